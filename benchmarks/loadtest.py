@@ -0,0 +1,396 @@
+"""Replay a mix of planner traffic against one in-process ASGI worker and report latencies.
+
+Builds a synthetic SQLite database in a temporary directory, serves
+``weekly_meals.asgi:application`` with uvicorn on a background thread and
+drives it with simulated users over keep-alive HTTP/1.1 connections. The
+traffic mix covers week page views, week navigation, bursts of cell edits,
+admin similar-meal searches and ``plan_with_ai`` with a stubbed model.
+Requests and data are generated from ``--seed``, so runs are comparable.
+The SQLite file runs in WAL mode with a busy timeout and transactions
+that take the write lock up front, so concurrent edit bursts queue for
+its single writer instead of failing; pass
+``--database-url`` with an empty, disposable PostgreSQL database to
+measure the production setup. Logs go to the temporary directory too:
+
+    python benchmarks/loadtest.py --users 20 --duration 30 --output before.json
+    python benchmarks/loadtest.py --users 20 --duration 30 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weekly_meals.settings')
+os.environ.setdefault('SECRET_KEY', 'loadtest')
+os.environ['DEBUG'] = 'False'
+os.environ['DATABASE_POOL'] = 'False'
+os.environ['CACHE_URL'] = 'locmemcache://'
+os.environ['MEAL_PLAN_LIVE_BACKEND'] = 'meals.live.LocalBackend'
+
+SQLITE_BUSY_TIMEOUT = 30
+CSRF_TOKEN = 'loadtestcsrftoken0123456789abcde'
+SEARCH_TERMS = ['chicken', 'salad', 'soup', 'pasta', 'curry', 'oat', 'rice', 'tofu', 'egg', 'stew']
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner', 'snack']
+
+# (scenario, weight); each scenario issues one or more labelled requests.
+SCENARIOS = [
+    ('week_page', 40),
+    ('week_navigation', 20),
+    ('edit_burst', 20),
+    ('admin_search', 12),
+    ('plan_with_ai', 8),
+]
+
+
+def configure(database_url, directory):
+    """Point Django at the load test database and keep its log files in ``directory``."""
+    os.environ['DATABASE_URL'] = database_url
+    from django.conf import settings
+
+    for handler in settings.LOGGING['handlers'].values():
+        if 'filename' in handler:
+            handler['filename'] = os.path.join(directory, os.path.basename(handler['filename']))
+    database = settings.DATABASES['default']
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        # Wait for the writer instead of failing with "database is locked".
+        database.setdefault('OPTIONS', {})['timeout'] = SQLITE_BUSY_TIMEOUT
+        # A deferred transaction that reads and then writes fails at once when
+        # another write landed in between, whatever the timeout. Taking the
+        # write lock up front queues transactions instead, as Django 5.1's
+        # "transaction_mode": "IMMEDIATE" option does.
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+        DatabaseWrapper._start_transaction_under_autocommit = lambda self: self.cursor().execute('BEGIN IMMEDIATE')
+
+    import django
+    django.setup()
+
+
+def setup_database(meals, weeks, seed):
+    from django.core.management import call_command
+    from django.db import connection
+    call_command('migrate', verbosity=0)
+    if connection.vendor == 'sqlite':
+        # Readers no longer block the writer; the mode is stored in the database file.
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+    from django.contrib.auth.models import User
+    from meals import rollups, search, usage
+    from meals.models import Meal, MealPlanEntry, Nutrition, Recipe, WeeklyMealPlan
+    from meals.utils import iter_iso_weeks
+
+    rng = random.Random(seed)
+    user = User.objects.create_superuser('admin', 'admin@example.com', 'loadtest')
+    Meal.objects.bulk_create([
+        Meal(
+            name=f'{rng.choice(SEARCH_TERMS).title()} {kind} {number}',
+            description=f'{rng.choice(SEARCH_TERMS)} with {rng.choice(SEARCH_TERMS)}',
+            meal_type=rng.choice(MEAL_TYPES),
+            created_by=user,
+        )
+        for number, kind in enumerate(rng.choice(['bowl', 'plate', 'wrap', 'bake']) for _ in range(meals))
+    ])
+    meal_ids = list(Meal.objects.values_list('id', flat=True))
+    Recipe.objects.bulk_create([
+        Recipe(meal_id=meal_id, ingredients='1 cup rice\n2 eggs\n1 onion', instructions='Cook.',
+               prep_time=rng.randint(5, 30), cook_time=rng.randint(5, 60), servings=rng.randint(1, 4))
+        for meal_id in meal_ids
+    ])
+    Nutrition.objects.bulk_create([
+        Nutrition(meal_id=meal_id, calories_per_serving=rng.randint(200, 900)) for meal_id in meal_ids
+    ])
+
+    today = date.today()
+    first = today - timedelta(weeks=weeks // 2)
+    year, week, _ = first.isocalendar()
+    plan_weeks = list(iter_iso_weeks(year, week, weeks))
+    WeeklyMealPlan.objects.bulk_create([
+        WeeklyMealPlan(user=user, year=y, week_number=w, name=f'Week of {start}') for y, w, start in plan_weeks
+    ])
+    plans = list(WeeklyMealPlan.objects.order_by('year', 'week_number').values_list('id', 'year', 'week_number'))
+    MealPlanEntry.objects.bulk_create([
+        MealPlanEntry(meal_plan_id=plan_id, day_of_week=day, meal_type=meal_type, meal_id=rng.choice(meal_ids))
+        for plan_id, _, _ in plans
+        for day in range(7)
+        for meal_type in MEAL_TYPES[:3]
+    ], batch_size=500)
+    rollups.rebuild_all()
+    search.update_documents()
+    usage.rebuild()
+
+    from django.test import Client
+    client = Client()
+    client.force_login(user)
+    return {
+        'session': client.cookies['sessionid'].value,
+        'plans': plans,
+        'meal_ids': meal_ids,
+    }
+
+
+class StubModel:
+    """Stands in for the Gemini model so plan_with_ai costs only its own work plus a fixed delay."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        return type('Response', (), {'text': f'Stub plan for a {len(prompt)} character prompt.', 'usage_metadata': None})
+
+
+def stub_ai(latency):
+    from meals import views
+    views.genai = type('StubGenAI', (), {
+        'configure': staticmethod(lambda **kwargs: None),
+        'GenerativeModel': staticmethod(lambda name: StubModel(latency)),
+    })
+
+
+def start_server():
+    """Serve the ASGI application on a background thread; returns (server, port)."""
+    import uvicorn
+    from weekly_meals.asgi import application
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1024)
+    server = uvicorn.Server(uvicorn.Config(application, lifespan='off', log_level='warning', access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, sock.getsockname()[1]
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client over asyncio streams."""
+
+    def __init__(self, port, cookies):
+        self.port = port
+        self.cookie = '; '.join(f'{name}={value}' for name, value in cookies.items())
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b'', headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        lines = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: 127.0.0.1:{self.port}',
+            f'Cookie: {self.cookie}',
+            f'Content-Length: {len(body)}',
+        ]
+        lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        response_headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode().partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding') == 'chunked':
+            while size := int((await self.reader.readline()).strip(), 16):
+                await self.reader.readexactly(size + 2)
+            await self.reader.readline()
+        else:
+            await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+        if response_headers.get('connection') == 'close':
+            await self.close()
+        return status
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class Recorder:
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.recording = False
+
+    async def timed(self, label, connection, method, path, body=b'', headers=None):
+        started = time.perf_counter()
+        try:
+            status = await connection.request(method, path, body, headers)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            await connection.close()
+            status = None
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.timings[label].append(elapsed)
+            if status is None or status >= 400:
+                self.errors[label][str(status or 'connection')] += 1
+
+
+def week_path(year, week):
+    return f'/weekly-plan/{year}/{week}/'
+
+
+async def run_scenario(name, rng, connection, recorder, data):
+    plan_id, year, week = rng.choice(data['plans'])
+    if name == 'week_page':
+        await recorder.timed('week_page', connection, 'GET', week_path(year, week))
+    elif name == 'week_navigation':
+        start = date.fromisocalendar(year, week, 1)
+        step = rng.choice([-7, 7])
+        for offset in range(rng.randint(2, 4)):
+            y, w, _ = (start + timedelta(days=step * offset)).isocalendar()
+            await recorder.timed('week_navigation', connection, 'GET', week_path(y, w))
+    elif name == 'edit_burst':
+        headers = {'Content-Type': 'application/json', 'X-CSRFToken': CSRF_TOKEN}
+        for _ in range(rng.randint(3, 8)):
+            body = json.dumps({
+                'meal_plan_id': plan_id,
+                'day_of_week': rng.randrange(7),
+                'meal_type': rng.choice(MEAL_TYPES),
+                'meal_id': rng.choice(data['meal_ids'] + [''] * 2),
+            }).encode()
+            await recorder.timed('update_meal_plan_entry', connection, 'POST', '/update-meal-entry/', body, headers)
+    elif name == 'admin_search':
+        query = urlencode({'q': rng.choice(SEARCH_TERMS)[:rng.randint(2, 6)]})
+        await recorder.timed('admin_search', connection, 'GET', f'/admin/meals/meal/search-similar/?{query}')
+    else:
+        body = urlencode({'prompt': 'More vegetarian dinners, quick lunches', 'csrfmiddlewaretoken': CSRF_TOKEN}).encode()
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        await recorder.timed('plan_with_ai', connection, 'POST', '/plan-with-ai/', body, headers)
+
+
+async def virtual_user(number, port, data, recorder, deadline, think, seed):
+    rng = random.Random(seed * 1000 + number)
+    names = [name for name, _ in SCENARIOS]
+    weights = [weight for _, weight in SCENARIOS]
+    connection = Connection(port, {'sessionid': data['session'], 'csrftoken': CSRF_TOKEN})
+    try:
+        while time.monotonic() < deadline:
+            await run_scenario(rng.choices(names, weights)[0], rng, connection, recorder, data)
+            if think:
+                await asyncio.sleep(rng.uniform(0, 2 * think))
+    finally:
+        await connection.close()
+
+
+async def drive(port, data, args):
+    recorder = Recorder()
+    loop_start = time.monotonic()
+    deadline = loop_start + args.warmup + args.duration
+    users = [
+        asyncio.create_task(virtual_user(number, port, data, recorder, deadline, args.think / 1000, args.seed))
+        for number in range(args.users)
+    ]
+    await asyncio.sleep(args.warmup)
+    recorder.recording = True
+    started = time.perf_counter()
+    await asyncio.gather(*users)
+    return recorder, time.perf_counter() - started
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for label, timings in sorted(recorder.timings.items()):
+        timings.sort()
+        endpoints[label] = {
+            'requests': len(timings),
+            'errors': sum(recorder.errors[label].values()),
+            'error_statuses': dict(recorder.errors[label]),
+            'requests_per_second': round(len(timings) / elapsed, 1),
+            'mean_ms': round(statistics.fmean(timings) * 1000, 2),
+            'p50_ms': round(percentile(timings, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+        'total': {
+            'requests': total,
+            'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+            'requests_per_second': round(total / elapsed, 1),
+        },
+        'endpoints': endpoints,
+    }
+
+
+def print_report(report, baseline=None):
+    columns = ['requests', 'errors', 'requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms']
+    print(f"{'endpoint':24}" + ''.join(f'{column.replace("_per_second", "/s"):>18}' for column in columns))
+    for label, endpoint in report['endpoints'].items():
+        before = (baseline or {}).get('endpoints', {}).get(label, {})
+        cells = []
+        for column in columns:
+            value = endpoint[column]
+            if column in before and before[column] and column not in ('requests', 'errors'):
+                value = f'{value} ({(value - before[column]) / before[column]:+.0%})'
+            cells.append(f'{value:>18}')
+        print(f'{label:24}' + ''.join(cells))
+    total = report['total']
+    print(f"total: {total['requests']} requests, {total['errors']} errors, {total['requests_per_second']} req/s")
+    if baseline:
+        changed = {
+            key: (baseline.get('config', {}).get(key), value)
+            for key, value in report['config'].items()
+            if baseline.get('config', {}).get(key) != value
+        }
+        if changed:
+            print(f'warning: the baseline ran with different options: {changed}')
+        before = baseline['total']['requests_per_second']
+        print(f"baseline: {before} req/s ({(total['requests_per_second'] - before) / before:+.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10, help="Concurrent simulated users.")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds of measured traffic.")
+    parser.add_argument('--warmup', type=float, default=3, help="Seconds of unmeasured traffic first.")
+    parser.add_argument('--think', type=float, default=0, help="Mean pause between a user's scenarios, in ms.")
+    parser.add_argument('--meals', type=int, default=300)
+    parser.add_argument('--weeks', type=int, default=26, help="Weeks of seeded plans around the current week.")
+    parser.add_argument('--ai-latency', type=float, default=0.2, help="Seconds the stubbed model takes to answer.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-url', help="Empty, disposable database to use instead of a temporary SQLite file.")
+    parser.add_argument('--output', help="Write the JSON report to this file.")
+    parser.add_argument('--compare', help="JSON report of an earlier run to compare against.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f'sqlite:///{os.path.join(directory, "loadtest.sqlite3")}'
+        configure(database_url, directory)
+        data = setup_database(args.meals, args.weeks, args.seed)
+        stub_ai(args.ai_latency)
+        server, thread, port = start_server()
+        try:
+            recorder, elapsed = asyncio.run(drive(port, data, args))
+        finally:
+            server.should_exit = True
+            thread.join()
+
+    report = summarize(recorder, elapsed)
+    report['config'] = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'database_url')}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
 from django.contrib import admin
-from .models import Meal, Recipe, Nutrition, WeeklyMealPlan, MealPlanEntry
+from .models import Meal, Recipe, Nutrition, WeeklyMealPlan, MealPlanEntry, MealPlanTemplate, MealPlanTemplateEntry
 from django import forms
 from django.utils import timezone
 from django.http import JsonResponse
 from django.urls import path
 from django.db.models import Q
+from .queries import query_budget
 
 
 class RecipeInline(admin.StackedInline):
@@ -25,6 +26,7 @@ class NutritionInline(admin.StackedInline):
 @admin.register(Meal)
 class MealAdmin(admin.ModelAdmin):
     list_display = ['name', 'search_similar_names_button', 'meal_type', 'get_total_time', 'get_servings', 'created_by', 'created_at']
+    list_select_related = ['created_by', 'recipe']
     list_filter = ['meal_type', 'created_by', 'created_at']
     search_fields = ['name', 'description']
     readonly_fields = ['created_at', 'updated_at']
@@ -38,6 +40,7 @@ class MealAdmin(admin.ModelAdmin):
         ]
         return custom_urls + urls
 
+    @query_budget(1)
     def search_similar_meals(self, request):
         """AJAX endpoint to search for similar meals"""
         query = request.GET.get('q', '').strip()
@@ -48,7 +51,7 @@ class MealAdmin(admin.ModelAdmin):
         # Search for similar meals using name and description
         similar_meals = Meal.objects.filter(
             Q(name__icontains=query) | Q(description__icontains=query)
-        ).select_related('created_by').prefetch_related('recipe', 'nutrition')[:10]
+        ).select_related('created_by', 'recipe', 'nutrition')[:10]
         
         meals_data = []
         for meal in similar_meals:
@@ -191,3 +194,27 @@ class WeeklyMealPlanAdmin(admin.ModelAdmin):
         if not obj.year:
             obj.year = timezone.now().year
         super().save_model(request, obj, form, change)
+
+
+class MealPlanTemplateEntryInline(admin.TabularInline):
+    model = MealPlanTemplateEntry
+    extra = 1
+    autocomplete_fields = ['meal']
+    fields = ['day_of_week', 'meal_type', 'meal', 'notes']
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return qs.select_related('meal')
+
+@admin.register(MealPlanTemplate)
+class MealPlanTemplateAdmin(admin.ModelAdmin):
+    list_display = ['name', 'user', 'updated_at']
+    list_filter = ['user']
+    search_fields = ['name', 'user__username']
+    readonly_fields = ['created_at', 'updated_at']
+    inlines = [MealPlanTemplateEntryInline]
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.user = request.user
+        super().save_model(request, obj, form, change)
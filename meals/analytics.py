@@ -0,0 +1,115 @@
+from datetime import date
+
+import numpy as np
+
+from .models import DailyNutritionRollup
+from .rollups import NUTRIENT_FIELDS
+
+NUTRIENTS = list(NUTRIENT_FIELDS)
+
+
+def _monday_ordinal(year, week):
+    return date.fromisocalendar(year, week, 1).toordinal()
+
+
+def load_daily_columns(user):
+    """Load a user's daily nutrition rollups as NumPy columns in a single query.
+
+    Returns ``(week_ordinal, day_of_week, entry_count, values)``, where
+    ``week_ordinal`` numbers weeks consecutively and ``values`` is a float
+    matrix with one column per nutrient, or None when the user has no
+    planned days.
+    """
+    rows = list(DailyNutritionRollup.objects.filter(user=user, entry_count__gt=0).values_list(
+        'year', 'week_number', 'day_of_week', 'entry_count', *NUTRIENTS
+    ))
+    if not rows:
+        return None
+
+    columns = list(zip(*rows))
+    week_keys = np.array(columns[0], dtype=np.int64) * 100 + np.array(columns[1], dtype=np.int64)
+    # Only the distinct weeks go through the calendar conversion.
+    unique_keys, inverse = np.unique(week_keys, return_inverse=True)
+    unique_ordinals = np.array(
+        [_monday_ordinal(int(key) // 100, int(key) % 100) for key in unique_keys], dtype=np.int64
+    )
+    week_ordinal = (unique_ordinals[inverse] - 1) // 7
+    day_of_week = np.array(columns[2], dtype=np.int64)
+    entry_count = np.array(columns[3], dtype=np.int64)
+    values = np.array(columns[4:], dtype=np.float64).T
+    return week_ordinal, day_of_week, entry_count, values
+
+
+def _rolling_mean(series, window):
+    """Trailing mean over ``window`` weeks, ignoring weeks without data (NaN)."""
+    present = ~np.isnan(series)
+    sums = np.cumsum(np.where(present, series, 0.0))
+    counts = np.cumsum(present)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _to_json(array, digits=2):
+    out = np.round(array, digits).astype(object)
+    out[np.isnan(array)] = None
+    return out.tolist()
+
+
+def nutrition_trends(user, window=4, targets=None):
+    """Compute weekly nutrition trends for a user.
+
+    For every week between the first and last planned week this returns
+    the weekly total, the average per planned day, a trailing rolling
+    average of that daily figure and its deviation from ``targets``
+    (per-day goals keyed by nutrient). Weeks without plans are None.
+    """
+    targets = targets or {}
+    columns = load_daily_columns(user)
+    if columns is None:
+        return {'weeks': [], 'window': window, 'nutrients': {}, 'day_of_week_average': {}}
+    week_ordinal, day_of_week, entry_count, values = columns
+
+    first_week = week_ordinal.min()
+    week_count = int(week_ordinal.max() - first_week + 1)
+    week_pos = week_ordinal - first_week
+
+    weekly_totals = np.zeros((week_count, len(NUTRIENTS)))
+    np.add.at(weekly_totals, week_pos, values)
+    planned_days = np.bincount(week_pos, minlength=week_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_average = np.where(planned_days[:, None] > 0, weekly_totals / planned_days[:, None], np.nan)
+    weekly_totals[planned_days == 0] = np.nan
+
+    weekday_totals = np.zeros((7, len(NUTRIENTS)))
+    np.add.at(weekday_totals, day_of_week, values)
+    weekday_counts = np.bincount(day_of_week, minlength=7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weekday_average = np.where(weekday_counts[:, None] > 0, weekday_totals / weekday_counts[:, None], np.nan)
+
+    nutrients = {}
+    for i, nutrient in enumerate(NUTRIENTS):
+        rolling = _rolling_mean(daily_average[:, i], window)
+        series = {
+            'total': _to_json(weekly_totals[:, i]),
+            'daily_average': _to_json(daily_average[:, i]),
+            'rolling_average': _to_json(rolling),
+        }
+        target = targets.get(nutrient)
+        if target:
+            deviation = daily_average[:, i] - target
+            series['target'] = target
+            series['deviation'] = _to_json(deviation)
+            series['deviation_pct'] = _to_json(deviation / target * 100, 1)
+        nutrients[nutrient] = series
+
+    week_starts = np.arange(first_week, first_week + week_count) * 7 + 1
+    return {
+        'weeks': [date.fromordinal(int(ordinal)).isoformat() for ordinal in week_starts],
+        'planned_days': planned_days.tolist(),
+        'entry_count': np.bincount(week_pos, weights=entry_count, minlength=week_count).astype(int).tolist(),
+        'window': window,
+        'nutrients': nutrients,
+        'day_of_week_average': {nutrient: _to_json(weekday_average[:, i]) for i, nutrient in enumerate(NUTRIENTS)},
+    }
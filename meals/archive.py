@@ -0,0 +1,146 @@
+"""Archival of old weekly plans.
+
+Plans older than the archive horizon are folded into one ArchivedWeek row
+each and removed from WeeklyMealPlan/MealPlanEntry, keeping the hot tables
+small. Derived data (nutrition rollups, meal usage stats) is left in
+place when a week is archived, and is recomputed from the archived slots
+by rebuilds and nutrition edits. Readers of plan entries also read
+``archived_weeks()``, so history views keep working.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import usage
+from .models import ArchivedWeek, Meal, MealPlanEntry, WeeklyMealPlan
+from .signals import entries_changed, maintenance_suppressed
+from .utils import iso_week_start
+
+MEAL_TYPES = [meal_type for meal_type, _ in MealPlanEntry.MEAL_TYPE_CHOICES]
+SLOT_COUNT = len(MealPlanEntry.DAYS_OF_WEEK) * len(MEAL_TYPES)
+
+
+def slot_index(day_of_week, meal_type):
+    return day_of_week * len(MEAL_TYPES) + MEAL_TYPES.index(meal_type)
+
+
+def weeks_before(horizon_weeks, field_prefix=''):
+    """Return a Q matching ISO weeks that start more than ``horizon_weeks`` before the current week."""
+    today = timezone.now().date()
+    cutoff = today - timedelta(days=today.weekday(), weeks=horizon_weeks)
+    year, week, _ = cutoff.isocalendar()
+    return Q(**{f'{field_prefix}year__lt': year}) | Q(**{f'{field_prefix}year': year, f'{field_prefix}week_number__lt': week})
+
+
+def archived_weeks(user):
+    """Return a queryset of the user's archived weeks that have no live plan.
+
+    A week planned again after it was archived is read from its live plan,
+    as on the weekly plan page.
+    """
+    live = WeeklyMealPlan.objects.filter(user=user, year=OuterRef('year'), week_number=OuterRef('week_number'))
+    return ArchivedWeek.objects.filter(user=user).exclude(Exists(live))
+
+
+def archive_plans(plans):
+    """Fold the given WeeklyMealPlan objects into ArchivedWeek rows and delete them. Returns the count."""
+    plans = list(plans)
+    if not plans:
+        return 0
+    archived = {
+        plan.id: ArchivedWeek(
+            user_id=plan.user_id,
+            year=plan.year,
+            week_number=plan.week_number,
+            name=plan.name,
+            slots=[None] * SLOT_COUNT,
+            notes={},
+            created_at=plan.created_at,
+        )
+        for plan in plans
+    }
+    # Later entries win when a slot holds more than one, as on the planner page.
+    entries = MealPlanEntry.objects.filter(meal_plan__in=plans).order_by('id').values_list(
+        'meal_plan_id', 'day_of_week', 'meal_type', 'meal_id', 'notes'
+    )
+    dropped = []
+    for plan_id, day, meal_type, meal_id, notes in entries:
+        if meal_type not in MEAL_TYPES:
+            continue
+        index = slot_index(day, meal_type)
+        week = archived[plan_id]
+        if week.slots[index] is not None:
+            dropped.append((week.user_id, week.slots[index], meal_type, iso_week_start(week.year, week.week_number)))
+        week.slots[index] = meal_id
+        if notes:
+            week.notes[str(index)] = notes
+
+    with transaction.atomic(), maintenance_suppressed():
+        ArchivedWeek.objects.bulk_create(
+            archived.values(),
+            update_conflicts=True,
+            unique_fields=['user', 'year', 'week_number'],
+            update_fields=['name', 'slots', 'notes', 'created_at', 'archived_at'],
+        )
+        WeeklyMealPlan.objects.filter(id__in=archived.keys()).delete()
+        usage.slots_dropped(dropped)
+    return len(archived)
+
+
+def restore_weeks(archived_weeks):
+    """Move ArchivedWeek rows back into WeeklyMealPlan/MealPlanEntry. Returns the count.
+
+    If a week has been planned again since it was archived, the archived
+    meals only fill that plan's empty slots.
+    """
+    archived_weeks = list(archived_weeks)
+    if not archived_weeks:
+        return 0
+    meal_ids = {meal_id for week in archived_weeks for meal_id in week.slots if meal_id is not None}
+    existing_meals = set(Meal.objects.filter(id__in=meal_ids).values_list('id', flat=True))
+    week_filter = Q()
+    for week in archived_weeks:
+        week_filter |= Q(user_id=week.user_id, year=week.year, week_number=week.week_number)
+
+    with transaction.atomic():
+        WeeklyMealPlan.objects.bulk_create(
+            [
+                WeeklyMealPlan(
+                    user_id=week.user_id,
+                    year=week.year,
+                    week_number=week.week_number,
+                    name=week.name,
+                    created_at=week.created_at,
+                )
+                for week in archived_weeks
+            ],
+            ignore_conflicts=True,
+        )
+        plans = {
+            (plan.user_id, plan.year, plan.week_number): plan
+            for plan in WeeklyMealPlan.objects.filter(week_filter)
+        }
+        occupied = set(MealPlanEntry.objects.filter(meal_plan__in=plans.values()).values_list(
+            'meal_plan_id', 'day_of_week', 'meal_type'
+        ))
+        entries, dropped = [], []
+        for week in archived_weeks:
+            plan = plans[(week.user_id, week.year, week.week_number)]
+            week_start = iso_week_start(week.year, week.week_number)
+            for day, meal_type, meal_id, notes in week.slot_entries():
+                if meal_id not in existing_meals:
+                    continue
+                if (plan.id, day, meal_type) in occupied:
+                    dropped.append((week.user_id, meal_id, meal_type, week_start))
+                else:
+                    entries.append(MealPlanEntry(
+                        meal_plan=plan, day_of_week=day, meal_type=meal_type, meal_id=meal_id, notes=notes,
+                    ))
+        MealPlanEntry.objects.bulk_create(entries, batch_size=500)
+        # Restored entries were counted while archived; only the dropped slots change the usage stats.
+        usage.slots_dropped(dropped)
+        ArchivedWeek.objects.filter(id__in=[week.id for week in archived_weeks]).delete()
+        entries_changed({(entry.meal_plan_id, entry.day_of_week) for entry in entries})
+    return len(archived_weeks)
@@ -0,0 +1,384 @@
+"""Streaming bulk import and export of meals (with recipe and nutrition) and plan entries.
+
+Exports are generators over ``.iterator()`` querysets and imports work in
+fixed-size chunks with ``bulk_create``, so memory use does not grow with
+the number of rows. Plan exports include archived weeks. Both JSON Lines
+and CSV are supported.
+"""
+import csv
+import heapq
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import ingredients, search, usage
+from .archive import SLOT_COUNT, archived_weeks
+from .models import Meal, MealPlanEntry, Nutrition, Recipe
+from .planning import ensure_weekly_plans
+from .signals import deferred_maintenance, entries_changed, meals_changed, nutrition_changed
+from .utils import iso_week_start
+
+FORMATS = ('jsonl', 'csv')
+CONFLICT_MODES = ('skip', 'update')
+CHUNK_SIZE = 1000
+MAX_INTEGER = 2 ** 31 - 1
+
+MEAL_FIELDS = ['name', 'description', 'meal_type']
+RECIPE_FIELDS = ['ingredients', 'instructions', 'prep_time', 'cook_time', 'servings', 'difficulty']
+NUTRITION_FIELDS = [
+    'calories_per_serving', 'protein_grams', 'carbs_grams', 'fat_grams', 'fiber_grams', 'sugar_grams', 'sodium_mg',
+]
+PLAN_FIELDS = ['year', 'week_number', 'day_of_week', 'meal_type', 'meal', 'notes']
+
+KINDS = {
+    'meals': MEAL_FIELDS + RECIPE_FIELDS + NUTRITION_FIELDS,
+    'plans': PLAN_FIELDS,
+}
+
+
+class RowError(ValueError):
+    """Raised for a row that cannot be imported; the message names the problem."""
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+# Export
+
+def _archived_plan_rows(user):
+    """Yield the user's archived plan slots as export rows, in week and day order."""
+    weeks = archived_weeks(user).order_by('year', 'week_number').iterator(chunk_size=CHUNK_SIZE)
+    for chunk in _chunks(weeks, CHUNK_SIZE // SLOT_COUNT):
+        meal_names = dict(Meal.objects.filter(
+            id__in={meal_id for week in chunk for _, _, meal_id, _ in week.slot_entries()}
+        ).values_list('id', 'name'))
+        for week in chunk:
+            for day, meal_type, meal_id, notes in week.slot_entries():
+                if meal_id in meal_names:
+                    yield week.year, week.week_number, day, meal_type, meal_names[meal_id], notes
+
+
+def export_rows(kind, user):
+    """Yield the user's meals or plan entries as dicts with the fields of ``KINDS[kind]``."""
+    if kind == 'meals':
+        columns = MEAL_FIELDS + [f'recipe__{f}' for f in RECIPE_FIELDS] + [f'nutrition__{f}' for f in NUTRITION_FIELDS]
+        rows = Meal.objects.filter(created_by=user).order_by('id').values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+    else:
+        entries = MealPlanEntry.objects.filter(meal_plan__user=user).order_by(
+            'meal_plan__year', 'meal_plan__week_number', 'day_of_week', 'id'
+        ).values_list(
+            'meal_plan__year', 'meal_plan__week_number', 'day_of_week', 'meal_type', 'meal__name', 'notes'
+        )
+        rows = heapq.merge(
+            entries.iterator(chunk_size=CHUNK_SIZE), _archived_plan_rows(user), key=lambda row: row[:3],
+        )
+    fields = KINDS[kind]
+    for row in rows:
+        yield dict(zip(fields, row))
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def render_rows(rows, kind, fmt):
+    """Serialize export rows lazily as JSON Lines or CSV text chunks."""
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps({k: v for k, v in row.items() if v is not None}, default=_json_default) + '\n'
+        return
+    writer = csv.writer(_Echo())
+    fields = KINDS[kind]
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(['' if row[field] is None else row[field] for field in fields])
+
+
+# Import
+
+def parse_records(lines, fmt):
+    """Yield (line_number, dict) records from text lines in JSON Lines or CSV format."""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, {k: v for k, v in record.items() if k and v not in (None, '')}
+        return
+    for line_number, line in enumerate(lines, start=1):
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, e
+                continue
+            yield line_number, record if isinstance(record, dict) else RowError('expected a JSON object')
+
+
+def _integer(record, field, default=None):
+    value = record.get(field, default)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be an integer')
+    # Every imported integer is stored in a PositiveIntegerField.
+    if not 0 <= value <= MAX_INTEGER:
+        raise RowError(f'{field} must be between 0 and {MAX_INTEGER}')
+    return value
+
+
+def _decimal(record, field):
+    value = record.get(field)
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise RowError(f'{field} must be a number')
+
+
+def _choice(value, choices, field):
+    if value not in {key for key, _ in choices}:
+        raise RowError(f'{field} must be one of {", ".join(key for key, _ in choices)}')
+    return value
+
+
+def _text(record, field):
+    value = record.get(field, '')
+    if not isinstance(value, str):
+        raise RowError(f'{field} must be text')
+    return value
+
+
+def _validate(instance, record, fields):
+    """Check the fields a record carries against the model's own validation (ranges, digits, choices)."""
+    carried = set(_carried(record, fields))
+    try:
+        instance.clean_fields(exclude=[field.name for field in instance._meta.fields if field.name not in carried])
+    except ValidationError as e:
+        raise RowError('; '.join(
+            f'{field} {" ".join(messages).lower()}' for field, messages in e.message_dict.items()
+        ))
+    return instance
+
+
+def _meal_from_record(record, user):
+    """Build the unsaved meal, recipe and nutrition of a record, raising RowError for invalid values."""
+    name = str(record.get('name', '')).strip()
+    if not name:
+        raise RowError('name is required')
+    meal = _validate(Meal(
+        name=name[:200],
+        description=_text(record, 'description'),
+        meal_type=_choice(record.get('meal_type'), Meal.MEAL_TYPES, 'meal_type'),
+        created_by=user,
+    ), record, MEAL_FIELDS)
+    recipe = None
+    if any(field in record for field in RECIPE_FIELDS):
+        recipe = Recipe(
+            ingredients=_text(record, 'ingredients'),
+            instructions=_text(record, 'instructions'),
+            prep_time=_integer(record, 'prep_time', 0),
+            cook_time=_integer(record, 'cook_time', 0),
+            servings=_integer(record, 'servings', 1),
+            difficulty=_choice(record.get('difficulty', 'easy'), Recipe._meta.get_field('difficulty').choices, 'difficulty'),
+        )
+        _validate(recipe, record, RECIPE_FIELDS)
+    nutrition = None
+    if any(field in record for field in NUTRITION_FIELDS):
+        nutrition = _validate(Nutrition(
+            calories_per_serving=_integer(record, 'calories_per_serving'),
+            **{field: _decimal(record, field) for field in NUTRITION_FIELDS[1:]},
+        ), record, NUTRITION_FIELDS)
+    return meal, recipe, nutrition
+
+
+def _carried(record, fields):
+    return [field for field in fields if field in record]
+
+
+def _import_meal_chunk(records, user, on_conflict, stats):
+    parsed = {}
+    for line_number, record in records:
+        try:
+            if isinstance(record, Exception):
+                raise RowError(str(record))
+            meal, recipe, nutrition = _meal_from_record(record, user)
+        except RowError as e:
+            stats['errors'].append({'line': line_number, 'error': str(e)})
+            continue
+        parsed[meal.name] = (line_number, record, meal, recipe, nutrition)
+    if not parsed:
+        return
+
+    with transaction.atomic():
+        # Meal names are unique across users; another user's meal is never overwritten.
+        stored = {
+            meal.name: meal
+            for meal in Meal.objects.filter(name__in=parsed).select_related('recipe', 'nutrition')
+        }
+        for name, meal in stored.items():
+            if meal.created_by_id != user.id:
+                line_number = parsed.pop(name)[0]
+                stats['errors'].append({'line': line_number, 'error': f'meal {name!r} belongs to another user'})
+        existing = set(parsed) & set(stored)
+
+        Meal.objects.bulk_create(
+            [meal for name, (_, _, meal, _, _) in parsed.items() if name not in existing],
+            ignore_conflicts=True,
+        )
+        created = set(Meal.objects.filter(
+            name__in=set(parsed) - existing, created_by=user
+        ).values_list('name', 'id'))
+        new_recipes, new_nutritions = [], []
+        for name, meal_id in created:
+            _, _, _, recipe, nutrition = parsed[name]
+            if recipe is not None:
+                recipe.meal_id = meal_id
+                new_recipes.append(recipe)
+            if nutrition is not None:
+                nutrition.meal_id = meal_id
+                new_nutritions.append(nutrition)
+
+        # Updates only change the fields a record carries.
+        updated = existing if on_conflict == 'update' else set()
+        meals, recipes, nutritions = [], [], []
+        for name in updated:
+            _, record, imported_meal, imported_recipe, imported_nutrition = parsed[name]
+            meal = stored[name]
+            for field in _carried(record, MEAL_FIELDS[1:]):
+                setattr(meal, field, getattr(imported_meal, field))
+            meal.updated_at = timezone.now()
+            meals.append(meal)
+            for imported, current, fields, new_rows, changed_rows in [
+                (imported_recipe, getattr(meal, 'recipe', None), RECIPE_FIELDS, new_recipes, recipes),
+                (imported_nutrition, getattr(meal, 'nutrition', None), NUTRITION_FIELDS, new_nutritions, nutritions),
+            ]:
+                if imported is None:
+                    continue
+                if current is None:
+                    imported.meal_id = meal.id
+                    new_rows.append(imported)
+                    continue
+                for field in _carried(record, fields):
+                    setattr(current, field, getattr(imported, field))
+                changed_rows.append(current)
+        Meal.objects.bulk_update(meals, MEAL_FIELDS[1:] + ['updated_at'])
+        Recipe.objects.bulk_create(new_recipes)
+        Recipe.objects.bulk_update(recipes, RECIPE_FIELDS)
+        Nutrition.objects.bulk_create(new_nutritions)
+        Nutrition.objects.bulk_update(nutritions, NUTRITION_FIELDS)
+
+        # Bulk writes skip model signals, so refresh the derived data here.
+        written_ids = [meal_id for _, meal_id in created] + [stored[name].id for name in updated]
+        ingredients.reparse_recipes(new_recipes + recipes)
+        search.update_documents(written_ids)
+        meals_changed()
+        nutrition_updated = [stored[name].id for name in updated if parsed[name][4] is not None]
+        if nutrition_updated:
+            nutrition_changed(nutrition_updated)
+
+    stats['created'] += len(created)
+    stats['updated'] += len(updated)
+    stats['skipped'] += len(parsed) - len(created) - len(updated)
+
+
+def _import_plan_chunk(records, user, on_conflict, stats):
+    parsed = {}
+    for line_number, record in records:
+        try:
+            if isinstance(record, Exception):
+                raise RowError(str(record))
+            year = _integer(record, 'year')
+            week = _integer(record, 'week_number', record.get('week'))
+            day = _integer(record, 'day_of_week')
+            if year is None or week is None or day not in range(7):
+                raise RowError('year, week_number and day_of_week (0-6) are required')
+            try:
+                week_start = iso_week_start(year, week)
+            except ValueError:
+                raise RowError(f'{year}-W{week} is not an ISO week')
+            meal_type = _choice(record.get('meal_type'), MealPlanEntry.MEAL_TYPE_CHOICES, 'meal_type')
+            meal_name = str(record.get('meal', '')).strip()
+            if not meal_name:
+                raise RowError('meal is required')
+            notes = _text(record, 'notes')
+        except RowError as e:
+            stats['errors'].append({'line': line_number, 'error': str(e)})
+            continue
+        parsed[(year, week, day, meal_type)] = (week_start, meal_name, notes, line_number)
+    if not parsed:
+        return
+
+    meal_ids = dict(Meal.objects.filter(
+        name__in={meal_name for _, meal_name, _, _ in parsed.values()}, created_by=user
+    ).values_list('name', 'id'))
+    for key, (_, meal_name, _, line_number) in list(parsed.items()):
+        if meal_name not in meal_ids:
+            stats['errors'].append({'line': line_number, 'error': f'unknown meal {meal_name!r}'})
+            del parsed[key]
+
+    with transaction.atomic(), deferred_maintenance():
+        weeks = sorted({(year, week, week_start) for (year, week, _, _), (week_start, _, _, _) in parsed.items()})
+        plans = {(plan.year, plan.week_number): plan for plan in ensure_weekly_plans(user, weeks)}
+        occupied = set(MealPlanEntry.objects.filter(meal_plan__in=plans.values()).values_list(
+            'meal_plan_id', 'day_of_week', 'meal_type'
+        ))
+        new_entries = []
+        for (year, week, day, meal_type), (_, meal_name, notes, _) in parsed.items():
+            plan = plans[(year, week)]
+            if (plan.id, day, meal_type) in occupied:
+                if on_conflict == 'skip':
+                    stats['skipped'] += 1
+                    continue
+                stats['updated'] += 1
+            else:
+                stats['created'] += 1
+            new_entries.append(MealPlanEntry(
+                meal_plan=plan, day_of_week=day, meal_type=meal_type, meal_id=meal_ids[meal_name], notes=notes,
+            ))
+        if on_conflict == 'update':
+            replaced = {(entry.meal_plan_id, entry.day_of_week, entry.meal_type) for entry in new_entries} & occupied
+            if replaced:
+                stored = MealPlanEntry.objects.filter(meal_plan__in=plans.values()).values_list(
+                    'id', 'meal_plan_id', 'day_of_week', 'meal_type'
+                )
+                MealPlanEntry.objects.filter(
+                    id__in=[entry_id for entry_id, *slot in stored if tuple(slot) in replaced]
+                ).delete()
+        MealPlanEntry.objects.bulk_create(new_entries, batch_size=500)
+        usage.entries_added(new_entries)
+        entries_changed({(entry.meal_plan_id, entry.day_of_week) for entry in new_entries})
+
+
+def import_records(records, kind, user, on_conflict='skip', chunk_size=CHUNK_SIZE):
+    """Import (line_number, record) pairs chunk by chunk and return counts plus per-line errors.
+
+    Meals conflict on ``Meal.name``; plan entries conflict on their slot.
+    ``skip`` keeps what is already stored and ``update`` overwrites it with
+    the fields each record carries. A meal name used by another user is a
+    row error, as is a plan entry naming a meal the user does not own.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f'Unknown conflict mode {on_conflict!r}')
+    import_chunk = _import_meal_chunk if kind == 'meals' else _import_plan_chunk
+    stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+    for chunk in _chunks(records, chunk_size):
+        import_chunk(chunk, user, on_conflict, stats)
+    return stats
@@ -0,0 +1,50 @@
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _version_key(scope, key):
+    return f'meals:version:{scope}:{key}'
+
+
+def _fresh_version():
+    # Start from the clock so a version evicted from the cache is never reused.
+    return time.time_ns() // 1000
+
+
+def get_version(scope, key):
+    """Return the current cache version for an object, e.g. ``get_version('user', user.id)``."""
+    version_key = _version_key(scope, key)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, _fresh_version(), None)
+        version = cache.get(version_key)
+    return version
+
+
+async def aget_version(scope, key):
+    """Async version of get_version()."""
+    version_key = _version_key(scope, key)
+    version = await cache.aget(version_key)
+    if version is None:
+        await cache.aadd(version_key, _fresh_version(), None)
+        version = await cache.aget(version_key)
+    return version
+
+
+def bump_version(scope, key):
+    """Invalidate everything cached under the current version of an object once the transaction commits.
+
+    Bumping earlier would let a request that reads the pre-commit data cache
+    it under the new version, where it would outlive the commit.
+    """
+    transaction.on_commit(partial(_bump, _version_key(scope, key)))
+
+
+def _bump(version_key):
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.add(version_key, _fresh_version(), None)
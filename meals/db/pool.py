@@ -0,0 +1,212 @@
+"""A small thread-safe connection pool, one per worker process and database alias.
+
+Connections are handed out most recently used first, health-checked on
+checkout and replaced once older than ``max_lifetime`` seconds. The pool
+opens up to ``max_size`` connections; callers wait up to ``timeout``
+seconds when all are in use. The first checkout also starts a background
+thread that opens connections up to ``min_size``, so the requests that
+follow find them ready instead of connecting themselves; the pool is
+topped up the same way whenever a checkout finds it below ``min_size``.
+Expired idle connections beyond ``min_size`` are closed as soon as they
+are noticed rather than on their next checkout.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the pool timeout."""
+
+
+class ConnectionPool:
+    def __init__(self, connect, check=None, reset=None, is_usable=None,
+                 min_size=1, max_size=10, max_lifetime=3600, timeout=10):
+        self._connect = connect
+        self._check = check
+        self._reset = reset
+        self._is_usable = is_usable or (lambda conn: True)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._opened_at = {}
+        self._in_use = 0
+        self._filling = False
+        self._metrics = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'failed_checks': 0,
+            'expired': 0,
+        }
+
+    @property
+    def size(self):
+        return len(self._idle) + self._in_use
+
+    def _expired(self, conn):
+        return time.monotonic() - self._opened_at[id(conn)] > self.max_lifetime
+
+    def _discard(self, conn):
+        """Close a connection that is no longer counted by the pool."""
+        self._opened_at.pop(id(conn), None)
+        self._metrics['connections_closed'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opened_at[id(conn)] = time.monotonic()
+            self._metrics['connections_opened'] += 1
+        return conn
+
+    def _start_fill(self):
+        """Top the pool up to ``min_size`` in the background; called with the lock held."""
+        if self._filling or self.size >= min(self.min_size, self.max_size):
+            return
+        self._filling = True
+        threading.Thread(target=self._fill, name='db-pool-fill', daemon=True).start()
+
+    def _fill(self):
+        try:
+            while True:
+                with self._cond:
+                    if self.size >= min(self.min_size, self.max_size):
+                        return
+                    # Reserve the slot the way a checkout does, so concurrent
+                    # checkouts never push the pool past max_size.
+                    self._in_use += 1
+                try:
+                    conn = self._open()
+                except Exception:
+                    # _open released the slot; the next checkout tries again.
+                    return
+                with self._cond:
+                    self._in_use -= 1
+                    self._idle.append(conn)
+                    self._cond.notify()
+        finally:
+            with self._cond:
+                self._filling = False
+
+    def getconn(self):
+        """Check out a healthy connection, opening one if the pool has room."""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                self._start_fill()
+                while not self._idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                    if not waited:
+                        waited = True
+                        self._metrics['waits'] += 1
+                    started = time.monotonic()
+                    self._cond.wait(remaining)
+                    self._metrics['wait_seconds'] += time.monotonic() - started
+                self._in_use += 1
+                self._metrics['checkouts'] += 1
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._open()
+            if self._expired(conn):
+                self._metrics['expired'] += 1
+            elif self._is_usable(conn) and self._healthy(conn):
+                return conn
+            with self._cond:
+                self._in_use -= 1
+                self._metrics['checkouts'] -= 1
+                self._discard(conn)
+
+    def _healthy(self, conn):
+        if self._check is None:
+            return True
+        try:
+            self._check(conn)
+        except Exception:
+            self._metrics['failed_checks'] += 1
+            return False
+        return True
+
+    def putconn(self, conn):
+        """Return a checked-out connection, closing it if it is broken or expired."""
+        expired = self._expired(conn)
+        keep = self._is_usable(conn) and not expired
+        if keep and self._reset is not None:
+            try:
+                self._reset(conn)
+            except Exception:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append(conn)
+            else:
+                self._metrics['expired'] += expired
+                self._discard(conn)
+            # The least recently used idle connections sit at the left end.
+            while len(self._idle) > self.min_size and self._idle and self._expired(self._idle[0]):
+                self._metrics['expired'] += 1
+                self._discard(self._idle.popleft())
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.popleft())
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pid': os.getpid(),
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self._metrics,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_or_create_pool(alias, factory):
+    """Return this process's pool for a database alias, building it with ``factory()`` on first use.
+
+    Pools are keyed by process id, so a pool created before a fork is never shared.
+    """
+    key = (os.getpid(), alias)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = factory()
+    return pool
+
+
+def pool_stats():
+    """Return the metrics of every pool in this process, keyed by database alias."""
+    pid = os.getpid()
+    return {alias: pool.stats() for (owner, alias), pool in list(_pools.items()) if owner == pid}
@@ -0,0 +1,62 @@
+"""PostgreSQL backend that checks connections out of a per-process pool.
+
+Use it as the ``ENGINE`` of a database and configure the pool under the
+database's ``POOL`` key (``min_size``, ``max_size``, ``max_lifetime``,
+``timeout``, ``check``). Django's ``close()`` at the end of each request
+returns the connection to the pool instead of closing it, so keep
+``CONN_MAX_AGE`` at 0.
+"""
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from meals.db.pool import ConnectionPool, get_or_create_pool
+
+# libpq's PGTransactionStatusType values, shared by psycopg2 and psycopg 3.
+TRANSACTION_IDLE = 0
+TRANSACTION_UNKNOWN = 4
+
+
+def _check(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+def _is_usable(conn):
+    return not conn.closed and conn.info.transaction_status != TRANSACTION_UNKNOWN
+
+
+def _reset(conn):
+    # Anything left open by the request is rolled back before the next one sees it.
+    if conn.info.transaction_status != TRANSACTION_IDLE:
+        conn.rollback()
+
+
+def get_pool(wrapper, conn_params):
+    options = wrapper.settings_dict.get('POOL', {})
+    connect = super(DatabaseWrapper, wrapper).get_new_connection
+    return get_or_create_pool(wrapper.alias, lambda: ConnectionPool(
+        lambda: connect(conn_params),
+        check=_check if options.get('check', True) else None,
+        reset=_reset,
+        is_usable=_is_usable,
+        min_size=options.get('min_size', 1),
+        max_size=options.get('max_size', 10),
+        max_lifetime=options.get('max_lifetime', 3600),
+        timeout=options.get('timeout', 10),
+    ))
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        connection = get_pool(self, conn_params).getconn()
+        # The parent sets this while connecting, which only happens for some checkouts.
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = (
+            IsolationLevel.READ_COMMITTED if isolation_level is None else IsolationLevel(isolation_level)
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self, self.get_connection_params()).putconn(self.connection)
@@ -0,0 +1,154 @@
+"""Rendered HTML fragments of the weekly planner.
+
+The plan grid is cached per plan version (bumped whenever the plan's
+entries change) and meals version (bumped whenever a meal or recipe
+changes), so a warm planner page renders without touching the entry
+tables. Single cells are rendered with the same template for saves and
+live updates. The meal picker lists the user's most planned meals first,
+read from MealUsageStats, and is cached per meals and usage version.
+The meal list page's cards are cached per meals version.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .caching import aget_version, get_version
+from .models import Meal, MealPlanEntry, MealUsageStats
+
+# Meals are referenced by every plan, so one version covers all of them.
+MEALS_VERSION_KEY = 'all'
+FREQUENT_MEALS = 10
+
+
+def plan_grid_rows(entries):
+    """Arrange entries as ``[(meal_type, meal_type_display, [(day, entry or None), ...]), ...]``."""
+    # Later entries win when a slot holds more than one.
+    slots = {(entry.day_of_week, entry.meal_type): entry for entry in entries}
+    return [
+        (meal_type, meal_type_display, [(day, slots.get((day, meal_type))) for day, _ in MealPlanEntry.DAYS_OF_WEEK])
+        for meal_type, meal_type_display in MealPlanEntry.MEAL_TYPE_CHOICES
+    ]
+
+
+def render_cell(entry):
+    """Render the contents of one planner cell; ``entry`` needs ``meal__recipe`` loaded, or is None."""
+    return render_to_string('meals/_meal_cell.html', {'entry': entry})
+
+
+def render_grid(entries):
+    return render_to_string('meals/_plan_grid.html', {
+        'rows': plan_grid_rows(entries),
+        'days_of_week': MealPlanEntry.DAYS_OF_WEEK,
+    })
+
+
+def _plan_grid_key(plan_id, plan_version, meals_version):
+    return f'meals:plan-grid:{plan_id}:{plan_version}:{meals_version}'
+
+
+def _meal_select_key(user_id, meals_version, usage_version):
+    return f'meals:meal-select:{user_id}:{meals_version}:{usage_version}'
+
+
+def _meal_list_key(user_id, meals_version):
+    return f'meals:meal-list:{user_id}:{meals_version}'
+
+
+def _plan_entries(plan_id):
+    return MealPlanEntry.objects.filter(meal_plan_id=plan_id).select_related('meal__recipe').order_by('id')
+
+
+def _user_meals(user):
+    return Meal.objects.filter(created_by=user).order_by('name').values_list('id', 'name')
+
+
+def _frequent_meals(user):
+    return MealUsageStats.objects.filter(
+        user=user, meal__created_by=user, times_planned__gt=0
+    ).order_by('-times_planned', 'meal__name').values_list('meal_id', 'meal__name')[:FREQUENT_MEALS]
+
+
+def _meal_select_context(frequent_meals, meals):
+    # Each meal is offered once, so the frequent ones are left out of the full list.
+    frequent_ids = {meal_id for meal_id, _ in frequent_meals}
+    return {
+        'frequent_meals': frequent_meals,
+        'meals': [(meal_id, name) for meal_id, name in meals if meal_id not in frequent_ids],
+    }
+
+
+def _meal_cards(user):
+    return Meal.objects.filter(created_by=user).select_related('recipe').order_by('-created_at')
+
+
+def plan_grid_cache_key(plan_id):
+    return _plan_grid_key(plan_id, get_version('plan', plan_id), get_version('meals', MEALS_VERSION_KEY))
+
+
+def render_plan_grid(plan_id):
+    """Return the grid HTML of a saved plan, rendering and caching it on a miss."""
+    key = plan_grid_cache_key(plan_id)
+    html = cache.get(key)
+    if html is None:
+        html = render_grid(_plan_entries(plan_id))
+        cache.set(key, html, settings.PLANNER_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+def render_meal_select(user):
+    """Return the ``<template>`` holding the meal picker, cached per meals and usage version."""
+    key = _meal_select_key(user.id, get_version('meals', MEALS_VERSION_KEY), get_version('usage', user.id))
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('meals/_meal_select.html', _meal_select_context(
+            list(_frequent_meals(user)), _user_meals(user)
+        ))
+        cache.set(key, html, settings.PLANNER_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+def render_meal_list(user):
+    """Return the cards of the user's meals for the meal list page, cached per meals version."""
+    key = _meal_list_key(user.id, get_version('meals', MEALS_VERSION_KEY))
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('meals/_meal_list.html', {'meals': _meal_cards(user)})
+        cache.set(key, html, settings.PLANNER_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+async def arender_plan_grid(plan_id):
+    """Async version of render_plan_grid()."""
+    plan_version = await aget_version('plan', plan_id)
+    meals_version = await aget_version('meals', MEALS_VERSION_KEY)
+    key = _plan_grid_key(plan_id, plan_version, meals_version)
+    html = await cache.aget(key)
+    if html is None:
+        html = render_grid([entry async for entry in _plan_entries(plan_id)])
+        await cache.aset(key, html, settings.PLANNER_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+async def arender_meal_select(user):
+    """Async version of render_meal_select()."""
+    meals_version = await aget_version('meals', MEALS_VERSION_KEY)
+    usage_version = await aget_version('usage', user.id)
+    key = _meal_select_key(user.id, meals_version, usage_version)
+    html = await cache.aget(key)
+    if html is None:
+        html = render_to_string('meals/_meal_select.html', _meal_select_context(
+            [meal async for meal in _frequent_meals(user)], [meal async for meal in _user_meals(user)]
+        ))
+        await cache.aset(key, html, settings.PLANNER_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+async def arender_meal_list(user):
+    """Async version of render_meal_list()."""
+    key = _meal_list_key(user.id, await aget_version('meals', MEALS_VERSION_KEY))
+    html = await cache.aget(key)
+    if html is None:
+        html = render_to_string('meals/_meal_list.html', {'meals': [meal async for meal in _meal_cards(user)]})
+        await cache.aset(key, html, settings.PLANNER_CACHE_TIMEOUT)
+    return mark_safe(html)
@@ -0,0 +1,154 @@
+import re
+from collections import namedtuple
+from decimal import Decimal
+
+from .models import IngredientToken, RecipeIngredient
+
+ParsedIngredient = namedtuple('ParsedIngredient', ['quantity', 'unit', 'name', 'raw'])
+
+UNICODE_FRACTIONS = {
+    '¼': '1/4', '½': '1/2', '¾': '3/4', '⅓': '1/3', '⅔': '2/3',
+    '⅛': '1/8', '⅜': '3/8', '⅝': '5/8', '⅞': '7/8',
+}
+
+# Spelling -> (canonical unit, factor to convert the quantity into it).
+UNITS = {}
+for _unit, _factor, _aliases in [
+    ('g', 1, ['g', 'gm', 'gms', 'gram', 'grams']),
+    ('g', 1000, ['kg', 'kgs', 'kilo', 'kilos', 'kilogram', 'kilograms']),
+    ('ml', 1, ['ml', 'milliliter', 'milliliters', 'millilitre', 'millilitres']),
+    ('ml', 1000, ['l', 'liter', 'liters', 'litre', 'litres']),
+    ('tsp', 1, ['tsp', 'tsps', 'teaspoon', 'teaspoons']),
+    ('tbsp', 1, ['tbsp', 'tbsps', 'tbs', 'tablespoon', 'tablespoons']),
+    ('cup', 1, ['cup', 'cups']),
+    ('oz', 1, ['oz', 'ounce', 'ounces']),
+    ('lb', 1, ['lb', 'lbs', 'pound', 'pounds']),
+    ('pinch', 1, ['pinch', 'pinches']),
+    ('clove', 1, ['clove', 'cloves']),
+    ('can', 1, ['can', 'cans', 'tin', 'tins']),
+    ('bunch', 1, ['bunch', 'bunches']),
+    ('piece', 1, ['piece', 'pieces', 'pc', 'pcs']),
+]:
+    for _alias in _aliases:
+        UNITS[_alias] = (_unit, Decimal(_factor))
+
+QUANTITY_RE = re.compile(
+    r'^(?P<quantity>\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)(?:\s*(?:-|to)\s*\d+(?:[./]\d+)?)?\s*'
+)
+MAX_QUANTITY = Decimal(10) ** 7
+NOTE_RE = re.compile(r'\b(?:to taste|as needed|as required|optional|for garnish(?:ing)?)\b')
+# Words that describe an ingredient rather than name it; they are not indexed on their own.
+DESCRIPTIVE_WORDS = {
+    'a', 'an', 'and', 'or', 'of', 'the', 'with', 'fresh', 'dried', 'frozen', 'large', 'medium',
+    'small', 'big', 'chopped', 'diced', 'sliced', 'minced', 'grated', 'ground', 'whole', 'raw',
+    'cooked', 'boiled', 'peeled', 'finely', 'roughly', 'thinly', 'ripe', 'extra', 'virgin',
+}
+BULLET_RE = re.compile(r'^(?:[-*•]+|\d+[.)](?=\s))\s*')
+
+
+def _parse_quantity(text):
+    whole, _, fraction = text.rpartition(' ')
+    if '/' in fraction:
+        numerator, denominator = fraction.split('/')
+        if int(denominator) == 0:
+            return None
+        value = Decimal(numerator) / Decimal(denominator)
+        return value + Decimal(whole or 0)
+    return Decimal(text)
+
+
+def singularize(word):
+    """Crude English singular form, enough to group "onions" with "onion"."""
+    if len(word) > 3 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('oes'):
+        return word[:-2]
+    if len(word) > 2 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def normalize_name(text):
+    """Lowercase an ingredient name and drop preparation notes, e.g. "Onions, chopped" -> "onion"."""
+    text = re.sub(r'\([^)]*\)', ' ', text.lower())
+    text = NOTE_RE.sub(' ', text.split(',')[0])
+    words = re.findall(r"[a-z][a-z'-]*", text)
+    if words and words[0] == 'of':
+        words = words[1:]
+    if words:
+        words[-1] = singularize(words[-1])
+    return ' '.join(words)
+
+
+def parse_ingredient_line(line):
+    """Parse one free-text ingredient line into a ParsedIngredient, or None for blank/heading lines."""
+    raw = line.strip()
+    text = BULLET_RE.sub('', raw)
+    if not text or text.endswith(':'):
+        return None
+    for symbol, fraction in UNICODE_FRACTIONS.items():
+        text = re.sub(rf'(\d)\s*{symbol}', rf'\1 {fraction}', text).replace(symbol, fraction)
+
+    quantity = None
+    match = QUANTITY_RE.match(text)
+    if match:
+        quantity = _parse_quantity(' '.join(match.group('quantity').split()))
+        text = text[match.end():]
+
+    article, _, after_article = text.partition(' ')
+    if quantity is None and article.lower() in ('a', 'an') and after_article.partition(' ')[0].lower() in UNITS:
+        quantity = Decimal(1)
+        text = after_article
+
+    unit = ''
+    first, _, rest = text.partition(' ')
+    unit_key = first.lower().rstrip('.')
+    if quantity is not None and unit_key in UNITS:
+        unit, factor = UNITS[unit_key]
+        quantity *= factor
+        text = rest
+
+    name = normalize_name(text)
+    if not name:
+        return None
+    if quantity is not None and quantity >= MAX_QUANTITY:
+        quantity = None
+    return ParsedIngredient(quantity, unit, name, raw[:500])
+
+
+def ingredient_tokens(name):
+    """Return the index tokens of a normalized ingredient name: the full name plus each naming word."""
+    tokens = {name}
+    tokens.update(word for word in name.split() if word not in DESCRIPTIVE_WORDS and len(word) > 1)
+    return tokens
+
+
+def parse_ingredients(text):
+    """Parse a recipe's ingredient text into a list of ParsedIngredient."""
+    parsed = (parse_ingredient_line(line) for line in text.splitlines())
+    return [ingredient for ingredient in parsed if ingredient]
+
+
+def reparse_recipes(recipes):
+    """Replace the parsed ingredient rows and index tokens of the given Recipe objects."""
+    recipes = list(recipes)
+    if not recipes:
+        return
+    RecipeIngredient.objects.filter(recipe__in=recipes).delete()
+    parsed = RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(
+            recipe=recipe,
+            position=position,
+            quantity=None if ingredient.quantity is None else round(ingredient.quantity, 3),
+            unit=ingredient.unit,
+            name=ingredient.name[:200],
+            raw=ingredient.raw,
+        )
+        for recipe in recipes
+        for position, ingredient in enumerate(parse_ingredients(recipe.ingredients))
+    ], batch_size=500)
+    IngredientToken.objects.bulk_create([
+        IngredientToken(token=token, ingredient=ingredient, recipe_id=ingredient.recipe_id)
+        for ingredient in parsed
+        for token in ingredient_tokens(ingredient.name)
+    ], batch_size=500)
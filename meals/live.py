@@ -0,0 +1,241 @@
+"""Live plan updates pushed to open planner pages.
+
+After a transaction that changed plan entries commits, the new state of
+every cell on the changed days is published per plan. Subscribers are the
+server-sent event streams opened by the planner page; each process keeps
+them in an in-process ``Broker``. The backend named by the
+``MEAL_PLAN_LIVE_BACKEND`` setting carries messages to the brokers:
+``LocalBackend`` delivers within the process, ``PostgresNotifyBackend``
+fans out to every worker process over LISTEN/NOTIFY.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache, partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.module_loading import import_string
+
+from .fragments import render_cell
+from .models import MealPlanEntry
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+# Streams end after this long and the browser reconnects; this bounds how long
+# a stream outlives a client whose disconnect the server did not notice.
+STREAM_MAX_SECONDS = 300
+RETRY_MILLISECONDS = 3000
+# PostgreSQL rejects NOTIFY payloads of this many bytes or more.
+NOTIFY_PAYLOAD_BYTES = 8000
+
+RELOAD = {'type': 'reload'}
+
+
+class Broker:
+    """In-process pub/sub from plan ids to asyncio queues, safe to publish to from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, plan_id):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=QUEUE_SIZE))
+        with self._lock:
+            self._subscribers[plan_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, plan_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(plan_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[plan_id]
+
+    def has_subscribers(self, plan_id):
+        with self._lock:
+            return plan_id in self._subscribers
+
+    def deliver(self, plan_id, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(plan_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, message)
+            except RuntimeError:
+                # The subscriber's event loop has closed; its stream is gone.
+                pass
+
+    @staticmethod
+    def _put(queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A client this far behind gets one reload instead of the backlog.
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RELOAD)
+
+
+broker = Broker()
+
+
+class LocalBackend:
+    """Deliver messages to subscribers in the current process only."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def start(self):
+        pass
+
+    def wants(self, plan_id):
+        """Whether messages for the plan can reach anyone; lets publishers skip building them."""
+        return self.broker.has_subscribers(plan_id)
+
+    def publish(self, plan_id, message):
+        self.broker.deliver(plan_id, message)
+
+
+class PostgresNotifyBackend(LocalBackend):
+    """Fan messages out to every process through PostgreSQL NOTIFY on one channel.
+
+    Each process listens on a dedicated connection in a daemon thread,
+    started when its first stream opens.
+    """
+    channel = 'meals_plan_updates'
+    reconnect_seconds = 5
+
+    def __init__(self, broker, alias=DEFAULT_DB_ALIAS):
+        super().__init__(broker)
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='meals-live-listener', daemon=True)
+                self._thread.start()
+
+    def wants(self, plan_id):
+        return True
+
+    def publish(self, plan_id, message):
+        with connections[self.alias].cursor() as cursor:
+            for payload in self.payloads(plan_id, message):
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def payloads(self, plan_id, message):
+        """Encode a message as NOTIFY payloads that each fit under ``NOTIFY_PAYLOAD_BYTES``.
+
+        A cells message too large for one notification is sent one day at a
+        time; a day that is still too large becomes a reload.
+        """
+        payload = json.dumps({'plan_id': plan_id, 'message': message})
+        if len(payload.encode()) < NOTIFY_PAYLOAD_BYTES:
+            return [payload]
+        days = defaultdict(list)
+        for cell in message.get('cells', ()):
+            days[cell['day']].append(cell)
+        if len(days) < 2:
+            return [json.dumps({'plan_id': plan_id, 'message': RELOAD})]
+        return [
+            payload
+            for cells in days.values()
+            for payload in self.payloads(plan_id, {'type': 'cells', 'cells': cells})
+        ]
+
+    def _listen(self):
+        import psycopg2
+
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(**connections[self.alias].get_connection_params())
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                while True:
+                    if select.select([connection], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        data = json.loads(notify.payload)
+                        self.broker.deliver(data['plan_id'], data['message'])
+            except Exception:
+                logger.exception('Live update listener failed; reconnecting')
+                time.sleep(self.reconnect_seconds)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.MEAL_PLAN_LIVE_BACKEND)(broker)
+
+
+def plan_day_cells(plan_days):
+    """Return ``{plan_id: [cell, ...]}`` with the rendered state of every cell on the given plan days."""
+    plan_days = set(plan_days)
+    slots = {}
+    entries = MealPlanEntry.objects.filter(
+        meal_plan_id__in={plan_id for plan_id, _ in plan_days}, day_of_week__in={day for _, day in plan_days}
+    ).select_related('meal__recipe').order_by('id')
+    # Later entries win when a slot holds more than one, as on the planner page.
+    for entry in entries:
+        slots[(entry.meal_plan_id, entry.day_of_week, entry.meal_type)] = entry
+    grouped = defaultdict(list)
+    for plan_id, day in sorted(plan_days):
+        for meal_type, _ in MealPlanEntry.MEAL_TYPE_CHOICES:
+            entry = slots.get((plan_id, day, meal_type))
+            grouped[plan_id].append({'day': day, 'meal_type': meal_type, 'html': render_cell(entry)})
+    return grouped
+
+
+def _publish(plan_days):
+    try:
+        backend = get_backend()
+        plan_days = {(plan_id, day) for plan_id, day in plan_days if backend.wants(plan_id)}
+        if not plan_days:
+            return
+        for plan_id, cells in plan_day_cells(plan_days).items():
+            backend.publish(plan_id, {'type': 'cells', 'cells': cells})
+    except Exception:
+        # Live updates are best effort; the change itself has been committed.
+        logger.exception('Failed to publish live plan updates')
+
+
+def publish_plan_days(plan_days):
+    """Publish the cells of the given (meal_plan_id, day_of_week) pairs once the transaction commits."""
+    plan_days = set(plan_days)
+    if plan_days:
+        transaction.on_commit(partial(_publish, plan_days))
+
+
+async def event_stream(plan_id):
+    """Yield server-sent events for a plan's cell changes until ``STREAM_MAX_SECONDS`` pass."""
+    get_backend().start()
+    subscriber = broker.subscribe(plan_id)
+    _, queue = subscriber
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    try:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                message = await asyncio.wait_for(queue.get(), min(KEEPALIVE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield f'data: {json.dumps(message)}\n\n'
+    finally:
+        broker.unsubscribe(plan_id, subscriber)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from meals.archive import archive_plans, restore_weeks, weeks_before
+from meals.models import ArchivedWeek, WeeklyMealPlan
+
+
+def parse_iso_week(value):
+    try:
+        year, week = (int(part) for part in value.replace('W', '').split('-'))
+    except ValueError:
+        raise CommandError(f"Expected an ISO week like 2024-W05, got {value!r}")
+    return year, week
+
+
+class Command(BaseCommand):
+    help = "Archive weekly meal plans older than the archive horizon, or restore archived weeks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--weeks', type=int, default=settings.MEAL_PLAN_ARCHIVE_AFTER_WEEKS,
+            help="Archive plans whose week started more than this many weeks ago.",
+        )
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--restore', action='store_true', help="Restore archived weeks instead.")
+        parser.add_argument('--from', dest='from_week', help="First ISO week to restore, e.g. 2024-W01.")
+        parser.add_argument('--to', dest='to_week', help="Last ISO week to restore, e.g. 2024-W52.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['restore']:
+            weeks = ArchivedWeek.objects.all()
+            if options['from_week']:
+                year, week = parse_iso_week(options['from_week'])
+                weeks = weeks.filter(Q(year__gt=year) | Q(year=year, week_number__gte=week))
+            if options['to_week']:
+                year, week = parse_iso_week(options['to_week'])
+                weeks = weeks.filter(Q(year__lt=year) | Q(year=year, week_number__lte=week))
+            process, queryset, verb = restore_weeks, weeks, "Restored"
+        else:
+            if options['weeks'] < 1:
+                raise CommandError("--weeks must be at least 1")
+            process, queryset, verb = archive_plans, WeeklyMealPlan.objects.filter(weeks_before(options['weeks'])), "Archived"
+
+        total = 0
+        while True:
+            batch = list(queryset.order_by('year', 'week_number', 'id')[:batch_size])
+            if not batch:
+                break
+            total += process(batch)
+            self.stdout.write(f"{verb} {total} weeks...")
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} weeks."))
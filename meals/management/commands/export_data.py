@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from meals.bulk import FORMATS, KINDS, export_rows, render_rows
+from meals.utils import get_default_user
+
+
+class Command(BaseCommand):
+    help = "Stream meals (with recipes and nutrition) or plan entries as JSON Lines or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(KINDS))
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--output', '-o', default='-', help="File to write, or - for stdout.")
+
+    def handle(self, *args, **options):
+        user = get_default_user()
+        chunks = render_rows(export_rows(options['kind'], user), options['kind'], options['format'])
+        if options['output'] == '-':
+            sys.stdout.writelines(chunks)
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(chunks)
+        self.stderr.write(self.style.SUCCESS(f"Exported {options['kind']} to {options['output']}."))
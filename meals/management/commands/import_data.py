@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meals.bulk import CHUNK_SIZE, CONFLICT_MODES, FORMATS, KINDS, import_records, parse_records
+from meals.utils import get_default_user
+
+
+class Command(BaseCommand):
+    help = "Import meals (with recipes and nutrition) or plan entries from JSON Lines or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(KINDS))
+        parser.add_argument('path', help="File to read, or - for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else jsonl.")
+        parser.add_argument(
+            '--on-conflict', choices=CONFLICT_MODES, default='skip',
+            help="What to do with meals whose name (or plan slots that) already exist.",
+        )
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        user = get_default_user()
+
+        def run(lines):
+            return import_records(
+                parse_records(lines, fmt), options['kind'], user,
+                on_conflict=options['on_conflict'], chunk_size=options['chunk_size'],
+            )
+
+        if path == '-':
+            stats = run(sys.stdin)
+        else:
+            try:
+                with open(path, newline='', encoding='utf-8') as lines:
+                    stats = run(lines)
+            except OSError as e:
+                raise CommandError(str(e))
+
+        for error in stats['errors'][:20]:
+            self.stderr.write(f"Line {error['line']}: {error['error']}")
+        if len(stats['errors']) > 20:
+            self.stderr.write(f"... and {len(stats['errors']) - 20} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats['created']}, updated {stats['updated']}, skipped {stats['skipped']}, "
+            f"{len(stats['errors'])} errors."
+        ))
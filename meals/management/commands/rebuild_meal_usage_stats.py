@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from meals import usage
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-meal usage stats from all meal plan entries and archived weeks."
+
+    def handle(self, *args, **options):
+        count = usage.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt usage stats for {count} meals."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from meals import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-day nutrition rollups from all meal plan entries and archived weeks."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rollups.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} daily nutrition rollups."))
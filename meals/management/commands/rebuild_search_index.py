@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from meals import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of all meals and recipes."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.update_documents()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the meal search index."))
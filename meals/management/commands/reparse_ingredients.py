@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from meals.ingredients import reparse_recipes
+from meals.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Re-parse the ingredient text of every recipe and rebuild the ingredient index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipes = Recipe.objects.only('id', 'ingredients').order_by('id')
+        count = 0
+        batch = []
+        for recipe in recipes.iterator(chunk_size=batch_size):
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                with transaction.atomic():
+                    reparse_recipes(batch)
+                count += len(batch)
+                batch = []
+        with transaction.atomic():
+            reparse_recipes(batch)
+        count += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Parsed ingredients of {count} recipes."))
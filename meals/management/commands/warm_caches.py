@@ -0,0 +1,92 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from meals.fragments import render_meal_list, render_meal_select, render_plan_grid
+from meals.models import WeeklyMealPlan
+from meals.planning import ensure_plans_for_users
+from meals.utils import get_default_user, iter_iso_weeks
+
+# Django's MAX_ENTRIES when the cache OPTIONS do not set one.
+DEFAULT_MAX_ENTRIES = 300
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the current and upcoming weeks' plans for active users and pre-render their "
+        "planner and meal list fragments into the cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=1, help="Upcoming weeks to warm after the current one.")
+        parser.add_argument(
+            '--active-weeks', type=int, default=4,
+            help="Users with a plan in this many weeks before the current one count as active.",
+        )
+
+    def handle(self, *args, **options):
+        if 'locmem' in settings.CACHES['default']['BACKEND'].lower():
+            raise CommandError(
+                "The default cache is local to each process, so the web workers would never see "
+                "the warmed entries; set CACHE_URL to a shared cache."
+            )
+        today = timezone.now().date()
+        year, week, _ = today.isocalendar()
+        weeks = list(iter_iso_weeks(year, week, options['weeks'] + 1))
+        timings = {}
+
+        started = time.perf_counter()
+        users = self.active_users(today, options['active_weeks'])
+        plans = ensure_plans_for_users([user.id for user in users], weeks)
+        timings['plans'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for plan in plans:
+            render_plan_grid(plan.id)
+        timings['plan grids'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for user in users:
+            render_meal_select(user)
+            render_meal_list(user)
+        timings['meal pickers and lists'] = time.perf_counter() - started
+
+        # Each plan has a grid and a version key, each user a picker, a list
+        # and a usage version key; the meals version key is shared.
+        keys = 2 * len(plans) + 3 * len(users) + 1
+        for phase, seconds in timings.items():
+            self.stdout.write(f"{phase}: {seconds * 1000:.0f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {len(plans)} plans for {len(users)} users ({keys} cache keys) "
+            f"in {sum(timings.values()) * 1000:.0f} ms."
+        ))
+        self.check_max_entries(keys)
+
+    def check_max_entries(self, keys):
+        """Warn when a culling cache is too small to hold what was just warmed."""
+        config = settings.CACHES['default']
+        if not config['BACKEND'].endswith(('FileBasedCache', 'DatabaseCache')):
+            return
+        max_entries = config.get('OPTIONS', {}).get('MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        if keys > max_entries:
+            self.stderr.write(self.style.WARNING(
+                f"The cache culls entries beyond MAX_ENTRIES={max_entries}, fewer than the {keys} just "
+                f"warmed; raise it, e.g. with ?max_entries= on CACHE_URL."
+            ))
+
+    def active_users(self, today, active_weeks):
+        """Return users who planned a recent week, plus the default user the pages are served for."""
+        first_week = today - timedelta(days=today.weekday(), weeks=active_weeks)
+        year, week, _ = first_week.isocalendar()
+        recent_plans = WeeklyMealPlan.objects.filter(year__gt=year) | WeeklyMealPlan.objects.filter(
+            year=year, week_number__gte=week
+        )
+        users = list(User.objects.filter(is_active=True, id__in=recent_plans.values('user_id')))
+        default_user = get_default_user()
+        if default_user is not None and default_user.id not in {user.id for user in users}:
+            users.append(default_user)
+        return users
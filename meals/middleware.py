@@ -0,0 +1,83 @@
+import logging
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.middleware.gzip import GZipMiddleware
+
+from .queries import audit_queries
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_CONTENT_TYPES = {
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/plain',
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+}
+
+
+async def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """GZip HTML, JSON and other text responses, leaving everything else untouched.
+
+    Streamed responses (exports, the plan range stream) are compressed as
+    one gzip stream; for asynchronous ones Django 4.2 would compress every
+    chunk separately. The live plan events are not a compressible type,
+    since gzip would hold each event back until its buffer filled.
+    """
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in COMPRESSIBLE_CONTENT_TYPES:
+            return response
+        if response.streaming and response.is_async and not response.has_header('Content-Encoding'):
+            chunks = response.streaming_content
+            response = super().process_response(request, response)
+            if response.has_header('Content-Encoding'):
+                response.streaming_content = _gzip_stream(chunks)
+            return response
+        return super().process_response(request, response)
+
+
+class QueryAuditMiddleware:
+    """Log requests that repeat a query shape, with the call sites, as likely N+1 queries.
+
+    Meant for development; settings add it when ``QUERY_AUDIT`` is on.
+    The query count is also sent in an ``X-Query-Count`` header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with audit_queries() as audit:
+            response = self.get_response(request)
+        return self.report(request, response, audit)
+
+    async def __acall__(self, request):
+        with audit_queries() as audit:
+            response = await self.get_response(request)
+        return self.report(request, response, audit)
+
+    def report(self, request, response, audit):
+        response['X-Query-Count'] = str(audit.count)
+        repeated = audit.describe_repeated()
+        if repeated:
+            logger.warning('Repeated queries in %s %s: %s', request.method, request.path, repeated)
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('meals', '0006_alter_mealplanentry_unique_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyNutritionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('week_number', models.PositiveIntegerField()),
+                ('day_of_week', models.IntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('entry_count', models.PositiveIntegerField(default=0)),
+                ('calories', models.PositiveIntegerField(default=0)),
+                ('protein_grams', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('carbs_grams', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('fat_grams', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('fiber_grams', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('sugar_grams', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('sodium_mg', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'year', 'week_number', 'day_of_week')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0007_dailynutritionrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('quantity', models.DecimalField(blank=True, decimal_places=3, max_digits=10, null=True)),
+                ('unit', models.CharField(blank=True, help_text='Normalized unit, e.g. g, ml, tbsp', max_length=20)),
+                ('name', models.CharField(db_index=True, help_text='Normalized ingredient name', max_length=200)),
+                ('raw', models.CharField(help_text='Original ingredient line', max_length=500)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parsed_ingredients', to='meals.recipe')),
+            ],
+            options={
+                'ordering': ['recipe', 'position'],
+                'unique_together': {('recipe', 'position')},
+            },
+        ),
+    ]
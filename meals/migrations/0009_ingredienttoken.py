@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0008_recipeingredient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=200)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='meals.recipeingredient')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='meals.recipe')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'recipe'], name='meals_ingre_token_bacd3f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from meals.search import create_index
+    create_index(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    from meals.search import drop_index
+    drop_index(schema_editor)
+
+
+def populate_search_index(apps, schema_editor):
+    from meals.search import update_documents
+    if schema_editor.connection.alias == 'default':
+        update_documents()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0009_ingredienttoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('meals', '0011_mealplantemplate_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedWeek',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField()),
+                ('week_number', models.PositiveIntegerField()),
+                ('name', models.CharField(default='Weekly Meal Plan', max_length=100)),
+                ('slots', models.JSONField(help_text='Meal id per day and meal type slot')),
+                ('notes', models.JSONField(blank=True, default=dict, help_text='Entry notes keyed by slot index')),
+                ('created_at', models.DateTimeField(help_text='When the original plan was created')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'year', 'week_number')},
+            },
+        ),
+    ]
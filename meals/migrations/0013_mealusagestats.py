@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('meals', '0012_archivedweek'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MealUsageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('times_planned', models.PositiveIntegerField(default=0)),
+                ('breakfast_count', models.PositiveIntegerField(default=0)),
+                ('lunch_count', models.PositiveIntegerField(default=0)),
+                ('dinner_count', models.PositiveIntegerField(default=0)),
+                ('snack_count', models.PositiveIntegerField(default=0)),
+                ('last_planned_week_start', models.DateField(blank=True, help_text='Monday of the latest week the meal is planned in', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('meal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_stats', to='meals.meal')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'meal usage stats',
+                'indexes': [models.Index(fields=['user', '-times_planned'], name='meals_mealu_user_id_bcf8ba_idx'), models.Index(fields=['user', 'last_planned_week_start'], name='meals_mealu_user_id_d49f65_idx')],
+                'unique_together': {('user', 'meal')},
+            },
+        ),
+    ]
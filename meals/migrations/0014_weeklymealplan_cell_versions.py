@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0013_mealusagestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weeklymealplan',
+            name='cell_versions',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text="Latest planner edit version saved per cell, keyed by the editing page's client id"),
+        ),
+    ]
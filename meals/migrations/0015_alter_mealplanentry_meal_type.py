@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0014_weeklymealplan_cell_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mealplanentry',
+            name='meal_type',
+            field=models.CharField(choices=[('breakfast', 'Breakfast'), ('lunch', 'Lunch'), ('dinner', 'Dinner'), ('snack', 'Snack')], max_length=20),
+        ),
+    ]
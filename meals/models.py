@@ -58,6 +58,38 @@ class Recipe(models.Model):
         return self.prep_time + self.cook_time
 
 
+class RecipeIngredient(models.Model):
+    """Model representing one ingredient line of a recipe, parsed from its free-text ingredients."""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='parsed_ingredients')
+    position = models.PositiveIntegerField()
+    quantity = models.DecimalField(max_digits=10, decimal_places=3, null=True, blank=True)
+    unit = models.CharField(max_length=20, blank=True, help_text="Normalized unit, e.g. g, ml, tbsp")
+    name = models.CharField(max_length=200, db_index=True, help_text="Normalized ingredient name")
+    raw = models.CharField(max_length=500, help_text="Original ingredient line")
+
+    class Meta:
+        ordering = ['recipe', 'position']
+        unique_together = ['recipe', 'position']
+
+    def __str__(self):
+        if self.quantity is None:
+            return self.name
+        return ' '.join(part for part in [f"{self.quantity.normalize():f}", self.unit, self.name] if part)
+
+
+class IngredientToken(models.Model):
+    """Model forming an inverted index from normalized ingredient tokens to recipe ingredients."""
+    token = models.CharField(max_length=200)
+    ingredient = models.ForeignKey(RecipeIngredient, on_delete=models.CASCADE, related_name='tokens')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        indexes = [models.Index(fields=['token', 'recipe'])]
+
+    def __str__(self):
+        return self.token
+
+
 class Nutrition(models.Model):
     """Model representing nutritional information for a meal."""
     meal = models.OneToOneField(Meal, on_delete=models.CASCADE, related_name='nutrition')
@@ -81,9 +113,13 @@ class WeeklyMealPlan(models.Model):
     year = models.PositiveIntegerField(help_text="Year of the meal plan")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    cell_versions = models.JSONField(
+        default=dict, blank=True, editable=False,
+        help_text="Latest planner edit version saved per cell, keyed by the editing page's client id",
+    )
     
     class Meta:
-        unique_together = ['user', 'week_number']
+        unique_together = ['user', 'year', 'week_number']
 
     def __str__(self):
         return f"{self.user.username}'s plan for week {self.week_number} of {self.year}"
@@ -133,3 +169,113 @@ class MealPlanEntry(models.Model):
     
     def __str__(self):
         return f"{self.get_day_of_week_display()} {self.get_meal_type_display()}: {self.meal.name}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so signal handlers can tell which slot an edit moved from.
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+
+class MealPlanTemplate(models.Model):
+    """Model representing a named, reusable week of meals that can be cloned into any week."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'name']
+
+    def __str__(self):
+        return f"{self.user.username}'s template {self.name}"
+
+
+class MealPlanTemplateEntry(models.Model):
+    """Model representing a meal slot within a meal plan template."""
+    template = models.ForeignKey(MealPlanTemplate, on_delete=models.CASCADE, related_name='entries')
+    meal = models.ForeignKey(Meal, on_delete=models.CASCADE)
+    day_of_week = models.IntegerField(choices=MealPlanEntry.DAYS_OF_WEEK)
+    meal_type = models.CharField(max_length=20, choices=MealPlanEntry.MEAL_TYPE_CHOICES)
+    notes = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.get_day_of_week_display()} {self.get_meal_type_display()}: {self.meal.name}"
+
+
+class ArchivedWeek(models.Model):
+    """Model holding an old weekly meal plan folded into a single compact row.
+
+    ``slots`` has one meal id (or null) per day and meal type, at index
+    ``day_of_week * len(MEAL_TYPE_CHOICES) + meal type position``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.PositiveIntegerField()
+    week_number = models.PositiveIntegerField()
+    name = models.CharField(max_length=100, default="Weekly Meal Plan")
+    slots = models.JSONField(help_text="Meal id per day and meal type slot")
+    notes = models.JSONField(default=dict, blank=True, help_text="Entry notes keyed by slot index")
+    created_at = models.DateTimeField(help_text="When the original plan was created")
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['user', 'year', 'week_number']
+
+    def __str__(self):
+        return f"{self.user.username}'s archived plan for week {self.week_number} of {self.year}"
+
+    def slot_entries(self):
+        """Yield (day_of_week, meal_type, meal_id, notes) for every filled slot."""
+        meal_types = MealPlanEntry.MEAL_TYPE_CHOICES
+        for index, meal_id in enumerate(self.slots):
+            if meal_id is not None:
+                day, type_index = divmod(index, len(meal_types))
+                yield day, meal_types[type_index][0], meal_id, self.notes.get(str(index), '')
+
+
+class DailyNutritionRollup(models.Model):
+    """Model holding per-day nutrient totals of a user's weekly plan, derived from its entries."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.PositiveIntegerField()
+    week_number = models.PositiveIntegerField()
+    day_of_week = models.IntegerField(choices=MealPlanEntry.DAYS_OF_WEEK)
+    entry_count = models.PositiveIntegerField(default=0)
+    calories = models.PositiveIntegerField(default=0)
+    protein_grams = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    carbs_grams = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    fat_grams = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    fiber_grams = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    sugar_grams = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    sodium_mg = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'year', 'week_number', 'day_of_week']
+
+    def __str__(self):
+        return f"{self.user.username}'s nutrition for {self.get_day_of_week_display()} of week {self.week_number}, {self.year}"
+
+
+class MealUsageStats(models.Model):
+    """Model holding denormalized planning counters for one of a user's meals, archived weeks included."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    meal = models.ForeignKey(Meal, on_delete=models.CASCADE, related_name='usage_stats')
+    times_planned = models.PositiveIntegerField(default=0)
+    breakfast_count = models.PositiveIntegerField(default=0)
+    lunch_count = models.PositiveIntegerField(default=0)
+    dinner_count = models.PositiveIntegerField(default=0)
+    snack_count = models.PositiveIntegerField(default=0)
+    last_planned_week_start = models.DateField(null=True, blank=True, help_text="Monday of the latest week the meal is planned in")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'meal']
+        indexes = [
+            models.Index(fields=['user', '-times_planned']),
+            models.Index(fields=['user', 'last_planned_week_start']),
+        ]
+        verbose_name_plural = 'meal usage stats'
+
+    def __str__(self):
+        return f"{self.meal.name} planned {self.times_planned} times"
@@ -0,0 +1,117 @@
+from django.db import transaction
+from django.db.models import Q
+
+from . import usage
+from .models import ArchivedWeek, Meal, MealPlanEntry, MealPlanTemplate, MealPlanTemplateEntry, WeeklyMealPlan
+from .signals import deferred_maintenance, entries_changed
+
+CLONE_MODES = ('merge', 'overwrite')
+
+
+def ensure_weekly_plans(user, weeks):
+    """Return the user's plans for (year, week, week_start) tuples, creating missing ones in bulk.
+
+    Uses two queries however many weeks are passed.
+    """
+    if not weeks:
+        return []
+    WeeklyMealPlan.objects.bulk_create(
+        [
+            WeeklyMealPlan(user=user, year=year, week_number=week, name=f'Week of {week_start}')
+            for year, week, week_start in weeks
+        ],
+        ignore_conflicts=True,
+    )
+    week_filter = Q()
+    for year, week, _ in weeks:
+        week_filter |= Q(year=year, week_number=week)
+    plans = {(plan.year, plan.week_number): plan for plan in WeeklyMealPlan.objects.filter(week_filter, user=user)}
+    return [plans[(year, week)] for year, week, _ in weeks]
+
+
+def ensure_plans_for_users(user_ids, weeks):
+    """Create the missing plans of every user for (year, week, week_start) tuples and return all of them.
+
+    Uses two queries however many users and weeks are passed.
+    """
+    if not user_ids or not weeks:
+        return []
+    WeeklyMealPlan.objects.bulk_create(
+        [
+            WeeklyMealPlan(user_id=user_id, year=year, week_number=week, name=f'Week of {week_start}')
+            for user_id in user_ids
+            for year, week, week_start in weeks
+        ],
+        ignore_conflicts=True,
+        batch_size=500,
+    )
+    week_filter = Q()
+    for year, week, _ in weeks:
+        week_filter |= Q(year=year, week_number=week)
+    return list(WeeklyMealPlan.objects.filter(week_filter, user_id__in=user_ids))
+
+
+def clone_entries(source_rows, user, weeks, mode='merge'):
+    """Copy entries into each of the given weeks in a fixed number of queries.
+
+    ``source_rows`` holds (day_of_week, meal_type, meal_id, notes) tuples,
+    e.g. a ``values_list()`` queryset of MealPlanEntry or MealPlanTemplateEntry.
+    ``merge`` only fills empty slots of the target weeks; ``overwrite`` first
+    clears them. Returns ``(plans, created_count)``.
+    """
+    if mode not in CLONE_MODES:
+        raise ValueError(f'Unknown clone mode {mode!r}')
+
+    with transaction.atomic(), deferred_maintenance():
+        rows = list(source_rows)
+        plans = ensure_weekly_plans(user, weeks)
+        targets = MealPlanEntry.objects.filter(meal_plan__in=plans)
+        if mode == 'overwrite':
+            targets.delete()
+            occupied = set()
+        else:
+            occupied = set(targets.values_list('meal_plan_id', 'day_of_week', 'meal_type'))
+
+        new_entries = [
+            MealPlanEntry(meal_plan=plan, day_of_week=day, meal_type=meal_type, meal_id=meal_id, notes=notes)
+            for plan in plans
+            for day, meal_type, meal_id, notes in rows
+            if (plan.id, day, meal_type) not in occupied
+        ]
+        MealPlanEntry.objects.bulk_create(new_entries, batch_size=500)
+        usage.entries_added(new_entries)
+        entries_changed({(entry.meal_plan_id, entry.day_of_week) for entry in new_entries})
+    return plans, len(new_entries)
+
+
+def clone_week(source, user, weeks, mode='merge'):
+    """Clone a WeeklyMealPlan, ArchivedWeek or MealPlanTemplate into the given weeks."""
+    fields = ['day_of_week', 'meal_type', 'meal_id', 'notes']
+    if isinstance(source, MealPlanTemplate):
+        source_rows = MealPlanTemplateEntry.objects.filter(template=source).order_by('id').values_list(*fields)
+    elif isinstance(source, ArchivedWeek):
+        slots = list(source.slot_entries())
+        # Archived slots may name meals deleted since.
+        existing = set(Meal.objects.filter(id__in={meal_id for _, _, meal_id, _ in slots}).values_list('id', flat=True))
+        source_rows = [slot for slot in slots if slot[2] in existing]
+    else:
+        source_rows = MealPlanEntry.objects.filter(meal_plan=source).order_by('id').values_list(*fields)
+    # Never clone a week onto itself, which would only duplicate or drop its entries.
+    if not isinstance(source, MealPlanTemplate):
+        weeks = [week for week in weeks if (week[0], week[1]) != (source.year, source.week_number)]
+    return clone_entries(source_rows, user, weeks, mode=mode)
+
+
+def save_as_template(meal_plan, name):
+    """Store a week's entries as the user's template ``name``, replacing any template of that name."""
+    with transaction.atomic():
+        template, _ = MealPlanTemplate.objects.get_or_create(user=meal_plan.user, name=name)
+        template.entries.all().delete()
+        MealPlanTemplateEntry.objects.bulk_create([
+            MealPlanTemplateEntry(template=template, day_of_week=day, meal_type=meal_type, meal_id=meal_id, notes=notes)
+            for day, meal_type, meal_id, notes in meal_plan.entries.order_by('id').values_list(
+                'day_of_week', 'meal_type', 'meal_id', 'notes'
+            )
+        ])
+        template.save(update_fields=['updated_at'])
+    return template
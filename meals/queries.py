@@ -0,0 +1,203 @@
+"""Query budgets and N+1 detection.
+
+``audit_queries()`` records the shape and call site of every query run in
+its block, including queries made on other threads through
+``sync_to_async``, which copies the block's context. ``query_budget(n)``
+declares how many queries a view (or block) may run, and
+``meals.middleware.QueryAuditMiddleware`` logs the query shapes a request
+repeats. Nothing is recorded unless ``settings.QUERY_AUDIT`` is on; it
+defaults to ``DEBUG``.
+"""
+import logging
+import re
+import sys
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Audits recording queries in the current context, innermost last.
+_audits = ContextVar('query_audits', default=())
+
+_END = object()
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+# Transaction control differs between databases and between tests and production.
+_TRANSACTION_STATEMENTS = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a block runs more queries than its budget and ``QUERY_BUDGET_STRICT`` is on."""
+
+
+def query_shape(sql):
+    """Return the SQL with ``IN`` lists collapsed, so queries differing only in parameters compare equal."""
+    return _IN_LIST.sub('IN (...)', ' '.join(sql.split()))
+
+
+def _call_site():
+    """Return ``path:line in function`` of the innermost project frame outside Django and this module."""
+    project_dir = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(project_dir) and filename != __file__ and 'site-packages' not in filename:
+            return f'{filename[len(project_dir) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+def _record(execute, sql, params, many, context):
+    audits = _audits.get()
+    if audits and not sql.startswith(_TRANSACTION_STATEMENTS):
+        query = (query_shape(sql), _call_site())
+        for audit in audits:
+            audit.queries.append(query)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # The wrapper list outlives reconnects of the same connection object.
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record)
+
+
+class QueryAudit:
+    """The queries recorded in an ``audit_queries()`` block, as (shape, call site) pairs."""
+
+    def __init__(self):
+        self.queries = []
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=None):
+        """Return ``[(shape, count, Counter of call sites), ...]`` for shapes run at least ``threshold`` times."""
+        threshold = threshold or settings.QUERY_AUDIT_REPEAT_THRESHOLD
+        counts = Counter(shape for shape, _ in self.queries)
+        return [
+            (shape, count, Counter(site for other, site in self.queries if other == shape))
+            for shape, count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def describe_repeated(self, threshold=None):
+        return '; '.join(
+            f'{count}x {shape[:200]} from {", ".join(f"{site} ({n})" for site, n in sites.most_common(3))}'
+            for shape, count, sites in self.repeated(threshold)
+        )
+
+
+@contextmanager
+def audit_queries(audit=None):
+    """Record the queries run in the block, whether or not ``QUERY_AUDIT`` is on.
+
+    Pass the audit of an earlier block to keep adding to it.
+    """
+    if audit is None:
+        audit = QueryAudit()
+    token = _audits.set(_audits.get() + (audit,))
+    try:
+        yield audit
+    finally:
+        _audits.reset(token)
+
+
+class query_budget:
+    """Allow at most ``limit`` queries in a view or block while ``QUERY_AUDIT`` is on.
+
+    Use as ``@query_budget(4)`` on a view, sync or async, or as
+    ``with query_budget(4):``. Going over logs a warning naming the repeated
+    query shapes, or raises QueryBudgetExceeded with ``QUERY_BUDGET_STRICT``.
+    A view's streaming response keeps counting against the budget while it
+    is iterated, and is checked once the stream is exhausted.
+    """
+
+    def __init__(self, limit, name=None):
+        self.limit = limit
+        self.name = name or 'block'
+        self._context = self._audit = None
+        self._streaming = False
+
+    def __enter__(self):
+        if not settings.QUERY_AUDIT:
+            return None
+        self._context = audit_queries()
+        self._audit = self._context.__enter__()
+        return self._audit
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self._context is None:
+            return False
+        self._context.__exit__(exc_type, exc, traceback)
+        if exc_type is None and not self._streaming:
+            self._check(self._audit)
+        return False
+
+    def _check(self, audit):
+        if audit.count > self.limit:
+            message = f'{self.name} ran {audit.count} queries, over its budget of {self.limit}'
+            repeated = audit.describe_repeated()
+            if repeated:
+                message += f'; repeated: {repeated}'
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+    def _follow(self, response):
+        """Count the queries a streaming response runs as it is iterated; called inside the block."""
+        if self._audit is None or not getattr(response, 'streaming', False):
+            return
+        self._streaming = True
+        audit, content = self._audit, response.streaming_content
+        if response.is_async:
+            async def audited():
+                iterator = aiter(content)
+                while True:
+                    with audit_queries(audit):
+                        chunk = await anext(iterator, _END)
+                    if chunk is _END:
+                        break
+                    yield chunk
+                self._check(audit)
+        else:
+            def audited():
+                iterator = iter(content)
+                while True:
+                    with audit_queries(audit):
+                        chunk = next(iterator, _END)
+                    if chunk is _END:
+                        break
+                    yield chunk
+                self._check(audit)
+        response.streaming_content = audited()
+
+    def __call__(self, view):
+        limit, name = self.limit, view.__qualname__
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(*args, **kwargs):
+                budget = query_budget(limit, name)
+                with budget:
+                    response = await view(*args, **kwargs)
+                    budget._follow(response)
+                return response
+        else:
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                budget = query_budget(limit, name)
+                with budget:
+                    response = view(*args, **kwargs)
+                    budget._follow(response)
+                return response
+        wrapper.query_budget = limit
+        return wrapper
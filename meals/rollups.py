@@ -0,0 +1,181 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, Exists, IntegerField, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import ArchivedWeek, DailyNutritionRollup, Meal, MealPlanEntry, WeeklyMealPlan
+
+# Rollup field -> Nutrition field summed into it.
+NUTRIENT_FIELDS = {
+    'calories': 'calories_per_serving',
+    'protein_grams': 'protein_grams',
+    'carbs_grams': 'carbs_grams',
+    'fat_grams': 'fat_grams',
+    'fiber_grams': 'fiber_grams',
+    'sugar_grams': 'sugar_grams',
+    'sodium_mg': 'sodium_mg',
+}
+KEY_FIELDS = ['user', 'year', 'week_number', 'day_of_week']
+BATCH_SIZE = 500
+
+
+def _totals(entries):
+    """Group entries by plan day and sum the nutrition of their meals."""
+    annotations = {'entry_count': Count('id')}
+    for field, source in NUTRIENT_FIELDS.items():
+        output_field = IntegerField() if field == 'calories' else DecimalField(max_digits=12, decimal_places=2)
+        annotations[field] = Coalesce(Sum(f'meal__nutrition__{source}'), Value(0), output_field=output_field)
+    return entries.values(
+        'meal_plan__user_id', 'meal_plan__year', 'meal_plan__week_number', 'day_of_week'
+    ).annotate(**annotations).order_by()
+
+
+def _rollup_from_totals(row):
+    return DailyNutritionRollup(
+        user_id=row['meal_plan__user_id'],
+        year=row['meal_plan__year'],
+        week_number=row['meal_plan__week_number'],
+        day_of_week=row['day_of_week'],
+        entry_count=row['entry_count'],
+        **{field: row[field] for field in NUTRIENT_FIELDS},
+    )
+
+
+def _save_rollups(rollups):
+    DailyNutritionRollup.objects.bulk_create(
+        rollups,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=KEY_FIELDS,
+        update_fields=['entry_count', *NUTRIENT_FIELDS],
+    )
+
+
+def _unplanned_archived_weeks():
+    """Return the archived weeks that have no live plan, whose rollups come from their slots."""
+    live = WeeklyMealPlan.objects.filter(
+        user_id=OuterRef('user_id'), year=OuterRef('year'), week_number=OuterRef('week_number')
+    )
+    return ArchivedWeek.objects.exclude(Exists(live)).only('user_id', 'year', 'week_number', 'slots', 'notes')
+
+
+def _archived_chunks():
+    weeks = []
+    for week in _unplanned_archived_weeks().order_by('id').iterator(chunk_size=BATCH_SIZE):
+        weeks.append(week)
+        if len(weeks) >= BATCH_SIZE:
+            yield weeks
+            weeks = []
+    if weeks:
+        yield weeks
+
+
+def _archived_rollups(weeks):
+    """Build the rollups of archived weeks from their slots, skipping meals deleted since."""
+    meal_ids = {meal_id for week in weeks for meal_id in week.slots if meal_id is not None}
+    nutrition = {
+        meal_id: values
+        for meal_id, *values in Meal.objects.filter(id__in=meal_ids).values_list(
+            'id', *(f'nutrition__{source}' for source in NUTRIENT_FIELDS.values())
+        )
+    }
+    totals = defaultdict(lambda: {'entry_count': 0, **{
+        field: 0 if field == 'calories' else Decimal(0) for field in NUTRIENT_FIELDS
+    }})
+    for week in weeks:
+        for day, _, meal_id, _ in week.slot_entries():
+            if meal_id not in nutrition:
+                continue
+            row = totals[(week.user_id, week.year, week.week_number, day)]
+            row['entry_count'] += 1
+            for field, value in zip(NUTRIENT_FIELDS, nutrition[meal_id]):
+                row[field] += value or 0
+    return [
+        DailyNutritionRollup(user_id=user_id, year=year, week_number=week, day_of_week=day, **row)
+        for (user_id, year, week, day), row in totals.items()
+    ]
+
+
+def refresh_archived_weeks(weeks):
+    """Recompute the rollups of the given archived weeks. Returns the ids of the users affected."""
+    weeks = list(weeks)
+    if not weeks:
+        return set()
+    week_filter = Q()
+    for week in weeks:
+        week_filter |= Q(user_id=week.user_id, year=week.year, week_number=week.week_number)
+    DailyNutritionRollup.objects.filter(week_filter).delete()
+    _save_rollups(_archived_rollups(weeks))
+    return {week.user_id for week in weeks}
+
+
+def refresh_plan_days(plan_days):
+    """Recompute the rollups for an iterable of (meal_plan_id, day_of_week) pairs.
+
+    Pairs whose plan no longer exists are ignored; days left without
+    entries lose their rollup row. Returns the ids of the users affected.
+    """
+    plan_days = set(plan_days)
+    if not plan_days:
+        return set()
+    plan_keys = {
+        plan_id: (user_id, year, week)
+        for plan_id, user_id, year, week in WeeklyMealPlan.objects.filter(
+            id__in={plan_id for plan_id, _ in plan_days}
+        ).values_list('id', 'user_id', 'year', 'week_number')
+    }
+    plan_days = sorted((plan_id, day) for plan_id, day in plan_days if plan_id in plan_keys)
+
+    for start in range(0, len(plan_days), BATCH_SIZE):
+        batch = plan_days[start:start + BATCH_SIZE]
+        day_filter = Q()
+        for plan_id, day in batch:
+            day_filter |= Q(meal_plan_id=plan_id, day_of_week=day)
+
+        rollups = [_rollup_from_totals(row) for row in _totals(MealPlanEntry.objects.filter(day_filter))]
+        _save_rollups(rollups)
+
+        filled = {(r.user_id, r.year, r.week_number, r.day_of_week) for r in rollups}
+        empty = Q()
+        for plan_id, day in batch:
+            user_id, year, week = plan_keys[plan_id]
+            if (user_id, year, week, day) not in filled:
+                empty |= Q(user_id=user_id, year=year, week_number=week, day_of_week=day)
+        if empty:
+            DailyNutritionRollup.objects.filter(empty).delete()
+
+    return {user_id for user_id, _, _ in plan_keys.values()}
+
+
+def refresh_meals(meal_ids):
+    """Recompute the rollups of every plan day, live or archived, that includes one of the given meals."""
+    user_ids = refresh_plan_days(
+        MealPlanEntry.objects.filter(meal_id__in=meal_ids).values_list('meal_plan_id', 'day_of_week').distinct()
+    )
+    # Slots are a JSON list, so the archived weeks holding the meals are found by scanning.
+    meal_ids = set(meal_ids)
+    for weeks in _archived_chunks():
+        user_ids |= refresh_archived_weeks([week for week in weeks if meal_ids.intersection(week.slots)])
+    return user_ids
+
+
+
+def rebuild_all():
+    """Drop and rebuild every rollup row from the plan entries and archived weeks. Returns the row count."""
+    DailyNutritionRollup.objects.all().delete()
+    count = 0
+    batch = []
+    for row in _totals(MealPlanEntry.objects.all()).iterator(chunk_size=BATCH_SIZE):
+        batch.append(_rollup_from_totals(row))
+        if len(batch) >= BATCH_SIZE:
+            _save_rollups(batch)
+            count += len(batch)
+            batch = []
+    _save_rollups(batch)
+    count += len(batch)
+    for weeks in _archived_chunks():
+        rollups = _archived_rollups(weeks)
+        _save_rollups(rollups)
+        count += len(rollups)
+    return count
@@ -0,0 +1,186 @@
+"""Full-text search over meal names, descriptions and recipe text.
+
+PostgreSQL keeps a weighted ``tsvector`` per meal in ``meals_mealsearch``
+behind a GIN index; SQLite uses an FTS5 virtual table of the same name.
+Both are created by migration 0010 and refreshed from signal handlers
+whenever a Meal or Recipe is saved. Other databases fall back to
+``icontains`` filtering.
+"""
+import html
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Meal
+
+TABLE = 'meals_mealsearch'
+# Control characters mark matches so the snippet can be HTML-escaped before highlighting.
+START_MARK, STOP_MARK = '\x02', '\x03'
+
+POSTGRES_DOCUMENT = """
+    setweight(to_tsvector('english', coalesce(m.name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(m.description, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(r.ingredients, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(r.instructions, '')), 'C')
+"""
+
+
+def create_index(schema_editor):
+    """Create the search table for the current database; called from the migration."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE {TABLE} ('
+            'meal_id bigint PRIMARY KEY REFERENCES meals_meal(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(f'CREATE INDEX {TABLE}_document_gin ON {TABLE} USING GIN (document)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {TABLE} USING fts5('
+            "name, description, ingredients, instructions, tokenize = 'porter unicode61')"
+        )
+
+
+def drop_index(schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+def update_documents(meal_ids=None):
+    """Rebuild the search documents of the given meals, or of every meal when ``meal_ids`` is None."""
+    if meal_ids is not None:
+        meal_ids = list(meal_ids)
+        if not meal_ids:
+            return
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            if meal_ids is None:
+                where, params = '', []
+                cursor.execute(f'TRUNCATE {TABLE}')
+            else:
+                where, params = 'WHERE m.id = ANY(%s)', [meal_ids]
+                cursor.execute(f'DELETE FROM {TABLE} WHERE meal_id = ANY(%s)', [meal_ids])
+            cursor.execute(
+                f'INSERT INTO {TABLE} (meal_id, document) '
+                f'SELECT m.id, {POSTGRES_DOCUMENT} FROM meals_meal m '
+                f'LEFT JOIN meals_recipe r ON r.meal_id = m.id {where}',
+                params,
+            )
+        elif vendor == 'sqlite':
+            if meal_ids is None:
+                where, params = '', []
+                cursor.execute(f'DELETE FROM {TABLE}')
+            else:
+                placeholders = ', '.join(['%s'] * len(meal_ids))
+                where, params = f'WHERE m.id IN ({placeholders})', meal_ids
+                cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN ({placeholders})', meal_ids)
+            cursor.execute(
+                f'INSERT INTO {TABLE} (rowid, name, description, ingredients, instructions) '
+                "SELECT m.id, m.name, m.description, coalesce(r.ingredients, ''), coalesce(r.instructions, '') "
+                f'FROM meals_meal m LEFT JOIN meals_recipe r ON r.meal_id = m.id {where}',
+                params,
+            )
+
+
+def delete_documents(meal_ids):
+    meal_ids = list(meal_ids)
+    if not meal_ids or connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    with connection.cursor() as cursor:
+        placeholders = ', '.join(['%s'] * len(meal_ids))
+        column = 'meal_id' if connection.vendor == 'postgresql' else 'rowid'
+        cursor.execute(f'DELETE FROM {TABLE} WHERE {column} IN ({placeholders})', meal_ids)
+
+
+def _highlight(snippet):
+    return html.escape(snippet or '').replace(START_MARK, '<mark>').replace(STOP_MARK, '</mark>')
+
+
+def _fts5_query(query):
+    """Turn free text into an FTS5 query: every word must match, the last one as a prefix."""
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _search_postgresql(query, user, limit):
+    sql = f"""
+        SELECT m.id, m.name, m.meal_type, ranked.rank,
+               ts_headline('english', concat_ws(' ', m.name, m.description, r.ingredients), ranked.query,
+                           %s)
+        FROM (
+            SELECT s.meal_id, ts_rank_cd(s.document, q) AS rank, q AS query
+            FROM {TABLE} s
+            JOIN meals_meal mm ON mm.id = s.meal_id,
+                 websearch_to_tsquery('english', %s) q
+            WHERE s.document @@ q AND mm.created_by_id = %s
+            ORDER BY rank DESC
+            LIMIT %s
+        ) ranked
+        JOIN meals_meal m ON m.id = ranked.meal_id
+        LEFT JOIN meals_recipe r ON r.meal_id = m.id
+        ORDER BY ranked.rank DESC
+    """
+    options = f'StartSel="{START_MARK}", StopSel="{STOP_MARK}", MaxWords=25, MinWords=8, MaxFragments=2'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [options, query, user.id, limit])
+        return cursor.fetchall()
+
+
+def _search_sqlite(query, user, limit):
+    match = _fts5_query(query)
+    if match is None:
+        return []
+    # bm25 weights follow the column order: name, description, ingredients, instructions.
+    sql = f"""
+        SELECT m.id, m.name, m.meal_type, -bm25({TABLE}, 10.0, 4.0, 4.0, 1.0) AS rank,
+               snippet({TABLE}, -1, char(2), char(3), '…', 16)
+        FROM {TABLE}
+        JOIN meals_meal m ON m.id = {TABLE}.rowid
+        WHERE {TABLE} MATCH %s AND m.created_by_id = %s
+        ORDER BY bm25({TABLE}, 10.0, 4.0, 4.0, 1.0)
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, user.id, limit])
+        return cursor.fetchall()
+
+
+def _search_fallback(query, user, limit):
+    meals = Meal.objects.filter(created_by=user)
+    for word in query.split():
+        meals = meals.filter(
+            Q(name__icontains=word) | Q(description__icontains=word)
+            | Q(recipe__ingredients__icontains=word) | Q(recipe__instructions__icontains=word)
+        )
+    return [(meal.id, meal.name, meal.meal_type, 0, meal.description[:200]) for meal in meals.distinct()[:limit]]
+
+
+def search_meals(query, user, limit=20):
+    """Return the user's meals matching ``query``, best first, with highlighted snippets."""
+    query = query.strip()
+    if not query:
+        return []
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        rows = _search_postgresql(query, user, limit)
+    elif vendor == 'sqlite':
+        rows = _search_sqlite(query, user, limit)
+    else:
+        rows = _search_fallback(query, user, limit)
+    return [
+        {
+            'meal_id': meal_id,
+            'name': name,
+            'meal_type': meal_type,
+            'rank': float(rank),
+            'snippet': _highlight(snippet),
+        }
+        for meal_id, name, meal_type, rank, snippet in rows
+    ]
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import caching, fragments, ingredients, live, rollups, search, usage
+from .models import DailyNutritionRollup, Meal, MealPlanEntry, Nutrition, Recipe, WeeklyMealPlan
+
+# Plan days changed inside a deferred_maintenance() block, or None outside one.
+_deferred_plan_days = ContextVar('deferred_plan_days', default=None)
+_maintenance_suppressed = ContextVar('maintenance_suppressed', default=False)
+
+
+def _entry_plan_days(entry):
+    """Return the (meal_plan_id, day_of_week) slots an entry occupies now and occupied when loaded."""
+    plan_days = {(entry.meal_plan_id, entry.day_of_week)}
+    loaded = getattr(entry, '_loaded_values', None)
+    if loaded and 'meal_plan_id' in loaded and 'day_of_week' in loaded:
+        plan_days.add((loaded['meal_plan_id'], loaded['day_of_week']))
+    return plan_days
+
+
+def _bump_plan_versions(user_ids):
+    for user_id in user_ids:
+        caching.bump_version('user', user_id)
+
+
+def entries_changed(plan_days):
+    """Refresh the data derived from plan entries on the given (meal_plan_id, day_of_week) pairs.
+
+    Bulk operations that bypass model signals (``bulk_create``) call this
+    directly. Inside ``deferred_maintenance()`` the pairs are collected and
+    refreshed once when the block exits.
+    """
+    if _maintenance_suppressed.get():
+        return
+    deferred = _deferred_plan_days.get()
+    if deferred is not None:
+        deferred.update(plan_days)
+        return
+    for plan_id in {plan_id for plan_id, _ in plan_days}:
+        caching.bump_version('plan', plan_id)
+    _bump_plan_versions(rollups.refresh_plan_days(plan_days))
+    live.publish_plan_days(plan_days)
+
+
+@contextmanager
+def deferred_maintenance():
+    """Batch the refreshes triggered by entry changes in the block into one pass at the end."""
+    if _deferred_plan_days.get() is not None:
+        yield
+        return
+    plan_days = set()
+    token = _deferred_plan_days.set(plan_days)
+    try:
+        with usage.batched():
+            yield
+    finally:
+        _deferred_plan_days.reset(token)
+    entries_changed(plan_days)
+
+
+@contextmanager
+def maintenance_suppressed():
+    """Skip entry maintenance in the block, for moves that keep the derived data valid (archiving)."""
+    token = _maintenance_suppressed.set(True)
+    try:
+        yield
+    finally:
+        _maintenance_suppressed.reset(token)
+
+
+@receiver(post_save, sender=MealPlanEntry)
+@receiver(post_delete, sender=MealPlanEntry)
+def refresh_rollups_on_entry_change(sender, instance, **kwargs):
+    entries_changed(_entry_plan_days(instance))
+
+
+@receiver(post_save, sender=MealPlanEntry)
+def count_saved_entry(sender, instance, created, **kwargs):
+    if not _maintenance_suppressed.get():
+        usage.entry_saved(instance, created)
+    # Later saves of the same instance compare against what is stored now.
+    instance._loaded_values = {field.attname: getattr(instance, field.attname) for field in sender._meta.concrete_fields}
+
+
+@receiver(post_delete, sender=MealPlanEntry)
+def uncount_deleted_entry(sender, instance, **kwargs):
+    if not _maintenance_suppressed.get():
+        usage.entry_deleted(instance)
+
+
+def nutrition_changed(meal_ids):
+    """Refresh the plan data derived from the nutrition of the given meals."""
+    _bump_plan_versions(rollups.refresh_meals(meal_ids))
+
+
+@receiver(post_save, sender=Nutrition)
+@receiver(post_delete, sender=Nutrition)
+def refresh_rollups_on_nutrition_change(sender, instance, **kwargs):
+    nutrition_changed([instance.meal_id])
+
+
+@receiver(post_delete, sender=WeeklyMealPlan)
+def delete_rollups_with_plan(sender, instance, **kwargs):
+    if _maintenance_suppressed.get():
+        return
+    DailyNutritionRollup.objects.filter(
+        user_id=instance.user_id, year=instance.year, week_number=instance.week_number
+    ).delete()
+    _bump_plan_versions([instance.user_id])
+
+
+@receiver(post_save, sender=Recipe)
+def parse_recipe_ingredients(sender, instance, **kwargs):
+    ingredients.reparse_recipes([instance])
+
+
+def meals_changed():
+    """Invalidate rendered planner fragments that show meal names or recipe times."""
+    caching.bump_version('meals', fragments.MEALS_VERSION_KEY)
+
+
+@receiver(post_save, sender=Meal)
+def index_meal(sender, instance, **kwargs):
+    search.update_documents([instance.id])
+    meals_changed()
+
+
+@receiver(post_delete, sender=Meal)
+def unindex_meal(sender, instance, **kwargs):
+    search.delete_documents([instance.id])
+    meals_changed()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def index_recipe_meal(sender, instance, **kwargs):
+    search.update_documents([instance.meal_id])
+    meals_changed()
@@ -0,0 +1,15 @@
+(function() {
+    const workerUrl = document.currentScript.dataset.serviceWorker;
+    if ('serviceWorker' in navigator) {
+        window.addEventListener('load', function() {
+            navigator.serviceWorker.register(workerUrl, {scope: '/weekly-meals/'}).then(function(reg) {
+                // Dynamically cache the current page if it's a weekly plan page
+                if (window.location.pathname.match(/^\/weekly-meals\/weekly-plan\//)) {
+                    if (reg.active) {
+                        reg.active.postMessage({action: 'cache-url', url: window.location.pathname});
+                    }
+                }
+            });
+        });
+    }
+})();
@@ -1,3 +1,1191 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import re
+import tempfile
+import time
+import zlib
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, modify_settings, override_settings
+from django.utils import timezone
+
+from . import urls as meals_urls
+from . import live, rollups, usage
+from .archive import archive_plans, restore_weeks
+from .bulk import import_records, parse_records
+from .db.pool import ConnectionPool
+from .fragments import render_meal_list, render_meal_select, render_plan_grid
+from .analytics import nutrition_trends
+from .ingredients import normalize_name, parse_ingredient_line, parse_ingredients
+from .models import (
+    ArchivedWeek, DailyNutritionRollup, Meal, MealPlanEntry, MealPlanTemplate, MealUsageStats, Nutrition, Recipe,
+    RecipeIngredient, WeeklyMealPlan,
+)
+from .planning import clone_week, ensure_weekly_plans, save_as_template
+from .queries import QueryBudgetExceeded, audit_queries, query_budget
+from .search import search_meals
+from .utils import iso_week_start, iter_iso_weeks
+
+MEAL_COUNT = 12
+WEEK_COUNT = 3
+
+
+class PlannerDataMixin:
+    """A user with meals (recipe and nutrition included) and several fully planned weeks.
+
+    Enough rows that a per-row query in any view shows up as going over budget.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.meals = []
+        for number in range(MEAL_COUNT):
+            meal = Meal.objects.create(
+                name=f'Chicken dish {number}', description='Spicy chicken', meal_type='lunch or dinner',
+                created_by=cls.user,
+            )
+            Recipe.objects.create(
+                meal=meal, ingredients='1 onion\n2 cups rice\n200 g chicken', instructions='Cook.',
+                prep_time=10, cook_time=20, servings=2,
+            )
+            Nutrition.objects.create(meal=meal, calories_per_serving=400 + number)
+            cls.meals.append(meal)
+
+        today = timezone.now().date()
+        cls.year, cls.week, _ = today.isocalendar()
+        first = today - timezone.timedelta(weeks=WEEK_COUNT - 1)
+        cls.plans = ensure_weekly_plans(cls.user, list(iter_iso_weeks(*first.isocalendar()[:2], WEEK_COUNT)))
+        for plan in cls.plans:
+            for day in range(7):
+                for index, (meal_type, _) in enumerate(MealPlanEntry.MEAL_TYPE_CHOICES):
+                    MealPlanEntry.objects.create(
+                        meal_plan=plan, day_of_week=day, meal_type=meal_type,
+                        meal=cls.meals[(day + index) % MEAL_COUNT],
+                    )
+        cls.plan = cls.plans[-1]
+        save_as_template(cls.plans[0], 'Usual week')
+
+    def setUp(self):
+        # Budgets are for cold caches, the most a view ever runs.
+        cache.clear()
+        self.client.force_login(self.user)
+
+
+class NutritionRollupTests(PlannerDataMixin, TestCase):
+    """Daily rollups follow entry and nutrition changes without a rebuild."""
+
+    def rollup(self, day):
+        return DailyNutritionRollup.objects.filter(
+            user=self.user, year=self.plan.year, week_number=self.plan.week_number, day_of_week=day
+        ).first()
+
+    def snapshot(self):
+        return sorted(DailyNutritionRollup.objects.values_list(
+            'user_id', 'year', 'week_number', 'day_of_week', 'entry_count', *rollups.NUTRIENT_FIELDS
+        ))
+
+    def test_totals_per_day(self):
+        # Day 0 holds meals 0-3, with 400-403 calories.
+        rollup = self.rollup(0)
+        self.assertEqual((rollup.entry_count, rollup.calories), (4, 1606))
+
+    def test_entry_changes_refresh_old_and_new_day(self):
+        entry = MealPlanEntry.objects.get(meal_plan=self.plan, day_of_week=0, meal_type='breakfast')
+        entry.meal = self.meals[11]
+        entry.save()
+        self.assertEqual(self.rollup(0).calories, 1606 - 400 + 411)
+        entry.day_of_week = 1
+        entry.save()
+        self.assertEqual((self.rollup(0).entry_count, self.rollup(0).calories), (3, 1206))
+        self.assertEqual(self.rollup(1).entry_count, 5)
+        MealPlanEntry.objects.filter(meal_plan=self.plan, day_of_week=0).delete()
+        self.assertIsNone(self.rollup(0))
+        expected = self.snapshot()
+        rollups.rebuild_all()
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_nutrition_changes_refresh_days_with_the_meal(self):
+        nutrition = self.meals[0].nutrition
+        nutrition.calories_per_serving = 100
+        nutrition.save()
+        self.assertEqual(self.rollup(0).calories, 1606 - 400 + 100)
+        expected = self.snapshot()
+        rollups.rebuild_all()
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_weekly_nutrition_reads_rollups(self):
+        data = self.client.get(f'/weekly-plan/{self.plan.year}/{self.plan.week_number}/nutrition/').json()
+        week, = data['weeks']
+        self.assertEqual(week['days'][0]['calories'], 1606)
+        self.assertEqual(week['totals']['entry_count'], 7 * len(MealPlanEntry.MEAL_TYPE_CHOICES))
+
+
+class NutritionTrendTests(PlannerDataMixin, TestCase):
+    """Weekly trends computed from the rollups, and their cache."""
+
+    def test_rolling_average_and_deviation(self):
+        # The first week keeps only day 0 and the middle week is emptied;
+        # day d of a full week holds meals d to d+3, 1606 + 4d calories.
+        first, middle, last = self.plans
+        MealPlanEntry.objects.filter(meal_plan=first, day_of_week__gt=0).delete()
+        MealPlanEntry.objects.filter(meal_plan=middle).delete()
+        trends = nutrition_trends(self.user, window=2, targets={'calories': 2000})
+        self.assertEqual(trends['weeks'], [str(iso_week_start(plan.year, plan.week_number)) for plan in self.plans])
+        self.assertEqual(trends['planned_days'], [1, 0, 7])
+        self.assertEqual(trends['entry_count'], [4, 0, 28])
+        calories = trends['nutrients']['calories']
+        self.assertEqual(calories['total'], [1606, None, 7 * 1606 + 4 * 21])
+        self.assertEqual(calories['daily_average'], [1606, None, 1618])
+        # Partial and empty weeks average over the weeks that have data.
+        self.assertEqual(calories['rolling_average'], [1606, 1606, 1618])
+        self.assertEqual(calories['deviation'], [-394, None, -382])
+        self.assertEqual(calories['deviation_pct'], [-19.7, None, -19.1])
+        self.assertNotIn('deviation', trends['nutrients']['protein_grams'])
+        self.assertEqual(trends['day_of_week_average']['calories'][:2], [1606, 1610])
+        wide = nutrition_trends(self.user, window=3)['nutrients']['calories']['rolling_average']
+        self.assertEqual(wide, [1606, 1606, 1612])
+
+    def test_user_without_plans(self):
+        trends = nutrition_trends(User.objects.create_user('cook'))
+        self.assertEqual(trends, {'weeks': [], 'window': 4, 'nutrients': {}, 'day_of_week_average': {}})
+
+    def test_cached_trends_follow_entry_and_nutrition_edits(self):
+        def last_week_calories():
+            data = self.client.get('/nutrition/trends/').json()
+            return data['nutrients']['calories']['total'][-1]
+
+        with mock.patch('meals.views.compute_nutrition_trends', wraps=nutrition_trends) as compute:
+            self.assertEqual(last_week_calories(), 11326)
+            self.assertEqual(last_week_calories(), 11326)
+            self.assertEqual(compute.call_count, 1)
+            entry = self.plan.entries.get(day_of_week=0, meal_type='breakfast')
+            entry.meal = self.meals[11]
+            with self.captureOnCommitCallbacks(execute=True):
+                entry.save()
+            self.assertEqual(last_week_calories(), 11326 - 400 + 411)
+            nutrition = self.meals[11].nutrition
+            nutrition.calories_per_serving = 500
+            with self.captureOnCommitCallbacks(execute=True):
+                nutrition.save()
+            self.assertEqual(last_week_calories(), 11326 - 400 + 500)
+            self.assertEqual(compute.call_count, 3)
+
+
+class IngredientParserTests(SimpleTestCase):
+
+    def assertParses(self, line, quantity, unit, name):
+        parsed = parse_ingredient_line(line)
+        self.assertEqual((parsed.quantity, parsed.unit, parsed.name), (quantity, unit, name), line)
+
+    def test_quantities_and_units(self):
+        self.assertParses('2 cups rice', Decimal(2), 'cup', 'rice')
+        self.assertParses('1 1/2 tbsp olive oil', Decimal('1.5'), 'tbsp', 'olive oil')
+        self.assertParses('½ tsp salt', Decimal('0.5'), 'tsp', 'salt')
+        self.assertParses('1.5 kg potatoes', Decimal(1500), 'g', 'potato')
+        self.assertParses('2-3 cloves garlic, minced', Decimal(2), 'clove', 'garlic')
+        self.assertParses('a pinch of salt', Decimal(1), 'pinch', 'salt')
+        self.assertParses('3 onions', Decimal(3), '', 'onion')
+        self.assertParses('Salt to taste', None, '', 'salt')
+
+    def test_bullets_headings_and_blank_lines(self):
+        self.assertIsNone(parse_ingredient_line('For the sauce:'))
+        self.assertIsNone(parse_ingredient_line('   '))
+        self.assertEqual([i.name for i in parse_ingredients('- 2 eggs\n1) 1 cup milk\n\nSauce:\n* butter')],
+                         ['egg', 'milk', 'butter'])
+
+    def test_huge_quantities_are_dropped(self):
+        self.assertParses('99999999 g sugar', None, 'g', 'sugar')
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name('Tomatoes (ripe), chopped'), 'tomato')
+        self.assertEqual(normalize_name('Berries'), 'berry')
+        self.assertEqual(normalize_name('Hummus'), 'hummus')
+
+
+class ShoppingListTests(PlannerDataMixin, TestCase):
+
+    def items(self, query='', plan=None):
+        plan = plan or self.plan
+        response = self.client.get(f'/weekly-plan/{plan.year}/{plan.week_number}/shopping-list/{query}')
+        return {(item['name'], item['unit']): item for item in response.json()['items']}
+
+    def test_recipe_saves_are_parsed(self):
+        recipe = self.meals[0].recipe
+        recipe.ingredients = '3 eggs\n1 tbsp butter'
+        recipe.save()
+        self.assertEqual(
+            list(RecipeIngredient.objects.filter(recipe=recipe).values_list('quantity', 'unit', 'name')),
+            [(Decimal(3), '', 'egg'), (Decimal(1), 'tbsp', 'butter')],
+        )
+
+    def test_each_entry_is_one_serving(self):
+        # 28 entries of two-serving recipes with 1 onion, 2 cups rice and 200 g chicken.
+        items = self.items()
+        self.assertEqual(items[('onion', '')]['quantity'], 14)
+        self.assertEqual(items[('rice', 'cup')]['quantity'], 28)
+        self.assertEqual(items[('chicken', 'g')]['quantity'], 2800)
+        self.assertEqual(items[('onion', '')]['meal_count'], 10)
+
+    def test_servings_and_weeks_scale_the_list(self):
+        self.assertEqual(self.items('?servings=3')[('onion', '')]['quantity'], 42)
+        self.assertEqual(self.items(f'?weeks={WEEK_COUNT}', plan=self.plans[0])[('onion', '')]['quantity'], 42)
+
+    def test_invalid_servings(self):
+        response = self.client.get(f'/weekly-plan/{self.plan.year}/{self.plan.week_number}/shopping-list/?servings=0')
+        self.assertEqual(response.status_code, 400)
+
+
+class MealsByIngredientsTests(PlannerDataMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        other = User.objects.create_user('other')
+        for name, user, text in [
+            ('Omelette', cls.user, '3 eggs\n1 tbsp butter'),
+            ('Fried rice', cls.user, '2 cups rice\n2 eggs\n1 onion\n2 tbsp soy sauce'),
+            ('Scrambled eggs', other, '2 eggs\nbutter'),
+        ]:
+            meal = Meal.objects.create(name=name, meal_type='lunch or dinner', created_by=user)
+            Recipe.objects.create(meal=meal, ingredients=text, instructions='Cook.', prep_time=5, cook_time=5)
+
+    def ranked(self, have):
+        return self.client.get(f'/meals/by-ingredients/?have={have}').json()['meals']
+
+    def test_fewest_missing_first(self):
+        omelette, fried_rice = self.ranked('Eggs,butter')
+        self.assertEqual((omelette['name'], omelette['missing'], omelette['covered']), ('Omelette', 0, 2))
+        self.assertEqual((fried_rice['name'], fried_rice['missing']), ('Fried rice', 3))
+        self.assertEqual(fried_rice['missing_ingredients'], ['rice', 'onion', 'soy sauce'])
+
+    def test_ties_rank_by_coverage(self):
+        ranked = self.ranked('rice,onion,egg')
+        self.assertEqual(ranked[0]['name'], 'Fried rice')
+        self.assertEqual(ranked[0]['covered'], 3)
+
+    def test_words_of_an_ingredient_match(self):
+        self.assertEqual([meal['name'] for meal in self.ranked('sauce')], ['Fried rice'])
+
+    def test_requires_ingredients(self):
+        self.assertEqual(self.client.get('/meals/by-ingredients/?have=,').status_code, 400)
+
+
+class MealSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.other = User.objects.create_user('other')
+        cls.soup = Meal.objects.create(
+            name='Lentil soup', description='Warming <b>red</b> lentils', meal_type='lunch or dinner', created_by=cls.user,
+        )
+        cls.curry = Meal.objects.create(name='Vegetable curry', meal_type='lunch or dinner', created_by=cls.user)
+        Recipe.objects.create(meal=cls.curry, ingredients='1 cup lentils\n2 carrots', instructions='Simmer.')
+        Meal.objects.create(name='Lentil salad', meal_type='lunch or dinner', created_by=cls.other)
+
+    def names(self, query, user=None):
+        return [result['name'] for result in search_meals(query, user or self.user)]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.names('lentil'), ['Lentil soup', 'Vegetable curry'])
+
+    def test_stems_and_prefixes(self):
+        self.assertEqual(self.names('carrot'), ['Vegetable curry'])
+        self.assertEqual(self.names('veget'), ['Vegetable curry'])
+        self.assertEqual(self.names('lentil carrots'), ['Vegetable curry'])
+
+    def test_only_the_users_meals(self):
+        self.assertEqual(self.names('salad'), [])
+        self.assertEqual(self.names('lentil', self.other), ['Lentil salad'])
+
+    def test_documents_follow_saves_and_deletes(self):
+        recipe = self.curry.recipe
+        recipe.ingredients = '400 g chickpeas'
+        recipe.save()
+        self.assertEqual(self.names('chickpea'), ['Vegetable curry'])
+        self.assertEqual(self.names('lentil'), ['Lentil soup'])
+        self.soup.delete()
+        self.assertEqual(self.names('soup'), [])
+
+    def test_snippets_are_escaped_and_highlighted(self):
+        result, = search_meals('warming', self.user)
+        self.assertIn('<mark>Warming</mark>', result['snippet'])
+        self.assertIn('&lt;b&gt;', result['snippet'])
+
+    def test_punctuation_only_query(self):
+        self.assertEqual(self.names('"*'), [])
+
+
+class CloneWeekTests(PlannerDataMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = self.plans[0]
+        next_monday = iso_week_start(self.plan.year, self.plan.week_number) + timezone.timedelta(weeks=1)
+        self.next_weeks = list(iter_iso_weeks(*next_monday.isocalendar()[:2], 2))
+
+    def slots(self, plan):
+        return dict(((day, meal_type), meal_id) for day, meal_type, meal_id in plan.entries.order_by('id').values_list(
+            'day_of_week', 'meal_type', 'meal_id'
+        ))
+
+    def test_into_empty_weeks(self):
+        plans, created = clone_week(self.source, self.user, self.next_weeks)
+        self.assertEqual(created, 2 * 28)
+        for plan in plans:
+            self.assertEqual(self.slots(plan), self.slots(self.source))
+
+    def test_merge_fills_empty_slots_only(self):
+        target = self.plan
+        target.entries.filter(day_of_week=0).delete()
+        target.entries.filter(day_of_week=1, meal_type='lunch').update(meal=self.meals[11])
+        _, created = clone_week(self.source, self.user, list(iter_iso_weeks(target.year, target.week_number, 1)), mode='merge')
+        self.assertEqual(created, 4)
+        slots = self.slots(target)
+        self.assertEqual(slots[(0, 'lunch')], self.slots(self.source)[(0, 'lunch')])
+        self.assertEqual(slots[(1, 'lunch')], self.meals[11].id)
+
+    def test_overwrite_replaces_the_week(self):
+        target = self.plan
+        target.entries.filter(day_of_week=1, meal_type='lunch').update(meal=self.meals[11])
+        _, created = clone_week(self.source, self.user, list(iter_iso_weeks(target.year, target.week_number, 1)), mode='overwrite')
+        self.assertEqual(created, 28)
+        self.assertEqual(self.slots(target), self.slots(self.source))
+
+    def test_never_onto_itself(self):
+        _, created = clone_week(self.source, self.user, list(iter_iso_weeks(self.source.year, self.source.week_number, 1)))
+        self.assertEqual(created, 0)
+        self.assertEqual(self.source.entries.count(), 28)
+
+    def test_from_template_view(self):
+        year, week, _ = self.next_weeks[0]
+        response = self.client.post('/clone-week/', json.dumps({
+            'template': 'Usual week', 'target_year': year, 'target_week': week, 'weeks': 2,
+        }), content_type='application/json')
+        self.assertEqual(response.json()['created'], 56)
+        template = MealPlanTemplate.objects.get(name='Usual week')
+        plan = WeeklyMealPlan.objects.get(user=self.user, year=year, week_number=week)
+        self.assertEqual(self.slots(plan), dict(
+            ((day, meal_type), meal_id)
+            for day, meal_type, meal_id in template.entries.values_list('day_of_week', 'meal_type', 'meal_id')
+        ))
+
+    def test_invalid_mode(self):
+        response = self.client.post('/clone-week/', json.dumps({
+            'source_plan_id': self.source.id, 'target_year': self.plan.year, 'target_week': self.plan.week_number,
+            'mode': 'replace',
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class UsageStatsTests(PlannerDataMixin, TestCase):
+    """Usage counters follow entry changes as deltas and agree with a full rebuild."""
+
+    def stats(self):
+        return sorted(MealUsageStats.objects.values_list(
+            'meal_id', 'times_planned', *usage.SLOT_FIELDS.values(), 'last_planned_week_start'
+        ))
+
+    def counts(self, meal):
+        return MealUsageStats.objects.values_list('times_planned', 'dinner_count').get(meal=meal)
+
+    def assertMatchesRebuild(self):
+        stats = self.stats()
+        usage.rebuild()
+        self.assertEqual(stats, self.stats())
+
+    def test_changing_an_entry_moves_its_count(self):
+        unplanned = self.meals[-1]
+        entry = self.plan.entries.get(day_of_week=0, meal_type='dinner')
+        planned = entry.meal
+        times_planned, dinner_count = self.counts(planned)
+        self.assertFalse(MealUsageStats.objects.filter(meal=unplanned).exists())
+        entry.meal = unplanned
+        entry.save()
+        self.assertEqual(self.counts(unplanned), (1, 1))
+        self.assertEqual(self.counts(planned), (times_planned - 1, dinner_count - 1))
+        self.assertMatchesRebuild()
+
+    def test_deleting_entries_moves_last_planned_week_back(self):
+        meal = self.meals[0]
+        self.assertEqual(
+            MealUsageStats.objects.get(meal=meal).last_planned_week_start,
+            iso_week_start(self.plan.year, self.plan.week_number),
+        )
+        self.plan.entries.filter(meal=meal).delete()
+        previous = self.plans[-2]
+        self.assertEqual(
+            MealUsageStats.objects.get(meal=meal).last_planned_week_start,
+            iso_week_start(previous.year, previous.week_number),
+        )
+        self.assertMatchesRebuild()
+
+    def test_bulk_clone_is_counted(self):
+        before = dict(MealUsageStats.objects.values_list('meal_id', 'times_planned'))
+        target = iso_week_start(self.year, self.week) + timezone.timedelta(weeks=1)
+        clone_week(self.plan, self.user, list(iter_iso_weeks(*target.isocalendar()[:2], 1)), mode='overwrite')
+        after = dict(MealUsageStats.objects.values_list('meal_id', 'times_planned'))
+        self.assertEqual(sum(after.values()) - sum(before.values()), 7 * len(MealPlanEntry.MEAL_TYPE_CHOICES))
+        self.assertMatchesRebuild()
+
+    def test_meal_picker_lists_each_meal_once(self):
+        html = str(render_meal_select(self.user))
+        values = [value for value in re.findall(r'<option value="(\d+)"', html)]
+        self.assertEqual(sorted(values), sorted(str(meal.id) for meal in self.meals))
+        self.assertIn('Frequently planned', html)
+
+
+class FragmentCacheTests(PlannerDataMixin, TestCase):
+    """Cached planner fragments are invalidated once the change behind them commits."""
+
+    def edit(self, day, meal_type, meal):
+        entry = self.plan.entries.get(day_of_week=day, meal_type=meal_type)
+        entry.meal = meal
+        entry.save()
+
+    def test_cell_edits_invalidate_grid_and_picker(self):
+        unplanned = self.meals[-1]
+        grid = render_plan_grid(self.plan.id)
+        render_meal_select(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            # Four plans of the meal rank it above the meals planned once a week.
+            for day in range(1, 5):
+                self.edit(day, 'snack', unplanned)
+            # Until the commit, readers keep the version they cached under.
+            self.assertEqual(render_plan_grid(self.plan.id), grid)
+        self.assertIn(unplanned.name, render_plan_grid(self.plan.id))
+        frequent = str(render_meal_select(self.user)).split('Other meals')[0]
+        self.assertIn(f'value="{unplanned.id}"', frequent)
+
+    def test_meal_edits_invalidate_every_fragment(self):
+        renders = (lambda: render_plan_grid(self.plan.id), lambda: render_meal_select(self.user),
+                   lambda: render_meal_list(self.user))
+        for render in renders:
+            render()
+        meal = self.meals[0]
+        meal.name = 'Renamed soup'
+        with self.captureOnCommitCallbacks(execute=True):
+            meal.save()
+        for render in renders:
+            self.assertIn('Renamed soup', render())
+
+
+class LiveUpdateTests(PlannerDataMixin, TestCase):
+    """Committed cell changes reach the event streams of the plan's open pages."""
+
+    def test_broker_fans_out_per_plan(self):
+        broker = live.Broker()
+
+        async def deliver():
+            first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+            broker.deliver(1, {'type': 'cells', 'cells': []})
+            received = [await asyncio.wait_for(queue.get(), 1) for _, queue in (first, second)]
+            await asyncio.sleep(0)
+            self.assertTrue(other[1].empty())
+            for _ in range(live.QUEUE_SIZE + 1):
+                broker.deliver(2, {'type': 'cells', 'cells': []})
+            await asyncio.sleep(0)
+            # An overflowing queue is replaced by a single reload.
+            self.assertEqual(other[1].qsize(), 1)
+            self.assertEqual(other[1].get_nowait(), live.RELOAD)
+            for plan_id, subscriber in ((1, first), (1, second), (2, other)):
+                broker.unsubscribe(plan_id, subscriber)
+            return received
+
+        self.assertEqual(async_to_sync(deliver)(), [{'type': 'cells', 'cells': []}] * 2)
+        self.assertFalse(broker.has_subscribers(1) or broker.has_subscribers(2))
+
+    def test_event_stream_framing(self):
+        async def read():
+            stream = live.event_stream(self.plan.id)
+            events = [await stream.__anext__()]
+            live.broker.deliver(self.plan.id, {'type': 'reload'})
+            events.append(await stream.__anext__())
+            with mock.patch('meals.live.KEEPALIVE_SECONDS', 0):
+                events.append(await stream.__anext__())
+            await stream.aclose()
+            return events
+
+        self.assertEqual(async_to_sync(read)(), [
+            f'retry: {live.RETRY_MILLISECONDS}\n\n', 'data: {"type": "reload"}\n\n', ': keepalive\n\n',
+        ])
+        self.assertFalse(live.broker.has_subscribers(self.plan.id))
+
+    @mock.patch('meals.live.get_backend')
+    def test_entry_changes_publish_on_commit(self, get_backend):
+        backend = get_backend.return_value
+        backend.wants.return_value = True
+        entry = self.plan.entries.get(day_of_week=2, meal_type='dinner')
+        with self.captureOnCommitCallbacks() as callbacks:
+            entry.meal = self.meals[-1]
+            entry.save()
+        backend.publish.assert_not_called()
+        for callback in callbacks:
+            callback()
+        (plan_id, message), _ = backend.publish.call_args
+        self.assertEqual(plan_id, self.plan.id)
+        self.assertEqual({cell['day'] for cell in message['cells']}, {2})
+        self.assertEqual(len(message['cells']), len(MealPlanEntry.MEAL_TYPE_CHOICES))
+        dinner, = [cell for cell in message['cells'] if cell['meal_type'] == 'dinner']
+        self.assertIn(self.meals[-1].name, dinner['html'])
+
+    def test_notify_payloads_fit_the_limit(self):
+        backend = live.PostgresNotifyBackend(live.broker)
+
+        def cells(days, size):
+            return {'type': 'cells', 'cells': [
+                {'day': day, 'meal_type': meal_type, 'html': 'x' * size}
+                for day in days for meal_type, _ in MealPlanEntry.MEAL_TYPE_CHOICES
+            ]}
+
+        self.assertEqual(len(backend.payloads(1, cells(range(7), 10))), 1)
+        # Too large for one notification: one per day.
+        payloads = backend.payloads(1, cells(range(7), 500))
+        self.assertEqual([json.loads(payload)['message']['cells'][0]['day'] for payload in payloads], list(range(7)))
+        # A single day that is still too large becomes a reload.
+        payloads = backend.payloads(1, cells([0, 1], 3000))
+        self.assertEqual([json.loads(payload) for payload in payloads], [{'plan_id': 1, 'message': live.RELOAD}] * 2)
+        for payload in payloads:
+            self.assertLess(len(payload.encode()), live.NOTIFY_PAYLOAD_BYTES)
+
+
+class WarmCachesTests(PlannerDataMixin, TestCase):
+    """warm_caches fills a shared cache with the active users' planner fragments."""
+
+    def warm(self, max_entries=300):
+        out, err = StringIO(), StringIO()
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+            'OPTIONS': {'MAX_ENTRIES': max_entries},
+        }}):
+            call_command('warm_caches', stdout=out, stderr=err)
+            keys = len(list(Path(location).glob('*.djcache')))
+        return keys, out.getvalue(), err.getvalue()
+
+    def test_refuses_a_per_process_cache(self):
+        with self.assertRaisesMessage(CommandError, 'set CACHE_URL to a shared cache'):
+            call_command('warm_caches', stdout=StringIO())
+
+    def test_warms_current_and_next_week(self):
+        keys, out, err = self.warm()
+        # The admin is the one active user: two plans, the second created now.
+        self.assertEqual(WeeklyMealPlan.objects.filter(user=self.user).count(), WEEK_COUNT + 1)
+        self.assertEqual(keys, 2 * 2 + 3 + 1)
+        self.assertIn('Warmed 2 plans for 1 users (8 cache keys)', out)
+        self.assertEqual(err, '')
+
+    def test_warns_when_the_cache_is_too_small(self):
+        _, _, err = self.warm(max_entries=5)
+        self.assertIn('MAX_ENTRIES=5, fewer than the 8 just warmed', err)
+
+
+class ArchiveTests(PlannerDataMixin, TestCase):
+    """Archived weeks keep their derived data and are still served by every reader."""
+
+    def setUp(self):
+        super().setUp()
+        self.old = self.plans[0]
+        self.old_week = f'{self.old.year}/{self.old.week_number}'
+        self.old.entries.filter(day_of_week=6, meal_type='snack').update(notes='leftovers')
+
+    def entries(self):
+        return sorted(MealPlanEntry.objects.filter(meal_plan__user=self.user).values_list(
+            'meal_plan__year', 'meal_plan__week_number', 'day_of_week', 'meal_type', 'meal_id', 'notes'
+        ))
+
+    def derived(self):
+        return (
+            sorted(DailyNutritionRollup.objects.values_list('year', 'week_number', 'day_of_week', 'calories')),
+            sorted(MealUsageStats.objects.values_list('meal_id', 'times_planned', 'last_planned_week_start')),
+        )
+
+    def archive(self):
+        archive_plans([self.old])
+
+    def test_round_trip(self):
+        entries, derived = self.entries(), self.derived()
+        self.archive()
+        self.assertFalse(WeeklyMealPlan.objects.filter(id=self.old.id).exists())
+        self.assertEqual(self.derived(), derived)
+        restore_weeks(ArchivedWeek.objects.all())
+        self.assertFalse(ArchivedWeek.objects.exists())
+        self.assertEqual(self.entries(), entries)
+        self.assertEqual(self.derived(), derived)
+
+    def test_rollups_follow_nutrition_and_rebuilds(self):
+        def old_rollup(day):
+            return DailyNutritionRollup.objects.get(
+                user=self.user, year=self.old.year, week_number=self.old.week_number, day_of_week=day
+            )
+
+        self.archive()
+        # Day 0 holds meals 0-3, with 400-403 calories.
+        self.assertEqual(old_rollup(0).calories, 1606)
+        nutrition = self.meals[0].nutrition
+        nutrition.calories_per_serving = 100
+        nutrition.save()
+        self.assertEqual(old_rollup(0).calories, 1606 - 400 + 100)
+        derived = self.derived()
+        rollups.rebuild_all()
+        self.assertEqual(self.derived(), derived)
+        self.assertEqual((old_rollup(0).entry_count, old_rollup(0).calories), (4, 1306))
+
+    def test_restore_only_fills_empty_slots(self):
+        self.archive()
+        plan, = ensure_weekly_plans(self.user, list(iter_iso_weeks(self.old.year, self.old.week_number, 1)))
+        MealPlanEntry.objects.create(meal_plan=plan, day_of_week=0, meal_type='breakfast', meal=self.meals[11])
+        restore_weeks(ArchivedWeek.objects.all())
+        self.assertEqual(plan.entries.get(day_of_week=0, meal_type='breakfast').meal, self.meals[11])
+        self.assertEqual(plan.entries.count(), 28)
+
+    def test_shopping_list(self):
+        path = f'/weekly-plan/{self.old_week}/shopping-list/?weeks={WEEK_COUNT}'
+        before = self.client.get(path).json()
+        self.archive()
+        self.assertEqual(self.client.get(path).json(), before)
+
+    def test_export(self):
+        before = b''.join(self.client.get('/export/plans.csv').streaming_content)
+        self.archive()
+        self.assertEqual(b''.join(self.client.get('/export/plans.csv').streaming_content), before)
+
+    def test_clone_from_archived_week(self):
+        self.archive()
+        self.meals[1].delete()
+        next_monday = iso_week_start(self.plan.year, self.plan.week_number) + timezone.timedelta(weeks=1)
+        year, week, _ = next_monday.isocalendar()
+        response = self.client.post('/clone-week/', json.dumps({
+            'source_year': self.old.year, 'source_week': self.old.week_number, 'target_year': year, 'target_week': week,
+        }), content_type='application/json')
+        # Meal 1 was planned in two of the archived slots.
+        self.assertEqual(response.json()['created'], 28 - 2)
+
+    @mock.patch('meals.views.genai')
+    def test_ai_history(self, genai):
+        genai.GenerativeModel.return_value.generate_content.return_value = mock.Mock(text='Soup', usage_metadata=None)
+        self.archive()
+        self.client.post('/plan-with-ai/', {'prompt': 'More fish'})
+        prompt = genai.GenerativeModel.return_value.generate_content.call_args.args[0]
+        self.assertIn(f'- {self.old.name}, Monday, Breakfast: {self.meals[0].name}', prompt)
+        self.assertEqual(prompt.count(': Chicken dish'), WEEK_COUNT * 28)
+
+
+class BulkImportExportTests(PlannerDataMixin, TestCase):
+
+    def export(self, kind, fmt='jsonl'):
+        return b''.join(self.client.get(f'/export/{kind}.{fmt}').streaming_content).decode()
+
+    def import_(self, kind, text, fmt='jsonl', on_conflict='skip', user=None):
+        return import_records(parse_records(text.splitlines(keepends=True), fmt), kind, user or self.user,
+                              on_conflict=on_conflict)
+
+    def test_round_trip(self):
+        for fmt in ('jsonl', 'csv'):
+            with self.subTest(fmt):
+                meals, plans = self.export('meals', fmt), self.export('plans', fmt)
+                Meal.objects.all().delete()
+                self.assertEqual(self.import_('meals', meals, fmt)['created'], MEAL_COUNT)
+                self.assertEqual(self.import_('plans', plans, fmt)['created'], WEEK_COUNT * 28)
+                self.assertEqual(self.export('meals', fmt), meals)
+                self.assertEqual(self.export('plans', fmt), plans)
+
+    async def test_export_is_async_under_asgi(self):
+        response = await self.async_client.get('/export/meals.jsonl')
+        self.assertTrue(response.is_async)
+        self.assertEqual(len([line async for line in response.streaming_content]), MEAL_COUNT)
+
+    def test_skip_keeps_stored_meals(self):
+        stats = self.import_('meals', json.dumps({'name': self.meals[0].name, 'meal_type': 'snack'}))
+        self.assertEqual((stats['created'], stats['skipped']), (0, 1))
+        self.assertEqual(Meal.objects.get(id=self.meals[0].id).meal_type, 'lunch or dinner')
+
+    def test_update_only_changes_carried_fields(self):
+        meal = self.meals[0]
+        stats = self.import_('meals', json.dumps({
+            'name': meal.name, 'meal_type': 'snack', 'servings': 4, 'calories_per_serving': 250,
+        }), on_conflict='update')
+        self.assertEqual(stats['updated'], 1)
+        meal = Meal.objects.select_related('recipe', 'nutrition').get(id=meal.id)
+        self.assertEqual((meal.meal_type, meal.description), ('snack', 'Spicy chicken'))
+        self.assertEqual((meal.recipe.servings, meal.recipe.prep_time, meal.recipe.instructions), (4, 10, 'Cook.'))
+        self.assertEqual((meal.nutrition.calories_per_serving, meal.nutrition.protein_grams), (250, None))
+        # Rollups follow the new calories: day 0 holds meals 0-3.
+        rollup = DailyNutritionRollup.objects.get(
+            user=self.user, year=self.plan.year, week_number=self.plan.week_number, day_of_week=0,
+        )
+        self.assertEqual(rollup.calories, 1606 - 400 + 250)
+
+    def test_other_users_meals_are_not_touched(self):
+        other = User.objects.create_user('other')
+        for on_conflict in ('skip', 'update'):
+            stats = self.import_('meals', json.dumps({
+                'name': self.meals[0].name, 'meal_type': 'snack', 'description': 'Mine now', 'servings': 9,
+            }) + '\n' + json.dumps({'name': 'Toast', 'meal_type': 'breakfast'}), on_conflict=on_conflict, user=other)
+            self.assertEqual(stats['errors'], [
+                {'line': 1, 'error': f"meal '{self.meals[0].name}' belongs to another user"},
+            ])
+        meal = Meal.objects.select_related('recipe').get(id=self.meals[0].id)
+        self.assertEqual((meal.description, meal.recipe.servings, meal.created_by), ('Spicy chicken', 2, self.user))
+        self.assertEqual(Meal.objects.get(name='Toast').created_by, other)
+        stats = self.import_('plans', json.dumps({
+            'year': self.year, 'week_number': self.week, 'day_of_week': 0, 'meal_type': 'lunch',
+            'meal': 'Chicken dish 1',
+        }), user=other)
+        self.assertEqual(stats['errors'], [{'line': 1, 'error': "unknown meal 'Chicken dish 1'"}])
+
+    def test_plan_conflicts(self):
+        slot = {'year': self.plan.year, 'week_number': self.plan.week_number, 'day_of_week': 0, 'meal_type': 'lunch'}
+        record = json.dumps({**slot, 'meal': self.meals[11].name})
+        self.assertEqual(self.import_('plans', record)['skipped'], 1)
+        self.assertEqual(self.import_('plans', record, on_conflict='update')['updated'], 1)
+        entries = self.plan.entries.filter(day_of_week=0, meal_type='lunch')
+        self.assertEqual([entry.meal for entry in entries], [self.meals[11]])
+
+    def test_row_errors(self):
+        stats = self.import_('meals', '\n'.join([
+            '{"name": "Tea"}', 'not json', '[1]', '{"name": "Tea", "meal_type": "snack", "servings": "x"}',
+        ]))
+        self.assertEqual([error['line'] for error in stats['errors']], [1, 2, 3, 4])
+        self.assertEqual(stats['created'], 0)
+
+    def test_invalid_values_are_row_errors(self):
+        stats = self.import_('meals', '\n'.join(json.dumps(record) for record in [
+            {'name': 'Tea', 'meal_type': 'snack', 'prep_time': -5},
+            {'name': 'Soup', 'meal_type': 'snack', 'description': {'rich': True}},
+            {'name': 'Stew', 'meal_type': 'snack', 'protein_grams': '12345.678'},
+            {'name': 'Toast', 'meal_type': 'breakfast', 'prep_time': 5, 'protein_grams': '4.5'},
+        ]))
+        self.assertEqual([error['line'] for error in stats['errors']], [1, 2, 3])
+        self.assertIn('prep_time', stats['errors'][0]['error'])
+        self.assertEqual(stats['errors'][1]['error'], 'description must be text')
+        self.assertIn('protein_grams', stats['errors'][2]['error'])
+        # The valid row in the same chunk is still imported.
+        self.assertEqual(stats['created'], 1)
+        toast = Meal.objects.select_related('recipe', 'nutrition').get(name='Toast')
+        self.assertEqual((toast.recipe.prep_time, toast.nutrition.protein_grams), (5, Decimal('4.5')))
+        self.assertFalse(Meal.objects.filter(name__in=['Tea', 'Soup', 'Stew']).exists())
+
+    def test_invalid_update_leaves_meal_alone(self):
+        meal = self.meals[0]
+        stats = self.import_('meals', json.dumps({'name': meal.name, 'meal_type': 'snack', 'servings': -1}),
+                             on_conflict='update')
+        self.assertEqual((stats['updated'], len(stats['errors'])), (0, 1))
+        self.assertEqual(Recipe.objects.get(meal=meal).servings, 2)
+
+
+class PlanRangeTests(PlannerDataMixin, TestCase):
+
+    def path(self, weeks, stream=False):
+        first = self.plans[0]
+        return f'/weekly-plan/{first.year}/{first.week_number}/range/?weeks={weeks}' + ('&stream=1' if stream else '')
+
+    def test_columnar_grid(self):
+        data = self.client.get(self.path(WEEK_COUNT)).json()
+        self.assertEqual([week['plan_id'] for week in data['weeks']], [plan.id for plan in self.plans])
+        # Day 2's lunch (the second meal type) holds meal (2 + 1) in every week.
+        self.assertEqual(data['grid'][2][1], [self.meals[3].id] * WEEK_COUNT)
+        self.assertEqual(data['meals'][str(self.meals[3].id)]['name'], self.meals[3].name)
+
+    def test_unplanned_weeks_are_empty_columns(self):
+        data = self.client.get(f'/weekly-plan/{self.plan.year}/{self.plan.week_number}/range/?weeks=3').json()
+        self.assertEqual([week['plan_id'] for week in data['weeks']], [self.plan.id, None, None])
+        self.assertEqual(data['grid'][0][0], [self.meals[0].id, None, None])
+
+    def test_invalid_ranges_are_rejected(self):
+        first = self.plans[0]
+        for query in ('weeks=0', 'weeks=261', 'weeks=two'):
+            with self.subTest(query):
+                response = self.client.get(f'/weekly-plan/{first.year}/{first.week_number}/range/?{query}')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/weekly-plan/{first.year}/60/range/').status_code, 400)
+
+    async def test_stream_is_async_under_asgi(self):
+        response = await self.async_client.get(self.path(20, stream=True))
+        self.assertTrue(response.is_async)
+        header, *chunks = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual(len(header['meal_types']), len(MealPlanEntry.MEAL_TYPE_CHOICES))
+        self.assertEqual([len(chunk['weeks']) for chunk in chunks], [13, 7])
+        # Meals are listed once, in the first chunk that uses them.
+        self.assertEqual(len(chunks[0]['meals']), 10)
+        self.assertEqual(chunks[1]['meals'], {})
+
+    async def test_async_stream_is_one_gzip_stream(self):
+        plain = await self.async_client.get(self.path(20, stream=True))
+        body = b''.join([chunk async for chunk in plain.streaming_content])
+        compressed = await self.async_client.get(self.path(20, stream=True), headers={'accept-encoding': 'gzip'})
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self.assertEqual(decompressor.decompress(b''.join([chunk async for chunk in compressed.streaming_content])), body)
+        self.assertEqual(decompressor.unused_data, b'')
+
+
+class AsyncPageTests(PlannerDataMixin, TestCase):
+    """The read-path pages render as async views with everything their templates need loaded."""
+
+    async def test_pages_render_under_asgi(self):
+        today = timezone.now().date()
+        home = await self.async_client.get('/')
+        self.assertContains(home, f'{self.meals[today.weekday()].name}<')
+        meal_list = await self.async_client.get('/meals/')
+        for meal in self.meals:
+            self.assertContains(meal_list, f'{meal.name}<')
+        detail = await self.async_client.get(f'/meals/{self.meals[3].id}/')
+        self.assertContains(detail, 'Cook.')
+        self.assertContains(detail, '403')
+        planner = await self.async_client.get(f'/weekly-plan/{self.plan.year}/{self.plan.week_number}/')
+        self.assertContains(planner, self.meals[9].name)
+
+    async def test_other_users_meals_are_not_found(self):
+        other = await User.objects.acreate(username='cook')
+        meal = await Meal.objects.acreate(name='Private soup', meal_type='snack', created_by=other)
+        response = await self.async_client.get(f'/meals/{meal.id}/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_weeks_are_created_on_first_visit(self):
+        response = await self.async_client.get('/weekly-plan/2030/10/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(await WeeklyMealPlan.objects.filter(user=self.user, year=2030, week_number=10).aexists())
+        response = await self.async_client.get('/weekly-plan/2030/60/')
+        self.assertRedirects(response, '/weekly-plan/', fetch_redirect_response=False)
+
+
+class CompressedStaticFilesTests(SimpleTestCase):
+    """collectstatic writes precompressed siblings of the hashed text files."""
+
+    @mock.patch('meals.storage.brotli', mock.Mock(compress=zlib.compress))
+    def test_collectstatic_compresses_hashed_text_files(self):
+        css = b'.planner-cell { color: #333; padding: 4px; }\n' * 20
+        with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as root:
+            Path(source, 'app.css').write_bytes(css)
+            Path(source, 'tiny.js').write_bytes(b'let a = 1;\n')
+            Path(source, 'logo.png').write_bytes(bytes(range(256)) * 4)
+            with override_settings(
+                STATIC_ROOT=root, STATICFILES_DIRS=[source],
+                STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            ):
+                call_command('collectstatic', interactive=False, verbosity=0)
+            manifest = json.loads(Path(root, 'staticfiles.json').read_text())['paths']
+            hashed = Path(root, manifest['app.css'])
+            self.assertNotEqual(hashed.name, 'app.css')
+            self.assertEqual(gzip.decompress(Path(f'{hashed}.gz').read_bytes()), css)
+            self.assertEqual(zlib.decompress(Path(f'{hashed}.br').read_bytes()), css)
+            # Too small to be worth it, or not a compressible type.
+            for name in ('tiny.js', 'logo.png'):
+                for collected in (name, manifest[name]):
+                    self.assertTrue(Path(root, collected).exists())
+                    self.assertFalse(Path(root, f'{collected}.gz').exists() or Path(root, f'{collected}.br').exists())
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def wait_for_fill(self, pool):
+        for _ in range(200):
+            with pool._cond:
+                if not pool._filling:
+                    return
+            time.sleep(0.01)
+        self.fail('pool fill did not finish')
+
+    def test_first_checkout_opens_min_size_connections(self):
+        pool = ConnectionPool(mock.Mock, min_size=3, max_size=5)
+        self.assertEqual(pool.stats()['size'], 0)
+        conn = pool.getconn()
+        self.wait_for_fill(pool)
+        stats = pool.stats()
+        self.assertEqual((stats['size'], stats['idle'], stats['in_use']), (3, 2, 1))
+        self.assertEqual(stats['connections_opened'], 3)
+        pool.putconn(conn)
+        self.assertEqual(pool.stats()['connections_opened'], 3)
+
+    def test_fill_never_exceeds_max_size(self):
+        pool = ConnectionPool(mock.Mock, min_size=4, max_size=2)
+        pool.getconn()
+        self.wait_for_fill(pool)
+        self.assertEqual(pool.stats()['size'], 2)
+
+
+# Views whose query count grows with the request body, by design.
+UNBUDGETED_URLS = {'import_data'}
+
+
+async def _ajoin(chunks):
+    return b''.join([chunk async for chunk in chunks])
+
+
+@override_settings(QUERY_AUDIT=True, QUERY_BUDGET_STRICT=True)
+class ViewQueryBudgetTests(PlannerDataMixin, TestCase):
+    """Every view in meals/urls.py declares a query budget and stays within it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Views reading history also look up archived weeks.
+        cls.archived_year, cls.archived_week = cls.plans[0].year, cls.plans[0].week_number
+        archive_plans([cls.plans[0]])
+
+    def requests(self):
+        """Return ``{url name: (method, path, body)}`` with one representative request per URL."""
+        week = f'{self.year}/{self.week}'
+        history = f'{self.archived_year}/{self.archived_week}'
+        meal = self.meals[0]
+        target = iso_week_start(self.year, self.week) + timezone.timedelta(weeks=1)
+        plan_import = '\n'.join(
+            json.dumps({'year': self.year, 'week_number': self.week, 'day_of_week': day,
+                        'meal_type': 'snack', 'meal': meal.name})
+            for day in range(7)
+        )
+        return {
+            'home': ('get', '/', None),
+            'meal_list': ('get', '/meals/', None),
+            'meal_detail': ('get', f'/meals/{meal.id}/', None),
+            'meal_search': ('get', '/meals/search/?q=spicy chicken', None),
+            'meals_by_ingredients': ('get', '/meals/by-ingredients/?have=onion,rice', None),
+            'weekly_meal_plan': ('get', '/weekly-plan/', None),
+            'weekly_meal_plan_date': ('get', f'/weekly-plan/{week}/', None),
+            'weekly_plan_range': ('get', f'/weekly-plan/{history}/range/?weeks={WEEK_COUNT}', None),
+            'weekly_nutrition': ('get', f'/weekly-plan/{history}/nutrition/?weeks={WEEK_COUNT}', None),
+            'shopping_list': ('get', f'/weekly-plan/{history}/shopping-list/?weeks={WEEK_COUNT}', None),
+            'nutrition_trends': ('get', '/nutrition/trends/', None),
+            'plan_with_ai': ('post', '/plan-with-ai/', {'prompt': 'Quick dinners'}),
+            'plan_events': ('get', f'/weekly-plan/{self.plan.id}/events/', None),
+            'update_meal_plan_entry': ('post', '/update-meal-entry/', json.dumps({
+                'meal_plan_id': self.plan.id, 'day_of_week': 0, 'meal_type': 'lunch', 'meal_id': self.meals[5].id,
+            })),
+            'clone_meal_plan': ('post', '/clone-week/', json.dumps({
+                'source_year': self.archived_year, 'source_week': self.archived_week,
+                'target_year': target.isocalendar()[0], 'target_week': target.isocalendar()[1],
+                'weeks': 2, 'mode': 'overwrite',
+            })),
+            'save_meal_plan_template': ('post', '/save-template/', json.dumps({
+                'meal_plan_id': self.plan.id, 'name': 'Another week',
+            })),
+            'export_data': ('get', '/export/meals.jsonl', None),
+            'import_data': ('post', '/import/plans/?on_conflict=update', plan_import),
+            'db_pool_stats': ('get', '/health/db-pool/', None),
+        }
+
+    def request(self, method, path, body):
+        if method == 'get':
+            return self.client.get(path)
+        if isinstance(body, dict):
+            return self.client.post(path, body)
+        return self.client.post(path, body, content_type='application/json')
+
+    def test_every_url_has_a_budget(self):
+        for pattern in meals_urls.urlpatterns:
+            if pattern.name in UNBUDGETED_URLS:
+                continue
+            with self.subTest(pattern.name):
+                self.assertTrue(hasattr(pattern.callback, 'query_budget'), f'{pattern.name} has no @query_budget')
+
+    def test_every_url_is_covered(self):
+        self.assertEqual({pattern.name for pattern in meals_urls.urlpatterns}, set(self.requests()))
+
+    def consume(self, response):
+        """Read the whole body, so queries a streaming response runs count too."""
+        if not response.streaming:
+            return response.content
+        if response.is_async:
+            return async_to_sync(_ajoin)(response.streaming_content)
+        return b''.join(response.streaming_content)
+
+    @mock.patch('meals.views.genai')
+    @mock.patch('meals.live.STREAM_MAX_SECONDS', 0)
+    def test_views_stay_within_budget(self, genai):
+        genai.GenerativeModel.return_value.generate_content.return_value = mock.Mock(
+            text='Monday: soup', usage_metadata=None,
+        )
+        for name, (method, path, body) in self.requests().items():
+            with self.subTest(name):
+                cache.clear()
+                response = self.request(method, path, body)
+                self.assertLess(response.status_code, 400, response.content[:200] if not response.streaming else name)
+                self.consume(response)
+                response.close()
+
+    @mock.patch('meals.views.genai')
+    def test_budget_does_not_grow_with_history(self, genai):
+        # Doubling the planned weeks must not add queries to views that read the whole history.
+        genai.GenerativeModel.return_value.generate_content.return_value = mock.Mock(text='Soup', usage_metadata=None)
+        first = iso_week_start(self.archived_year, self.archived_week) - timezone.timedelta(weeks=WEEK_COUNT)
+        year, week, _ = first.isocalendar()
+        weeks = 2 * WEEK_COUNT
+        requests = {
+            'nutrition_trends': ('get', '/nutrition/trends/', None),
+            'plan_with_ai': ('post', '/plan-with-ai/', {'prompt': 'Quick dinners'}),
+            'weekly_plan_range': ('get', f'/weekly-plan/{year}/{week}/range/?weeks={weeks}', None),
+            'shopping_list': ('get', f'/weekly-plan/{year}/{week}/shopping-list/?weeks={weeks}', None),
+            'export_data': ('get', '/export/plans.jsonl', None),
+        }
+
+        def query_counts():
+            counts = {}
+            for name, (method, path, body) in requests.items():
+                cache.clear()
+                with audit_queries() as audit:
+                    response = self.request(method, path, body)
+                    self.assertEqual(response.status_code, 200, name)
+                    self.consume(response)
+                counts[name] = audit.count
+            return counts
+
+        before = query_counts()
+        for plan in ensure_weekly_plans(self.user, list(iter_iso_weeks(year, week, WEEK_COUNT))):
+            MealPlanEntry.objects.bulk_create([
+                MealPlanEntry(meal_plan=plan, day_of_week=day, meal_type='dinner', meal=self.meals[day])
+                for day in range(7)
+            ])
+        # bulk_create sends no signals, so bring the derived tables up to date by hand.
+        rollups.rebuild_all()
+        usage.rebuild()
+        self.assertEqual(query_counts(), before)
+
+
+@override_settings(QUERY_AUDIT=True, QUERY_BUDGET_STRICT=True)
+class AdminQueryBudgetTests(PlannerDataMixin, TestCase):
+    """Admin changelists load related rows with the page, not per row."""
+
+    def test_changelists(self):
+        # Session, user, two counts and the page itself, plus the choices of
+        # list filters on users or distinct values.
+        budgets = {'meal': 6, 'recipe': 7, 'nutrition': 5, 'mealplanentry': 6, 'weeklymealplan': 7}
+        for model, budget in budgets.items():
+            with self.subTest(model), query_budget(budget, f'{model} changelist'):
+                self.assertEqual(self.client.get(f'/admin/meals/{model}/').status_code, 200)
+
+    def test_similar_meal_search(self):
+        response = self.client.get('/admin/meals/meal/search-similar/?q=chicken')
+        self.assertEqual(len(response.json()['meals']), 10)
+
+
+class QueryAuditTests(PlannerDataMixin, TestCase):
+
+    def test_repeated_shapes_name_the_call_site(self):
+        with audit_queries() as audit:
+            for meal in Meal.objects.all():
+                meal.recipe
+        (shape, count, sites), = audit.repeated()
+        self.assertEqual(count, MEAL_COUNT)
+        self.assertIn('meals_recipe', shape)
+        self.assertIn('meals/tests.py', next(iter(sites)))
+
+    def test_in_lists_share_a_shape(self):
+        with audit_queries() as audit:
+            for size in range(1, 4):
+                list(Meal.objects.filter(id__in=[meal.id for meal in self.meals[:size]]))
+        self.assertEqual(len(audit.repeated()), 1)
+
+    @override_settings(QUERY_AUDIT=True, QUERY_BUDGET_STRICT=True)
+    def test_budget_raises_when_strict(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'over its budget of 1'):
+            with query_budget(1):
+                list(Meal.objects.all())
+                list(Recipe.objects.all())
+
+    @override_settings(QUERY_AUDIT=True, QUERY_BUDGET_STRICT=True)
+    def test_budget_counts_streamed_queries(self):
+        @query_budget(1)
+        def view(request):
+            return StreamingHttpResponse(meal.recipe.instructions for meal in Meal.objects.all())
+
+        response = view(None)
+        with self.assertRaisesMessage(QueryBudgetExceeded, f'ran {MEAL_COUNT + 1} queries'):
+            b''.join(response)
+
+    @override_settings(QUERY_AUDIT=True)
+    def test_budget_logs_by_default(self):
+        with self.assertLogs('meals.queries', logging.WARNING):
+            with query_budget(0):
+                list(Meal.objects.all())
+
+    @override_settings(QUERY_AUDIT=False, QUERY_BUDGET_STRICT=True)
+    def test_budget_is_off_without_audit(self):
+        with query_budget(0):
+            list(Meal.objects.all())
+
+    @override_settings(QUERY_AUDIT=True)
+    @modify_settings(MIDDLEWARE={'prepend': 'meals.middleware.QueryAuditMiddleware'})
+    def test_middleware_reports_query_count(self):
+        with self.assertNoLogs('meals.middleware', logging.WARNING):
+            response = self.client.get(f'/weekly-plan/{self.year}/{self.week}/')
+        self.assertGreater(int(response['X-Query-Count']), 0)
+
+
+class PlannerEditTests(PlannerDataMixin, TestCase):
+    """Planner cell edits are idempotent, skip no-ops and drop out-of-order versions."""
+
+    def edit(self, meal, version=None, key=None, day=0):
+        body = {'meal_plan_id': self.plan.id, 'day_of_week': day, 'meal_type': 'dinner',
+                'meal_id': meal.id if meal else ''}
+        if version is not None:
+            body.update(client_id='page-1', client_version=version)
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post('/update-meal-entry/', json.dumps(body), content_type='application/json', **headers)
+
+    def current_meal(self, day=0):
+        return MealPlanEntry.objects.get(meal_plan=self.plan, day_of_week=day, meal_type='dinner').meal
+
+    def test_retry_with_same_key_is_replayed(self):
+        first = self.edit(self.meals[7], key='edit-1')
+        self.edit(self.meals[8])
+        retry = self.edit(self.meals[7], key='edit-1')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.current_meal(), self.meals[8])
+
+    def test_invalid_cells_are_rejected(self):
+        for day, meal_type in ((9, 'dinner'), (-1, 'dinner'), ('x', 'dinner'), (0, 'brunch'), (None, 'dinner')):
+            with self.subTest(day=day, meal_type=meal_type):
+                body = {'meal_plan_id': self.plan.id, 'day_of_week': day, 'meal_type': meal_type,
+                        'meal_id': self.meals[7].id}
+                response = self.client.post('/update-meal-entry/', json.dumps(body), content_type='application/json',
+                                            HTTP_IDEMPOTENCY_KEY='bad-cell')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.plan.entries.count(), 28)
+        # The rejected requests left no idempotency marker behind.
+        self.assertEqual(self.edit(self.meals[7], key='bad-cell').status_code, 200)
+
+    def test_day_may_be_sent_as_text(self):
+        body = {'meal_plan_id': self.plan.id, 'day_of_week': '1', 'meal_type': 'dinner', 'meal_id': self.meals[7].id}
+        self.client.post('/update-meal-entry/', json.dumps(body), content_type='application/json')
+        self.assertEqual(self.current_meal(day=1), self.meals[7])
+
+    def test_same_meal_writes_nothing(self):
+        meal = self.current_meal()
+        with audit_queries() as audit:
+            response = self.edit(meal)
+        self.assertFalse(response.json()['changed'])
+        self.assertFalse(any(shape.startswith(('UPDATE', 'INSERT', 'DELETE')) for shape, _ in audit.queries))
+
+    def test_removing_an_empty_slot_writes_nothing(self):
+        self.edit(None)
+        self.assertFalse(self.edit(None).json()['changed'])
+
+    def test_stale_version_is_rejected(self):
+        self.assertEqual(self.edit(self.meals[7], version=2).status_code, 200)
+        stale = self.edit(self.meals[8], version=1)
+        self.assertEqual(stale.status_code, 409)
+        self.assertIn(self.meals[7].name, stale.json()['html'])
+        self.assertEqual(self.current_meal(), self.meals[7])
+
+    def test_versions_outlive_the_cache(self):
+        self.edit(self.meals[7], version=2)
+        cache.clear()
+        self.assertEqual(self.edit(self.meals[8], version=1).status_code, 409)
+        self.assertEqual(self.current_meal(), self.meals[7])
+
+    def test_versions_are_per_cell(self):
+        self.edit(self.meals[7], version=2)
+        self.assertEqual(self.edit(self.meals[8], version=1, day=1).status_code, 200)
+        self.assertEqual(self.current_meal(day=1), self.meals[8])
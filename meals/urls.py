@@ -7,8 +7,20 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('meals/', views.meal_list, name='meal_list'),
     path('meals/<int:meal_id>/', views.meal_detail, name='meal_detail'),
+    path('meals/search/', views.meal_search, name='meal_search'),
+    path('meals/by-ingredients/', views.meals_by_ingredients, name='meals_by_ingredients'),
     path('weekly-plan/', views.weekly_meal_plan, name='weekly_meal_plan'),
     path('weekly-plan/<int:year>/<int:week>/', views.weekly_meal_plan, name='weekly_meal_plan_date'),
+    path('weekly-plan/<int:year>/<int:week>/range/', views.weekly_plan_range, name='weekly_plan_range'),
+    path('weekly-plan/<int:year>/<int:week>/nutrition/', views.weekly_nutrition, name='weekly_nutrition'),
+    path('weekly-plan/<int:year>/<int:week>/shopping-list/', views.shopping_list, name='shopping_list'),
+    path('nutrition/trends/', views.nutrition_trends, name='nutrition_trends'),
     path('plan-with-ai/', views.plan_with_ai, name='plan_with_ai'),
+    path('weekly-plan/<int:meal_plan_id>/events/', views.plan_events, name='plan_events'),
     path('update-meal-entry/', views.update_meal_plan_entry, name='update_meal_plan_entry'),
+    path('clone-week/', views.clone_meal_plan, name='clone_meal_plan'),
+    path('save-template/', views.save_meal_plan_template, name='save_meal_plan_template'),
+    path('export/<str:kind>.<str:fmt>', views.export_data, name='export_data'),
+    path('import/<str:kind>/', views.import_data, name='import_data'),
+    path('health/db-pool/', views.db_pool_stats, name='db_pool_stats'),
 ]
@@ -0,0 +1,259 @@
+"""Per-(user, meal) planning counters kept in MealUsageStats.
+
+Entry changes are turned into deltas (slot counts plus the weeks gained
+or lost) and applied with one UPDATE per user, so signal handlers and
+bulk operations never scan MealPlanEntry. Removing an entry only
+recomputes the meal's last planned week. Archived weeks stay counted:
+archiving and restoring adjust nothing except entries a restore drops.
+``rebuild()`` recomputes everything from entries and the archive.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import Case, DateField, F, IntegerField, Max, Q, Value, When
+from django.db.models.functions import Greatest
+
+from . import caching
+from .models import ArchivedWeek, Meal, MealPlanEntry, MealUsageStats, WeeklyMealPlan
+from .utils import iso_week_start
+
+SLOT_FIELDS = {meal_type: f'{meal_type}_count' for meal_type, _ in MealPlanEntry.MEAL_TYPE_CHOICES}
+BATCH_SIZE = 500
+
+# (deltas, plan info memo) collected inside a batched() block, or None outside one.
+_batch = ContextVar('usage_batch', default=None)
+
+
+class _Delta:
+    __slots__ = ('counts', 'latest_added', 'removed')
+
+    def __init__(self):
+        self.counts = Counter()
+        self.latest_added = None
+        self.removed = False
+
+
+def _plan_info(plan_id, entry=None, memo=None):
+    """Return (user_id, week_start) of a plan, using the entry's cached plan when there is one."""
+    if memo is not None and plan_id in memo:
+        return memo[plan_id]
+    if entry is not None and entry.meal_plan_id == plan_id and MealPlanEntry.meal_plan.is_cached(entry):
+        plan = entry.meal_plan
+        info = plan.user_id, iso_week_start(plan.year, plan.week_number)
+    else:
+        user_id, year, week = WeeklyMealPlan.objects.values_list('user_id', 'year', 'week_number').get(id=plan_id)
+        info = user_id, iso_week_start(year, week)
+    if memo is not None:
+        memo[plan_id] = info
+    return info
+
+
+def _record(changes):
+    """Apply or batch ``(user_id, meal_id, meal_type, week_start, sign)`` changes."""
+    batch = _batch.get()
+    deltas = batch[0] if batch is not None else defaultdict(_Delta)
+    for user_id, meal_id, meal_type, week_start, sign in changes:
+        delta = deltas[(user_id, meal_id)]
+        delta.counts[meal_type] += sign
+        if sign > 0:
+            if delta.latest_added is None or week_start > delta.latest_added:
+                delta.latest_added = week_start
+        else:
+            delta.removed = True
+    if batch is None:
+        _apply(deltas)
+
+
+def _entry_changes(entries, sign, memo=None):
+    for entry in entries:
+        user_id, week_start = _plan_info(entry.meal_plan_id, entry, memo)
+        yield user_id, entry.meal_id, entry.meal_type, week_start, sign
+
+
+def _stored_slot(entry):
+    """Return the (meal_plan_id, meal_id, meal_type) an entry was loaded with, or None if unknown."""
+    loaded = getattr(entry, '_loaded_values', None) or {}
+    if not all(field in loaded for field in ('meal_plan_id', 'meal_id', 'meal_type')):
+        return None
+    return loaded['meal_plan_id'], loaded['meal_id'], loaded['meal_type']
+
+
+def entry_saved(entry, created):
+    """Count a saved entry, moving its old slot's count if an update changed meal, type or plan."""
+    batch = _batch.get()
+    memo = batch[1] if batch is not None else {}
+    current = (entry.meal_plan_id, entry.meal_id, entry.meal_type)
+    stored = None if created else _stored_slot(entry)
+    if not created and (stored is None or stored == current):
+        return
+    changes = list(_entry_changes([entry], 1, memo))
+    if stored is not None:
+        plan_id, meal_id, meal_type = stored
+        user_id, week_start = _plan_info(plan_id, memo=memo)
+        changes.append((user_id, meal_id, meal_type, week_start, -1))
+    _record(changes)
+
+
+def entry_deleted(entry):
+    batch = _batch.get()
+    memo = batch[1] if batch is not None else {}
+    plan_id, meal_id, meal_type = _stored_slot(entry) or (entry.meal_plan_id, entry.meal_id, entry.meal_type)
+    user_id, week_start = _plan_info(plan_id, entry, memo)
+    _record([(user_id, meal_id, meal_type, week_start, -1)])
+
+
+def entries_added(entries):
+    """Count entries created with ``bulk_create``, which sends no signals."""
+    batch = _batch.get()
+    _record(_entry_changes(entries, 1, batch[1] if batch is not None else {}))
+
+
+def slots_dropped(changes):
+    """Uncount ``(user_id, meal_id, meal_type, week_start)`` slots that left the plan history."""
+    _record((user_id, meal_id, meal_type, week_start, -1) for user_id, meal_id, meal_type, week_start in changes)
+
+
+@contextmanager
+def batched():
+    """Collect the deltas recorded in the block and apply them together when it exits."""
+    if _batch.get() is not None:
+        yield
+        return
+    batch = (defaultdict(_Delta), {})
+    token = _batch.set(batch)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+    _apply(batch[0])
+
+
+def _apply(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if any(delta.counts.values()) or delta.removed}
+    if not deltas:
+        return
+    MealUsageStats.objects.bulk_create(
+        [
+            MealUsageStats(user_id=user_id, meal_id=meal_id)
+            for (user_id, meal_id), delta in deltas.items()
+            if delta.latest_added is not None
+        ],
+        ignore_conflicts=True,
+    )
+    by_user = defaultdict(dict)
+    for (user_id, meal_id), delta in deltas.items():
+        by_user[user_id][meal_id] = delta
+
+    for user_id, meals in by_user.items():
+        updates = {}
+        for meal_type, field in SLOT_FIELDS.items():
+            updates[field] = _add_per_meal(field, {meal_id: delta.counts[meal_type] for meal_id, delta in meals.items()})
+        updates['times_planned'] = _add_per_meal(
+            'times_planned', {meal_id: sum(delta.counts.values()) for meal_id, delta in meals.items()}
+        )
+        latest = [
+            When(
+                Q(meal_id=meal_id) & (Q(last_planned_week_start__isnull=True) | Q(last_planned_week_start__lt=delta.latest_added)),
+                then=Value(delta.latest_added),
+            )
+            for meal_id, delta in meals.items()
+            if delta.latest_added is not None
+        ]
+        if latest:
+            updates['last_planned_week_start'] = Case(
+                *latest, default=F('last_planned_week_start'), output_field=DateField()
+            )
+        updates = {field: value for field, value in updates.items() if value is not None}
+        if updates:
+            MealUsageStats.objects.filter(user_id=user_id, meal_id__in=meals).update(**updates)
+        removed = [meal_id for meal_id, delta in meals.items() if delta.removed]
+        if removed:
+            _refresh_last_planned(user_id, removed)
+        caching.bump_version('usage', user_id)
+
+
+def _add_per_meal(field, amounts):
+    whens = [When(meal_id=meal_id, then=Value(amount)) for meal_id, amount in amounts.items() if amount]
+    if not whens:
+        return None
+    # Never below zero, even if the stats were stale before the change.
+    return Greatest(F(field) + Case(*whens, default=Value(0), output_field=IntegerField()), Value(0))
+
+
+def _latest_weeks(user_id, meal_ids=None):
+    """Return ``{meal_id: week_start}`` of the latest week each meal is planned in, archive included."""
+    entries = MealPlanEntry.objects.filter(meal_plan__user_id=user_id)
+    if meal_ids is not None:
+        entries = entries.filter(meal_id__in=meal_ids)
+    latest = {
+        meal_id: iso_week_start(key // 100, key % 100)
+        for meal_id, key in entries.values('meal_id').annotate(
+            key=Max(F('meal_plan__year') * 100 + F('meal_plan__week_number'))
+        ).values_list('meal_id', 'key')
+    }
+    missing = None if meal_ids is None else set(meal_ids) - set(latest)
+    if missing is None or missing:
+        # Archived weeks are older than live ones, so newest first stops early.
+        archived = ArchivedWeek.objects.filter(user_id=user_id).order_by('-year', '-week_number').values_list(
+            'year', 'week_number', 'slots'
+        )
+        for year, week, slots in archived.iterator(chunk_size=BATCH_SIZE):
+            week_start = iso_week_start(year, week)
+            for meal_id in slots:
+                if meal_id is not None and (missing is None or meal_id in missing):
+                    latest.setdefault(meal_id, week_start)
+                    if missing is not None:
+                        missing.discard(meal_id)
+            if missing is not None and not missing:
+                break
+    return latest
+
+
+def _refresh_last_planned(user_id, meal_ids):
+    latest = _latest_weeks(user_id, meal_ids)
+    MealUsageStats.objects.filter(user_id=user_id, meal_id__in=meal_ids).update(
+        last_planned_week_start=Case(
+            *[When(meal_id=meal_id, then=Value(latest[meal_id])) for meal_id in meal_ids if meal_id in latest],
+            default=Value(None),
+            output_field=DateField(),
+        )
+    )
+
+
+def rebuild(user_ids=None):
+    """Recompute the stats of the given users (all users when None) from entries and archived weeks."""
+    if user_ids is None:
+        user_ids = set(WeeklyMealPlan.objects.values_list('user_id', flat=True).distinct())
+        user_ids |= set(ArchivedWeek.objects.values_list('user_id', flat=True).distinct())
+    count = 0
+    for user_id in user_ids:
+        counts = defaultdict(Counter)
+        for meal_id, meal_type in MealPlanEntry.objects.filter(meal_plan__user_id=user_id).values_list(
+            'meal_id', 'meal_type'
+        ).iterator(chunk_size=BATCH_SIZE):
+            counts[meal_id][meal_type] += 1
+        for week in ArchivedWeek.objects.filter(user_id=user_id).only('slots', 'notes').iterator(chunk_size=BATCH_SIZE):
+            for _, meal_type, meal_id, _ in week.slot_entries():
+                counts[meal_id][meal_type] += 1
+        latest = _latest_weeks(user_id)
+        stats = [
+            MealUsageStats(
+                user_id=user_id,
+                meal_id=meal_id,
+                times_planned=sum(slot_counts.values()),
+                last_planned_week_start=latest.get(meal_id),
+                **{field: slot_counts[meal_type] for meal_type, field in SLOT_FIELDS.items()},
+            )
+            for meal_id, slot_counts in counts.items()
+        ]
+        # Archived slots may name meals deleted since; there is nothing left to count them against.
+        existing = set(Meal.objects.filter(id__in=counts).values_list('id', flat=True))
+        stats = [row for row in stats if row.meal_id in existing]
+        with transaction.atomic():
+            MealUsageStats.objects.filter(user_id=user_id).delete()
+            MealUsageStats.objects.bulk_create(stats, batch_size=BATCH_SIZE)
+        caching.bump_version('usage', user_id)
+        count += len(stats)
+    return count
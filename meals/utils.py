@@ -1,4 +1,10 @@
+from datetime import date, timedelta
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+
+_END = object()
 
 def get_default_user():
     """Get the default user for the application."""
@@ -6,3 +12,41 @@ def get_default_user():
         return User.objects.get(username='admin')
     except User.DoesNotExist:
         return User.objects.filter(is_superuser=True).first() or User.objects.first()
+
+async def aget_default_user():
+    """Async version of get_default_user() for async views."""
+    try:
+        return await User.objects.aget(username='admin')
+    except User.DoesNotExist:
+        return await User.objects.filter(is_superuser=True).afirst() or await User.objects.afirst()
+
+def iso_week_start(year, week):
+    """Return the Monday of an ISO year/week, raising ValueError if it does not exist."""
+    return date.fromisocalendar(int(year), int(week), 1)
+
+def iter_iso_weeks(year, week, count):
+    """Yield (year, week, week_start) for ``count`` consecutive ISO weeks."""
+    week_start = iso_week_start(year, week)
+    for _ in range(count):
+        iso = week_start.isocalendar()
+        yield iso[0], iso[1], week_start
+        week_start += timedelta(days=7)
+
+async def aiter_sync(iterable):
+    """Yield the items of a sync iterable (e.g. one reading the ORM), each pulled through ``sync_to_async``."""
+    iterator = iter(iterable)
+    next_item = sync_to_async(next)
+    while (item := await next_item(iterator, _END)) is not _END:
+        yield item
+
+def streaming_content(request, iterable):
+    """Return ``iterable`` in the form the server handling ``request`` streams chunk by chunk.
+
+    Under ASGI, Django 4.2 collects a sync iterator given to
+    StreamingHttpResponse into a list before sending anything, so the
+    chunks are handed over as an async iterator there. WSGI streams sync
+    iterators as they are.
+    """
+    if isinstance(request, ASGIRequest):
+        return aiter_sync(iterable)
+    return iterable
@@ -3,46 +3,82 @@ from django.contrib import messages
 from django.utils import timezone
 from datetime import timedelta, datetime
 from .forms import MealPlanEntryForm
-from .models import Meal, WeeklyMealPlan, MealPlanEntry
-from .utils import get_default_user
+from .ingredients import normalize_name
+from .models import (
+    ArchivedWeek, DailyNutritionRollup, IngredientToken, Meal, MealPlanTemplate, RecipeIngredient, WeeklyMealPlan, MealPlanEntry,
+)
+from .planning import CLONE_MODES, clone_week, save_as_template
+from .queries import query_budget
+from . import live
+from .analytics import nutrition_trends as compute_nutrition_trends
+from .archive import archived_weeks
+from .bulk import CONFLICT_MODES, FORMATS as BULK_FORMATS, KINDS, export_rows, import_records, parse_records, render_rows
+from .caching import get_version
+from .db.pool import pool_stats
+from .fragments import arender_meal_list, arender_meal_select, arender_plan_grid, render_cell, render_grid
+from .rollups import NUTRIENT_FIELDS
+from .search import search_meals
+from .utils import aget_default_user, get_default_user, iter_iso_weeks, streaming_content
 import google.generativeai as genai
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, NullIf
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+import codecs
 import json
+from collections import Counter
 
 from langsmith import traceable
 from langsmith.run_helpers import get_current_run_tree
 
-def home(request):
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+async def _aget_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+# The read-path views below are async so they run on the ASGI event loop
+# alongside the long-lived event streams. Each ORM call still hops to
+# Django's single sync thread (Django 4.2 has no async database driver),
+# so queries run one after another and are awaited in turn. Everything the
+# templates touch is loaded up front, because lazy relation access is not
+# allowed in async code.
+
+@query_budget(4)
+async def home(request):
     """Home page view with current week's meal plan preview."""
-    user = get_default_user()
+    user = await aget_default_user()
     context = {'user': user}
     
     if user:
         today = timezone.now().date()
         week_start = today - timedelta(days=today.weekday())
         week_end = week_start + timedelta(days=6)
+        iso_year, iso_week, _ = today.isocalendar()
         
-        meal_plan, created = WeeklyMealPlan.objects.get_or_create(
+        meal_plan, created = await WeeklyMealPlan.objects.aget_or_create(
             user=user,
-            name=f'Week of {week_start}',
-            week_number=today.isocalendar()[1],
-            year=today.year
+            year=iso_year,
+            week_number=iso_week,
+            defaults={'name': f'Week of {week_start}'}
         )
         
-        today_entries = MealPlanEntry.objects.filter(
-            meal_plan=meal_plan,
-            day_of_week=today.weekday()
-        ).select_related('meal')
-        
-        week_entries = MealPlanEntry.objects.filter(
-            meal_plan=meal_plan
-        ).select_related('meal')
+        week_entries = MealPlanEntry.objects.filter(meal_plan=meal_plan)
+        today_entries = await _alist(
+            week_entries.filter(day_of_week=today.weekday()).select_related('meal__recipe')
+        )
+        week_entries_count = await week_entries.acount()
         
         context.update({
             'meal_plan': meal_plan,
             'today_entries': today_entries,
-            'week_entries_count': week_entries.count(),
+            'week_entries_count': week_entries_count,
             'week_start': week_start,
             'week_end': week_end,
             'today': today,
@@ -50,21 +86,25 @@ def home(request):
     
     return render(request, 'meals/home.html', context)
 
-def meal_list(request):
+@query_budget(2)
+async def meal_list(request):
     """Display all meals."""
-    user = get_default_user()
-    meals = Meal.objects.filter(created_by=user).order_by('-created_at')
-    return render(request, 'meals/meal_list.html', {'meals': meals})
+    user = await aget_default_user()
+    return render(request, 'meals/meal_list.html', {'meal_list_html': await arender_meal_list(user)})
 
-def meal_detail(request, meal_id):
+@query_budget(2)
+async def meal_detail(request, meal_id):
     """Display details of a specific meal."""
-    user = get_default_user()
-    meal = get_object_or_404(Meal, id=meal_id, created_by=user)
+    user = await aget_default_user()
+    meal = await _aget_object_or_404(
+        Meal.objects.select_related('recipe', 'nutrition'), id=meal_id, created_by=user
+    )
     return render(request, 'meals/meal_detail.html', {'meal': meal})
 
-def weekly_meal_plan(request, year=None, week=None):
+@query_budget(5)
+async def weekly_meal_plan(request, year=None, week=None):
     """Display or create the current week's meal plan."""
-    user = get_default_user()
+    user = await aget_default_user()
     
     if year and week:
         try:
@@ -77,23 +117,30 @@ def weekly_meal_plan(request, year=None, week=None):
         year = today.isocalendar()[0]
         week = today.isocalendar()[1]
 
-    meal_plan, created = WeeklyMealPlan.objects.get_or_create(
-        user=user,
-        year=year,
-        week_number=week,
-        defaults={'name': f'Week of {week_start}'}
-    )
-    
-    entries = MealPlanEntry.objects.filter(meal_plan=meal_plan).select_related('meal')
-    
-    meal_grid = {}
-    for day in range(7):
-        meal_grid[day] = {}
-        for meal_type, _ in MealPlanEntry.MEAL_TYPE_CHOICES:
-            meal_grid[day][meal_type] = None
-    
-    for entry in entries:
-        meal_grid[entry.day_of_week][entry.meal_type] = entry
+    meal_plan = await WeeklyMealPlan.objects.filter(user=user, year=year, week_number=week).afirst()
+    meal_select_html = await arender_meal_select(user)
+    archived_week = None
+    if meal_plan is None:
+        archived_week = await ArchivedWeek.objects.filter(user=user, year=year, week_number=week).afirst()
+
+    if archived_week:
+        # Archived weeks are served read-only from their compact row.
+        slots = list(archived_week.slot_entries())
+        meals = await Meal.objects.select_related('recipe').ain_bulk({meal_id for _, _, meal_id, _ in slots})
+        meal_grid_html = render_grid([
+            MealPlanEntry(day_of_week=day, meal_type=meal_type, meal=meals[meal_id], notes=notes)
+            for day, meal_type, meal_id, notes in slots
+            if meal_id in meals
+        ])
+    else:
+        if meal_plan is None:
+            meal_plan, created = await WeeklyMealPlan.objects.aget_or_create(
+                user=user,
+                year=year,
+                week_number=week,
+                defaults={'name': f'Week of {week_start}'}
+            )
+        meal_grid_html = await arender_plan_grid(meal_plan.id)
     
     previous_week_date = week_start - timedelta(days=7)
     next_week_date = week_start + timedelta(days=7)
@@ -105,21 +152,346 @@ def weekly_meal_plan(request, year=None, week=None):
     next_week_number = next_week_date.isocalendar()[1]
 
     context = {
-        'meal_plan': meal_plan,
-        'meal_grid': meal_grid,
-        'days_of_week': MealPlanEntry.DAYS_OF_WEEK,
-        'meal_types': MealPlanEntry.MEAL_TYPE_CHOICES,
+        'meal_plan': meal_plan or archived_week,
+        'is_archived': archived_week is not None,
+        'meal_grid_html': meal_grid_html,
         'week_start': week_start,
         'previous_week_year': previous_week_year,
         'previous_week_number': previous_week_number,
         'next_week_year': next_week_year,
         'next_week_number': next_week_number,
         'is_current_week': (year == timezone.now().date().year and week == timezone.now().date().isocalendar()[1]),
-        'all_meals': Meal.objects.filter(created_by=user).order_by('name'),
+        'meal_select_html': '' if archived_week else meal_select_html,
     }
     
     return render(request, 'meals/weekly_meal_plan.html', context)
 
+RANGE_MAX_WEEKS = 260
+RANGE_STREAM_CHUNK_WEEKS = 13
+
+
+def _week_range_payload(user, weeks, seen_meal_ids=None):
+    """Build the columnar plan payload for a list of (year, week, week_start) tuples.
+
+    Plans and entries are loaded in two queries; weeks without a live plan
+    are looked up in the archive with one more query. ``grid[day][meal_type][column]``
+    holds a meal id (or None) for each week column, and ``meals`` holds each
+    referenced meal once. Meals already in ``seen_meal_ids`` are left out of
+    ``meals`` so streamed chunks do not repeat them.
+    """
+    week_filter = Q()
+    for year, week, _ in weeks:
+        week_filter |= Q(year=year, week_number=week)
+    plan_ids = {
+        (year, week): plan_id
+        for plan_id, year, week in WeeklyMealPlan.objects.filter(
+            week_filter, user=user
+        ).values_list('id', 'year', 'week_number')
+    }
+
+    archived = {}
+    if len(plan_ids) < len(weeks):
+        archive_filter = Q()
+        for year, week, _ in weeks:
+            if (year, week) not in plan_ids:
+                archive_filter |= Q(year=year, week_number=week)
+        archived = {
+            (archived_week.year, archived_week.week_number): archived_week
+            for archived_week in ArchivedWeek.objects.filter(archive_filter, user=user)
+        }
+
+    column_of_plan = {}
+    columns = []
+    for column, (year, week, week_start) in enumerate(weeks):
+        plan_id = plan_ids.get((year, week))
+        if plan_id is not None:
+            column_of_plan[plan_id] = column
+        columns.append({
+            'year': year,
+            'week': week,
+            'week_start': week_start.isoformat(),
+            'plan_id': plan_id,
+            'archived': (year, week) in archived,
+        })
+
+    meal_type_index = {meal_type: i for i, (meal_type, _) in enumerate(MealPlanEntry.MEAL_TYPE_CHOICES)}
+    grid = [
+        [[None] * len(weeks) for _ in MealPlanEntry.MEAL_TYPE_CHOICES]
+        for _ in MealPlanEntry.DAYS_OF_WEEK
+    ]
+    meals = {}
+    if seen_meal_ids is None:
+        seen_meal_ids = set()
+
+    entries = MealPlanEntry.objects.filter(
+        meal_plan_id__in=column_of_plan.keys()
+    ).values_list(
+        'meal_plan_id', 'day_of_week', 'meal_type', 'meal_id', 'meal__name', 'meal__meal_type'
+    ).order_by('id')
+    for plan_id, day, meal_type, meal_id, meal_name, meal_kind in entries:
+        if meal_type not in meal_type_index:
+            continue
+        grid[day][meal_type_index[meal_type]][column_of_plan[plan_id]] = meal_id
+        if meal_id not in seen_meal_ids:
+            seen_meal_ids.add(meal_id)
+            meals[meal_id] = {'name': meal_name, 'meal_type': meal_kind}
+
+    archived_meal_ids = set()
+    for column, (year, week, _) in enumerate(weeks):
+        if (year, week) in archived:
+            for day, meal_type, meal_id, _ in archived[(year, week)].slot_entries():
+                grid[day][meal_type_index[meal_type]][column] = meal_id
+                if meal_id not in seen_meal_ids:
+                    archived_meal_ids.add(meal_id)
+    if archived_meal_ids:
+        for meal_id, meal_name, meal_kind in Meal.objects.filter(id__in=archived_meal_ids).values_list(
+            'id', 'name', 'meal_type'
+        ):
+            seen_meal_ids.add(meal_id)
+            meals[meal_id] = {'name': meal_name, 'meal_type': meal_kind}
+
+    return {'weeks': columns, 'grid': grid, 'meals': meals}
+
+
+@query_budget(4)
+def weekly_plan_range(request, year, week):
+    """Return the plans for ``?weeks=N`` consecutive weeks as columnar JSON.
+
+    Pass ``?stream=1`` to receive newline-delimited JSON, one chunk of
+    weeks per line, which keeps memory flat for long history views.
+    """
+    try:
+        count = int(request.GET.get('weeks', 4))
+        if not 1 <= count <= RANGE_MAX_WEEKS:
+            raise ValueError
+        weeks = list(iter_iso_weeks(year, week, count))
+    except ValueError:
+        return JsonResponse(
+            {'status': 'error', 'message': f'Invalid week range (1-{RANGE_MAX_WEEKS} weeks)'},
+            status=400,
+        )
+
+    user = get_default_user()
+    header = {
+        'days': [day_name for _, day_name in MealPlanEntry.DAYS_OF_WEEK],
+        'meal_types': [meal_type for meal_type, _ in MealPlanEntry.MEAL_TYPE_CHOICES],
+    }
+
+    if request.GET.get('stream') in ('1', 'true'):
+        def stream():
+            seen_meal_ids = set()
+            yield json.dumps(header) + '\n'
+            for start in range(0, count, RANGE_STREAM_CHUNK_WEEKS):
+                chunk = weeks[start:start + RANGE_STREAM_CHUNK_WEEKS]
+                yield json.dumps(_week_range_payload(user, chunk, seen_meal_ids)) + '\n'
+
+        return StreamingHttpResponse(streaming_content(request, stream()), content_type='application/x-ndjson')
+
+    return JsonResponse({**header, **_week_range_payload(user, weeks)})
+
+@query_budget(2)
+def weekly_nutrition(request, year, week):
+    """Return per-day and per-week nutrient totals for ``?weeks=N`` weeks from the rollup table."""
+    try:
+        count = int(request.GET.get('weeks', 1))
+        if not 1 <= count <= RANGE_MAX_WEEKS:
+            raise ValueError
+        weeks = list(iter_iso_weeks(year, week, count))
+    except ValueError:
+        return JsonResponse(
+            {'status': 'error', 'message': f'Invalid week range (1-{RANGE_MAX_WEEKS} weeks)'},
+            status=400,
+        )
+
+    user = get_default_user()
+    week_filter = Q()
+    for iso_year, iso_week, _ in weeks:
+        week_filter |= Q(year=iso_year, week_number=iso_week)
+    rollups = DailyNutritionRollup.objects.filter(week_filter, user=user).values(
+        'year', 'week_number', 'day_of_week', 'entry_count', *NUTRIENT_FIELDS
+    )
+
+    empty_day = {'entry_count': 0, **{field: 0 for field in NUTRIENT_FIELDS}}
+    days_by_week = {(iso_year, iso_week): [dict(empty_day) for _ in range(7)] for iso_year, iso_week, _ in weeks}
+    for row in rollups:
+        days_by_week[(row['year'], row['week_number'])][row['day_of_week']] = {
+            'entry_count': row['entry_count'],
+            **{field: row[field] if field == 'calories' else float(row[field]) for field in NUTRIENT_FIELDS},
+        }
+
+    result = []
+    for iso_year, iso_week, week_start in weeks:
+        days = days_by_week[(iso_year, iso_week)]
+        result.append({
+            'year': iso_year,
+            'week': iso_week,
+            'week_start': week_start.isoformat(),
+            'days': days,
+            'totals': {field: sum(day[field] for day in days) for field in ['entry_count', *NUTRIENT_FIELDS]},
+        })
+    return JsonResponse({'weeks': result})
+
+@query_budget(2)
+def nutrition_trends(request):
+    """Return weekly nutrition trends over the user's whole plan history.
+
+    ``?window=N`` sets the rolling-average window in weeks and
+    ``?target_<nutrient>=value`` (e.g. ``target_calories=2000``) overrides
+    the daily targets from ``settings.NUTRITION_TARGETS``. Results are
+    cached until the user's plans or nutrition data change.
+    """
+    user = get_default_user()
+    try:
+        window = int(request.GET.get('window', 4))
+        if not 1 <= window <= 52:
+            raise ValueError
+        targets = dict(settings.NUTRITION_TARGETS)
+        for nutrient in NUTRIENT_FIELDS:
+            value = request.GET.get(f'target_{nutrient}')
+            if value:
+                targets[nutrient] = float(value)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid window or target'}, status=400)
+
+    cache_key = 'meals:nutrition-trends:{}:{}:{}:{}'.format(
+        user.id,
+        get_version('user', user.id),
+        window,
+        ','.join(f'{nutrient}={targets[nutrient]}' for nutrient in sorted(targets)),
+    )
+    trends = cache.get(cache_key)
+    if trends is None:
+        trends = compute_nutrition_trends(user, window=window, targets=targets)
+        cache.set(cache_key, trends, settings.NUTRITION_TRENDS_CACHE_TIMEOUT)
+    return JsonResponse(trends)
+
+@query_budget(4)
+def shopping_list(request, year, week):
+    """Return the aggregated ingredients needed for ``?weeks=N`` weeks of planned meals.
+
+    Each planned entry counts as one serving, so recipe quantities are
+    divided by ``Recipe.servings``; ``?servings=N`` scales the list for
+    the number of people eating.
+    """
+    try:
+        count = int(request.GET.get('weeks', 1))
+        servings = int(request.GET.get('servings', 1))
+        if not 1 <= count <= RANGE_MAX_WEEKS or servings < 1:
+            raise ValueError
+        weeks = list(iter_iso_weeks(year, week, count))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid week range or servings'}, status=400)
+
+    user = get_default_user()
+    week_filter = Q()
+    for iso_year, iso_week, _ in weeks:
+        week_filter |= Q(year=iso_year, week_number=iso_week)
+    plans = WeeklyMealPlan.objects.filter(week_filter, user=user).values('id')
+
+    per_serving = Cast('quantity', FloatField()) / Cast(NullIf('recipe__servings', 0), FloatField())
+    # Summed per recipe so meals of archived weeks can be added in before grouping by ingredient.
+    rows = list(RecipeIngredient.objects.filter(
+        recipe__meal__mealplanentry__meal_plan__in=plans
+    ).values('name', 'unit', 'recipe_id').annotate(quantity=Sum(per_serving)).order_by())
+    archived_counts = Counter(
+        meal_id
+        for archived_week in archived_weeks(user).filter(week_filter)
+        for _, _, meal_id, _ in archived_week.slot_entries()
+    )
+    if archived_counts:
+        for row in RecipeIngredient.objects.filter(recipe__meal_id__in=archived_counts).values(
+            'name', 'unit', 'recipe_id', 'recipe__meal_id', per_serving=per_serving
+        ):
+            planned = archived_counts[row['recipe__meal_id']]
+            rows.append({**row, 'quantity': None if row['per_serving'] is None else row['per_serving'] * planned})
+
+    items = {}
+    for row in rows:
+        item = items.setdefault((row['name'], row['unit']), {'quantity': None, 'recipe_ids': set()})
+        if row['quantity'] is not None:
+            item['quantity'] = (item['quantity'] or 0) + row['quantity']
+        item['recipe_ids'].add(row['recipe_id'])
+
+    return JsonResponse({
+        'weeks': [{'year': iso_year, 'week': iso_week} for iso_year, iso_week, _ in weeks],
+        'servings': servings,
+        'items': [
+            {
+                'name': name,
+                'unit': unit,
+                'quantity': None if item['quantity'] is None else round(item['quantity'] * servings, 3),
+                'meal_count': len(item['recipe_ids']),
+            }
+            for (name, unit), item in sorted(items.items())
+        ],
+    })
+
+@query_budget(2)
+def meal_search(request):
+    """Full-text search over the user's meals and recipes, e.g. ``?q=spicy lentil``."""
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid limit'}, status=400)
+    query = request.GET.get('q', '')
+    user = get_default_user()
+    return JsonResponse({'query': query, 'results': search_meals(query, user, limit=limit)})
+
+@query_budget(4)
+def meals_by_ingredients(request):
+    """Rank the user's meals by how many of their ingredients are covered by ``?have=a,b,c``.
+
+    Results are ordered by the number of missing ingredients, then by the
+    number covered, and list the missing ingredient names.
+    """
+    terms = {normalize_name(term) for term in request.GET.get('have', '').split(',')}
+    terms.discard('')
+    if not terms:
+        return JsonResponse({'status': 'error', 'message': 'Pass available ingredients as ?have=a,b,c'}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid limit'}, status=400)
+
+    user = get_default_user()
+    ingredient_count = RecipeIngredient.objects.filter(recipe=OuterRef('recipe_id')).order_by().values(
+        'recipe'
+    ).annotate(count=Count('id')).values('count')
+    ranked = list(IngredientToken.objects.filter(
+        token__in=terms, recipe__meal__created_by=user
+    ).values('recipe_id', 'recipe__meal_id', 'recipe__meal__name').annotate(
+        covered=Count('ingredient', distinct=True),
+        total=Subquery(ingredient_count, output_field=IntegerField()),
+    ).annotate(
+        missing=F('total') - F('covered'),
+    ).order_by('missing', '-covered', 'recipe__meal__name')[:limit])
+
+    covered_ids = set(IngredientToken.objects.filter(
+        token__in=terms, recipe_id__in=[row['recipe_id'] for row in ranked]
+    ).values_list('ingredient_id', flat=True))
+    missing_names = {}
+    for recipe_id, ingredient_id, name in RecipeIngredient.objects.filter(
+        recipe_id__in=[row['recipe_id'] for row in ranked]
+    ).values_list('recipe_id', 'id', 'name'):
+        if ingredient_id not in covered_ids:
+            missing_names.setdefault(recipe_id, []).append(name)
+
+    return JsonResponse({
+        'have': sorted(terms),
+        'meals': [
+            {
+                'meal_id': row['recipe__meal_id'],
+                'name': row['recipe__meal__name'],
+                'covered': row['covered'],
+                'total': row['total'],
+                'missing': row['missing'],
+                'missing_ingredients': missing_names.get(row['recipe_id'], []),
+            }
+            for row in ranked
+        ],
+    })
+
+@query_budget(4)
 @traceable
 def plan_with_ai(request):
     context = {'error': None, 'suggestion': None, 'request': request}
@@ -139,11 +511,26 @@ def plan_with_ai(request):
         meal_entries = MealPlanEntry.objects.filter(
             meal_plan__user=user,
             meal_plan__created_at__gte=four_weeks_ago
-        ).select_related('meal').order_by('meal_plan__created_at', 'day_of_week', 'meal_type')
+        ).select_related('meal', 'meal_plan')
+        history = [
+            (entry.meal_plan.created_at, entry.day_of_week, entry.meal_type, entry.meal_plan.name, entry.meal.name)
+            for entry in meal_entries
+        ]
+        recent_archived = list(archived_weeks(user).filter(created_at__gte=four_weeks_ago))
+        if recent_archived:
+            slots = [(week, slot) for week in recent_archived for slot in week.slot_entries()]
+            meal_names = dict(Meal.objects.filter(id__in={slot[2] for _, slot in slots}).values_list('id', 'name'))
+            history += [
+                (week.created_at, day, meal_type, week.name, meal_names[meal_id])
+                for week, (day, meal_type, meal_id, _) in slots
+                if meal_id in meal_names
+            ]
+        days = dict(MealPlanEntry.DAYS_OF_WEEK)
+        meal_types = dict(MealPlanEntry.MEAL_TYPE_CHOICES)
         
         past_meals_str = ""
-        for entry in meal_entries:
-            past_meals_str += f"- {entry.meal_plan.name}, {entry.get_day_of_week_display()}, {entry.get_meal_type_display()}: {entry.meal.name}\n"
+        for _, day, meal_type, plan_name, meal_name in sorted(history, key=lambda row: row[:3]):
+            past_meals_str += f"- {plan_name}, {days[day]}, {meal_types.get(meal_type, meal_type)}: {meal_name}\n"
             
         if not past_meals_str:
             past_meals_str = "No recent meal data found."
@@ -184,39 +571,259 @@ def plan_with_ai(request):
 
     return render(request, 'meals/plan_with_ai.html', context)
 
+@query_budget(2)
+async def plan_events(request, meal_plan_id):
+    """Stream live cell updates for a plan as server-sent events."""
+    user = await sync_to_async(get_default_user)()
+    if not await WeeklyMealPlan.objects.filter(id=meal_plan_id, user=user).aexists():
+        return JsonResponse({'status': 'error', 'message': 'Meal plan not found'}, status=404)
+    response = StreamingHttpResponse(live.event_stream(meal_plan_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+# Pages whose edit versions are remembered per cell; older ones are forgotten first.
+CELL_VERSION_CLIENTS = 8
+_IDEMPOTENCY_PENDING = 'pending'
+# Seconds a request holds its idempotency key while running; a crashed one frees it for retries soon after.
+IDEMPOTENCY_PENDING_TIMEOUT = 60
+_CELL_DAYS = {day for day, _ in MealPlanEntry.DAYS_OF_WEEK}
+_CELL_MEAL_TYPES = {meal_type for meal_type, _ in MealPlanEntry.MEAL_TYPE_CHOICES}
+
+
+def _idempotency_cache_key(user_id, key):
+    return f'meals:idempotency:{user_id}:{key}'
+
+
+def _clean_cell(data):
+    """Return the edit's ``(day_of_week, meal_type)``, or None unless both name a planner slot."""
+    day_of_week, meal_type = data.get('day_of_week'), data.get('meal_type')
+    if isinstance(day_of_week, str) and day_of_week.isdigit():
+        day_of_week = int(day_of_week)
+    if type(day_of_week) is not int or day_of_week not in _CELL_DAYS or meal_type not in _CELL_MEAL_TYPES:
+        return None
+    return day_of_week, meal_type
+
+
+def _save_meal_plan_cell(user, data):
+    """Apply one cell edit and return ``(status, payload)``."""
+    meal_plan_id = data.get('meal_plan_id')
+    day_of_week = data.get('day_of_week')
+    meal_type = data.get('meal_type')
+    meal_id = data.get('meal_id')
+    client_id = str(data.get('client_id') or '')[:64]
+    try:
+        client_version = int(data['client_version']) if client_id and data.get('client_version') is not None else None
+    except (TypeError, ValueError):
+        return 400, {'status': 'error', 'message': 'Invalid client version'}
+
+    with transaction.atomic():
+        # Locking the plan serializes its edits. The cell versions live on the
+        # locked row and are written in the same transaction as the edit, so
+        # the check below always sees the version of the latest committed edit.
+        meal_plan = get_object_or_404(WeeklyMealPlan.objects.select_for_update(), id=meal_plan_id, user=user)
+        entries = list(MealPlanEntry.objects.filter(
+            meal_plan=meal_plan, day_of_week=day_of_week, meal_type=meal_type
+        ).select_related('meal__recipe').order_by('id'))
+        current = entries[-1] if entries else None
+
+        cell = f'{day_of_week}:{meal_type}'
+        if client_version is not None:
+            applied = meal_plan.cell_versions.get(cell, {}).get(client_id)
+            if applied is not None and client_version <= applied:
+                return 409, {
+                    'status': 'error',
+                    'message': 'A newer change to this meal was already saved',
+                    'html': render_cell(current),
+                }
+
+        if not meal_id:
+            if entries:
+                MealPlanEntry.objects.filter(id__in=[entry.id for entry in entries]).delete()
+            payload = {'status': 'success', 'message': 'Meal removed', 'changed': bool(entries), 'html': render_cell(None)}
+        elif len(entries) == 1 and str(current.meal_id) == str(meal_id):
+            payload = {'status': 'success', 'message': 'Meal plan unchanged', 'changed': False, 'html': render_cell(current)}
+        else:
+            meal = get_object_or_404(Meal.objects.select_related('recipe'), id=meal_id, created_by=user)
+            if current is None:
+                current = MealPlanEntry.objects.create(
+                    meal_plan=meal_plan, day_of_week=day_of_week, meal_type=meal_type, meal=meal
+                )
+            else:
+                if len(entries) > 1:
+                    MealPlanEntry.objects.filter(id__in=[entry.id for entry in entries[:-1]]).delete()
+                current.meal = meal
+                current.save()
+            payload = {'status': 'success', 'message': 'Meal plan updated', 'changed': True, 'html': render_cell(current)}
+
+        if client_version is not None:
+            versions = meal_plan.cell_versions.get(cell, {})
+            versions.pop(client_id, None)
+            versions[client_id] = client_version
+            meal_plan.cell_versions[cell] = dict(list(versions.items())[-CELL_VERSION_CLIENTS:])
+            WeeklyMealPlan.objects.filter(id=meal_plan.id).update(cell_versions=meal_plan.cell_versions)
+    return 200, payload
+
+
+@query_budget(13)
 def update_meal_plan_entry(request):
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            meal_plan_id = data.get('meal_plan_id')
-            day_of_week = data.get('day_of_week')
-            meal_type = data.get('meal_type')
-            meal_id = data.get('meal_id')
-
-            user = get_default_user()
-            meal_plan = get_object_or_404(WeeklyMealPlan, id=meal_plan_id, user=user)
-
-            if not meal_id:
-                MealPlanEntry.objects.filter(
-                    meal_plan=meal_plan,
-                    day_of_week=day_of_week,
-                    meal_type=meal_type
-                ).delete()
-                return JsonResponse({'status': 'success', 'message': 'Meal removed'})
-
-            meal = get_object_or_404(Meal, id=meal_id, created_by=user)
-
-            entry, created = MealPlanEntry.objects.update_or_create(
-                meal_plan=meal_plan,
-                day_of_week=day_of_week,
-                meal_type=meal_type,
-                defaults={'meal': meal}
-            )
-            
-            return JsonResponse({'status': 'success', 'message': 'Meal plan updated'})
-        except json.JSONDecodeError:
-            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
-        except Exception as e:
-            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+    """Set or clear the meal of one planner cell.
+
+    Saving the meal a cell already holds writes nothing. With an
+    ``Idempotency-Key`` header, a retry gets the first response back without
+    writing again. With ``client_id`` and ``client_version`` (numbered per
+    cell by each page), an edit older than one already saved from the same
+    page is rejected with 409, so a late retry never undoes a newer choice.
+    A day or meal type outside the planner grid is rejected with 400.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+    cell = _clean_cell(data) if isinstance(data, dict) else None
+    if cell is None:
+        return JsonResponse({'status': 'error', 'message': 'Invalid day of week or meal type'}, status=400)
+    data['day_of_week'], data['meal_type'] = cell
+
+    user = get_default_user()
+    idempotency_key = request.headers.get('Idempotency-Key', '')[:IDEMPOTENCY_KEY_MAX_LENGTH]
+    if idempotency_key:
+        cache_key = _idempotency_cache_key(user.id, idempotency_key)
+        if not cache.add(cache_key, _IDEMPOTENCY_PENDING, IDEMPOTENCY_PENDING_TIMEOUT):
+            stored = cache.get(cache_key)
+            if stored is None or stored == _IDEMPOTENCY_PENDING:
+                return JsonResponse(
+                    {'status': 'error', 'message': 'A request with this idempotency key is in progress'}, status=409
+                )
+            status, payload = stored
+            response = JsonResponse(payload, status=status)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+    try:
+        status, payload = _save_meal_plan_cell(user, data)
+    except Http404 as e:
+        status, payload = 404, {'status': 'error', 'message': str(e)}
+    except Exception as e:
+        status, payload = 500, {'status': 'error', 'message': str(e)}
+
+    if idempotency_key:
+        if status < 500:
+            cache.set(cache_key, (status, payload), settings.IDEMPOTENCY_KEY_TIMEOUT)
+        else:
+            # Let a retry run the edit again.
+            cache.delete(cache_key)
+    return JsonResponse(payload, status=status)
+
+@query_budget(13)
+def clone_meal_plan(request):
+    """Copy a week (or a named template) into one or more consecutive target weeks.
+
+    Expects JSON with ``target_year``/``target_week``, an optional ``weeks``
+    count and ``mode`` (``merge`` or ``overwrite``), and a source given as
+    ``source_plan_id``, ``source_year``/``source_week`` or ``template``.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+
+    user = get_default_user()
+    mode = data.get('mode', 'merge')
+    try:
+        count = int(data.get('weeks', 1))
+        if mode not in CLONE_MODES or not 1 <= count <= RANGE_MAX_WEEKS:
+            raise ValueError
+        weeks = list(iter_iso_weeks(data['target_year'], data['target_week'], count))
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid target weeks or mode'}, status=400)
+
+    if data.get('template'):
+        source = get_object_or_404(MealPlanTemplate, user=user, name=data['template'])
+    elif data.get('source_plan_id'):
+        source = get_object_or_404(WeeklyMealPlan, id=data['source_plan_id'], user=user)
+    else:
+        source_week = {'year': data.get('source_year'), 'week_number': data.get('source_week')}
+        source = (
+            WeeklyMealPlan.objects.filter(user=user, **source_week).first()
+            or get_object_or_404(archived_weeks(user), **source_week)
+        )
+
+    plans, created = clone_week(source, user, weeks, mode=mode)
+    return JsonResponse({
+        'status': 'success',
+        'message': f'Copied {created} meals into {len(plans)} week(s)',
+        'created': created,
+        'meal_plan_ids': [plan.id for plan in plans],
+    })
+
+@query_budget(9)
+def save_meal_plan_template(request):
+    """Save a week's meals as a named template, e.g. ``{"meal_plan_id": 3, "name": "Busy week"}``."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+
+    name = (data.get('name') or '').strip()
+    if not name:
+        return JsonResponse({'status': 'error', 'message': 'Template name is required'}, status=400)
+    user = get_default_user()
+    meal_plan = get_object_or_404(WeeklyMealPlan, id=data.get('meal_plan_id'), user=user)
+    template = save_as_template(meal_plan, name[:100])
+    return JsonResponse({'status': 'success', 'message': 'Template saved', 'template_id': template.id})
+
+@query_budget(4)
+def export_data(request, kind, fmt):
+    """Stream the user's meals or plan entries as JSON Lines or CSV without loading them into memory."""
+    if kind not in KINDS or fmt not in BULK_FORMATS:
+        return JsonResponse({'status': 'error', 'message': 'Unknown export'}, status=404)
+    user = get_default_user()
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(
+        streaming_content(request, render_rows(export_rows(kind, user), kind, fmt)), content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+# No query budget: the queries grow with the number of bulk.CHUNK_SIZE chunks imported.
+def import_data(request, kind):
+    """Import meals or plan entries from a JSON Lines or CSV request body, read line by line.
+
+    ``?format=`` picks ``jsonl`` (default) or ``csv`` and ``?on_conflict=``
+    picks ``skip`` (default) or ``update`` for existing meal names or slots.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+    fmt = request.GET.get('format', 'jsonl')
+    on_conflict = request.GET.get('on_conflict', 'skip')
+    if kind not in KINDS or fmt not in BULK_FORMATS or on_conflict not in CONFLICT_MODES:
+        return JsonResponse({'status': 'error', 'message': 'Invalid kind, format or conflict mode'}, status=400)
+
+    user = get_default_user()
+    lines = codecs.iterdecode(request, 'utf-8')
+    try:
+        stats = import_records(parse_records(lines, fmt), kind, user, on_conflict=on_conflict)
+    except UnicodeDecodeError:
+        return JsonResponse({'status': 'error', 'message': 'Body must be UTF-8'}, status=400)
+    return JsonResponse({
+        'status': 'success',
+        'message': f"Imported {stats['created'] + stats['updated']} {kind}",
+        'created': stats['created'],
+        'updated': stats['updated'],
+        'skipped': stats['skipped'],
+        'errors': stats['errors'][:100],
+        'error_count': len(stats['errors']),
+    })
 
-    return JsonResponse({'status': 'error', 'message': 'Invalid request method'}, status=405)
+@query_budget(0)
+def db_pool_stats(request):
+    """Report the database connection pool metrics of the worker process serving the request."""
+    return JsonResponse({'status': 'success', 'pools': pool_stats()})
@@ -43,6 +43,21 @@ LOGIN_REDIRECT_URL = "admin:index"
 USE_X_FORWARDED_HOST = True
 GEMINI_API_KEY = env('GEMINI_API_KEY', default=None)
 
+# Daily nutrition goals used by the trend analytics, e.g. NUTRITION_TARGETS=calories=2000,protein_grams=60
+NUTRITION_TARGETS = env.dict("NUTRITION_TARGETS", cast={"value": float}, default={})
+NUTRITION_TRENDS_CACHE_TIMEOUT = env.int("NUTRITION_TRENDS_CACHE_TIMEOUT", default=60 * 60 * 24)
+# Rendered planner fragments are keyed by plan and meal versions, so this only bounds cache growth.
+PLANNER_CACHE_TIMEOUT = env.int("PLANNER_CACHE_TIMEOUT", default=60 * 60 * 24 * 7)
+# How long a planner edit's response is kept for replaying retries with the same Idempotency-Key.
+IDEMPOTENCY_KEY_TIMEOUT = env.int("IDEMPOTENCY_KEY_TIMEOUT", default=60 * 60 * 24)
+
+# Plans older than this many weeks are moved to the archive by `manage.py archive_meal_plans`.
+MEAL_PLAN_ARCHIVE_AFTER_WEEKS = env.int("MEAL_PLAN_ARCHIVE_AFTER_WEEKS", default=26)
+
+# Carries live plan updates to open planner pages. Use meals.live.PostgresNotifyBackend
+# to fan out across several worker processes.
+MEAL_PLAN_LIVE_BACKEND = env("MEAL_PLAN_LIVE_BACKEND", default="meals.live.LocalBackend")
+
 
 # Application definition
 
@@ -58,6 +73,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'meals.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,6 +82,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Record queries per request (meals.queries): the middleware logs repeated query shapes
+# (likely N+1 queries) and views log when they go over their query budget. Set
+# QUERY_BUDGET_STRICT to raise instead of logging.
+QUERY_AUDIT = env.bool("QUERY_AUDIT", default=DEBUG)
+QUERY_BUDGET_STRICT = env.bool("QUERY_BUDGET_STRICT", default=False)
+QUERY_AUDIT_REPEAT_THRESHOLD = env.int("QUERY_AUDIT_REPEAT_THRESHOLD", default=3)
+if QUERY_AUDIT:
+    MIDDLEWARE.insert(0, 'meals.middleware.QueryAuditMiddleware')
+
 ROOT_URLCONF = 'weekly_meals.urls'
 
 TEMPLATES = [
@@ -93,6 +118,22 @@ DATABASES = {
     "default": env.db(),
 }
 
+# Each worker process keeps a pool of PostgreSQL connections instead of connecting per request.
+if DATABASES["default"]["ENGINE"] == "django.db.backends.postgresql" and env.bool("DATABASE_POOL", default=True):
+    DATABASES["default"]["ENGINE"] = "meals.db.pooled_postgresql"
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["POOL"] = {
+        "min_size": env.int("DATABASE_POOL_MIN_SIZE", default=2),
+        "max_size": env.int("DATABASE_POOL_MAX_SIZE", default=10),
+        "max_lifetime": env.int("DATABASE_POOL_MAX_LIFETIME", default=60 * 30),
+        "timeout": env.float("DATABASE_POOL_TIMEOUT", default=10.0),
+        "check": env.bool("DATABASE_POOL_CHECK", default=True),
+    }
+
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,6 +172,12 @@ USE_TZ = True
 STATIC_URL = env("STATIC_URL", default="/static/")
 STATIC_ROOT = env("STATIC_ROOT", default="./staticfiles")
 
+# collectstatic writes content-hashed copies plus .gz/.br variants for nginx to serve.
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "meals.storage.CompressedManifestStaticFilesStorage"},
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field